@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
-from typing import Union, Tuple, List, Callable
+from array import array
+from collections.abc import MutableSequence
+from itertools import count
+from typing import Union, Tuple, List, Callable, Iterable, Iterator
 
+from timeseries import CurrentEstimator, TimeSeries
 from utils import logger
 import utils
+import json
 import logging
-import math
+import os
 from time import time
 from abc import ABC, abstractmethod
 import sys
 
+NAN = float("nan")
+
 
 class Protection(object):
     """
@@ -127,24 +134,391 @@ class History:
 
 class Cell:
     """
-    This class holds information about a single cell
+    This class holds information about a single cell.
+    Once the cell is added to the `CellStore` of a battery, its values are read from
+    and written to the arrays of the store.
 
-    :param voltage: float = the voltage of the cell in Volts
     :param balance: bool = the balance status of the cell
     """
 
-    voltage: float = None
+    __slots__ = ("_store", "_index", "_voltage", "_balance", "_temp")
+
+    def __init__(self, balance: bool = None):
+        self._store: CellStore = None
+        self._index: int = None
+        self._voltage: float = None
+        self._balance: bool = None
+        self._temp: float = None
+        self.balance = balance
+
+    @property
+    def voltage(self) -> Union[float, None]:
+        """
+        The voltage of a specific cell in Volts
+        """
+        if self._store is None:
+            return self._voltage
+        value = self._store.voltages[self._index]
+        return None if value != value else value
+
+    @voltage.setter
+    def voltage(self, value: Union[float, None]) -> None:
+        store = self._store
+        if store is None:
+            self._voltage = value
+        else:
+            store.voltages[self._index] = NAN if value is None else value
+            store.version = next(CellStore.version_counter)
+
+    @property
+    def balance(self) -> Union[bool, None]:
+        """
+        The balance status of a specific cell
+        """
+        if self._store is None:
+            return self._balance
+        value = self._store.balances[self._index]
+        return None if value < 0 else value == 1
+
+    @balance.setter
+    def balance(self, value: Union[bool, None]) -> None:
+        store = self._store
+        if store is None:
+            self._balance = value
+        else:
+            store.balances[self._index] = -1 if value is None else bool(value)
+            store.version = next(CellStore.version_counter)
+
+    @property
+    def temp(self) -> Union[float, None]:
+        """
+        The temperature of a specific cell in °C
+        """
+        if self._store is None:
+            return self._temp
+        value = self._store.temps[self._index]
+        return None if value != value else value
+
+    @temp.setter
+    def temp(self, value: Union[float, None]) -> None:
+        store = self._store
+        if store is None:
+            self._temp = value
+        else:
+            store.temps[self._index] = NAN if value is None else value
+            store.version = next(CellStore.version_counter)
+
+
+class CellStore(MutableSequence):
     """
-    The voltage of a specific cell in Volts
+    This class holds the values of all cells of a battery in contiguous arrays.
+    It behaves like a list of `Cell` objects, so that the drivers can still use
+    `self.cells.append(Cell(False))`, `self.cells[c].voltage = ...` and `len(self.cells)`.
+    Values that are not set are stored as NaN (voltage, temperature) or -1 (balance).
+
+    Values are stored as double, so the values published on D-Bus are exactly the same as with plain floats.
+
+    :param cells: Cells to add to the store
     """
 
-    balance: bool = None
+    version_counter = count()
     """
-    The balance status of a specific cell
+    Shared by all stores, so that a version is never used twice, even if the cells of a battery are replaced
     """
 
-    def __init__(self, balance: bool = None):
-        self.balance = balance
+    def __init__(self, cells: Iterable[Cell] = ()):
+        self.voltages = array("d")
+        self.balances = array("b")
+        self.temps = array("d")
+        self._cells: List[Cell] = []
+        self.version: int = next(self.version_counter)
+        """
+        Changed on every modification of the store, used to invalidate the cached `CellStats`
+        """
+        for cell in cells:
+            self.append(cell)
+
+    def touch(self) -> None:
+        """
+        Mark the store as modified
+        """
+        self.version = next(self.version_counter)
+
+    def _reindex(self) -> None:
+        for index, cell in enumerate(self._cells):
+            cell._index = index
+        self.touch()
+
+    @staticmethod
+    def _unbind(cell: Cell) -> None:
+        # keep the values in the cell, when it's removed from the store
+        cell._voltage, cell._balance, cell._temp = cell.voltage, cell.balance, cell.temp
+        cell._store = None
+        cell._index = None
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def __getitem__(self, index):
+        return self._cells[index]
+
+    def __iter__(self) -> Iterator[Cell]:
+        return iter(self._cells)
+
+    def __setitem__(self, index, cell: Cell) -> None:
+        if isinstance(index, slice):
+            raise TypeError("slice assignment is not supported, use set_voltages()")
+        if cell._store is not None:
+            cell = self._copy(cell)
+        if index < 0:
+            index += len(self)
+        self._unbind(self._cells[index])
+        self._cells[index] = cell
+        self._write(index, cell)
+
+    def __delitem__(self, index) -> None:
+        removed = self._cells[index]
+        for cell in removed if isinstance(index, slice) else [removed]:
+            self._unbind(cell)
+        del self.voltages[index]
+        del self.balances[index]
+        del self.temps[index]
+        del self._cells[index]
+        self._reindex()
+
+    def insert(self, index: int, cell: Cell) -> None:
+        if cell._store is not None:
+            cell = self._copy(cell)
+        # same index handling as list.insert()
+        index = min(max(index + len(self), 0) if index < 0 else index, len(self))
+        self.voltages.insert(index, NAN)
+        self.balances.insert(index, -1)
+        self.temps.insert(index, NAN)
+        self._cells.insert(index, cell)
+        if index < len(self) - 1:
+            self._reindex()
+        self._write(index, cell)
+
+    def _write(self, index: int, cell: Cell) -> None:
+        # move the values of an unbound cell into the arrays
+        voltage, balance, temp = cell._voltage, cell._balance, cell._temp
+        self.voltages[index] = NAN if voltage is None else voltage
+        self.balances[index] = -1 if balance is None else bool(balance)
+        self.temps[index] = NAN if temp is None else temp
+        cell._store = self
+        cell._index = index
+        self.touch()
+
+    @staticmethod
+    def _copy(cell: Cell) -> Cell:
+        # a cell can only be part of one store at a time
+        copy = Cell(cell.balance)
+        copy.voltage = cell.voltage
+        copy.temp = cell.temp
+        return copy
+
+    def clear(self) -> None:
+        for cell in self._cells:
+            self._unbind(cell)
+        del self.voltages[:]
+        del self.balances[:]
+        del self.temps[:]
+        self._cells.clear()
+        self.touch()
+
+    def resize(self, length: int, balance: bool = False) -> None:
+        """
+        Add or remove cells, so that the store holds `length` cells
+
+        :param length: The number of cells
+        :param balance: The balance status of added cells
+        """
+        while len(self) < length:
+            self.append(Cell(balance))
+        if len(self) > length:
+            del self[length:]
+
+    def set_voltages(
+        self, values: Iterable[float], divisor: float = 1, start: int = 0
+    ) -> None:
+        """
+        Set the voltages of consecutive cells at once, e.g. from a decoded frame.
+        The store is extended, if it holds less cells than needed.
+
+        :param values: The raw values
+        :param divisor: Divisor to convert the raw values to Volts, e.g. 1000 for millivolts
+        :param start: Index of the first cell
+        """
+        voltages = array(
+            "d", values if divisor == 1 else (value / divisor for value in values)
+        )
+        if start + len(voltages) > len(self):
+            self.resize(start + len(voltages))
+        self.voltages[start : start + len(voltages)] = voltages
+        self.touch()
+
+    def set_balances(self, values: Iterable[bool], start: int = 0) -> None:
+        """
+        Set the balance status of consecutive cells at once.
+        The store is extended, if it holds less cells than needed.
+
+        :param values: The balance states
+        :param start: Index of the first cell
+        """
+        balances = array(
+            "b", (-1 if value is None else bool(value) for value in values)
+        )
+        if start + len(balances) > len(self):
+            self.resize(start + len(balances))
+        self.balances[start : start + len(balances)] = balances
+        self.touch()
+
+    def set_temps(self, values: Iterable[float], start: int = 0) -> None:
+        """
+        Set the temperatures of consecutive cells at once.
+        The store is extended, if it holds less cells than needed.
+
+        :param values: The temperatures in °C
+        :param start: Index of the first cell
+        """
+        temps = array("d", (NAN if value is None else value for value in values))
+        if start + len(temps) > len(self):
+            self.resize(start + len(temps))
+        self.temps[start : start + len(temps)] = temps
+        self.touch()
+
+
+class CellStats:
+    """
+    This class holds the statistics of all cells, which are calculated once per change of the cells
+    instead of iterating over all cells in every getter
+
+    :param cells: The cells of the battery
+    :param cell_count: Number of cells of the battery
+    """
+
+    def __init__(self, cells: CellStore, cell_count: Union[int, None]):
+        count = len(cells) if cell_count is None else min(len(cells), cell_count)
+        voltages = cells.voltages
+        balances = cells.balances
+
+        self.min_cell: Union[int, None] = None
+        """
+        Index of the cell with the lowest voltage
+        """
+
+        self.max_cell: Union[int, None] = None
+        """
+        Index of the cell with the highest voltage
+        """
+
+        self.voltage_sum: float = 0
+        """
+        Sum of all cell voltages
+        """
+
+        self.balancing: int = 0
+        """
+        1 if at least one cell is balancing, else 0
+        """
+
+        self.balancing_mask: int = 0
+        """
+        Bit mask of the balancing cells, bit 0 is the first cell
+        """
+
+        min_voltage = 9999
+        max_voltage = 0
+        for c in range(count):
+            voltage = voltages[c]
+            # NaN means the voltage is not set
+            if voltage == voltage:
+                if min_voltage > voltage:
+                    min_voltage = voltage
+                    self.min_cell = c
+                if max_voltage < voltage:
+                    max_voltage = voltage
+                    self.max_cell = c
+                self.voltage_sum += voltage
+            if balances[c] == 1:
+                self.balancing_mask |= 1 << c
+        self.balancing = 1 if self.balancing_mask else 0
+
+        valid_voltages = [voltage for voltage in voltages if voltage == voltage]
+
+        self.min_voltage: Union[float, None] = (
+            min(valid_voltages) if valid_voltages else None
+        )
+        """
+        Lowest cell voltage
+        """
+
+        self.max_voltage: Union[float, None] = (
+            max(valid_voltages) if valid_voltages else None
+        )
+        """
+        Highest cell voltage
+        """
+
+        self.delta: Union[float, None] = (
+            self.max_voltage - self.min_voltage if valid_voltages else None
+        )
+        """
+        Difference between the highest and the lowest cell voltage
+        """
+
+        self.half1_voltage: Union[float, None] = None
+        """
+        Sum of the voltages of the first half of the cells, without the middle cell
+        """
+
+        self.half2_voltage: Union[float, None] = None
+        """
+        Sum of the voltages of the second half of the cells, without the middle cell
+        """
+
+        self.middle_voltage: Union[float, None] = None
+        """
+        Voltage of the middle cell, if the cell count is uneven
+        """
+
+        if cell_count is not None and cell_count > 0 and len(cells) == cell_count:
+            halfcount = cell_count // 2
+            uneven_cells_offset = cell_count % 2
+            self.half1_voltage = sum(
+                voltage for voltage in voltages[:halfcount] if voltage == voltage
+            )
+            self.half2_voltage = sum(
+                voltage
+                for voltage in voltages[halfcount + uneven_cells_offset :]
+                if voltage == voltage
+            )
+            if uneven_cells_offset:
+                self.middle_voltage = cells[halfcount].voltage
+
+
+class ReadTier:
+    """
+    Rate at which a group of data is read from the BMS.
+    Data that changes slowly (settings, device info, history) does not need to be read every poll.
+    """
+
+    FAST = "Fast"
+    """
+    Every poll, e.g. current, voltage, cell voltages
+    """
+
+    MEDIUM = "Medium"
+    """
+    Every `POLL_TIER_MEDIUM_INTERVAL` seconds, e.g. temperatures, history
+    """
+
+    SLOW = "Slow"
+    """
+    Every `POLL_TIER_SLOW_INTERVAL` seconds, e.g. settings, device info
+    """
+
+    ALL = (FAST, MEDIUM, SLOW)
 
 
 class Battery(ABC):
@@ -154,6 +528,12 @@ class Battery(ABC):
     use the individual implementations as type Battery and work with it.
     """
 
+    READ_SCHEDULE: Tuple[Tuple[str, str], ...] = ()
+    """
+    Read methods of the driver with the `ReadTier` they belong to, in the order `run_read_schedule()` calls them.
+    Each method returns True on success, e.g. `(("read_cell_data", ReadTier.FAST), ("read_settings", ReadTier.SLOW))`
+    """
+
     def __init__(self, port: str, baud: int, address: str):
         self.port: str = port
         self.baud_rate: int = baud
@@ -161,6 +541,19 @@ class Battery(ABC):
         self.role: str = "battery"
         self.type: str = "Generic"
         self.poll_interval: int = 1000
+        self.tiers_due: Tuple[str, ...] = ReadTier.ALL
+        """
+        Read tiers that are due in this poll, set by the scheduler before `refresh_data()` is called
+        """
+        self.tiers_read: Tuple[str, ...] = None
+        """
+        Due tiers, whose read methods were all successful in the last poll, set by `run_read_schedule()`.
+        None if the driver does not use a read schedule
+        """
+        self.transactions_last_cycle: int = None
+        """
+        Number of requests sent to the BMS in the last poll, None if the driver does not count them
+        """
         self.online: bool = True
         self.hardware_version: str = None
         self.cell_count: int = None
@@ -200,8 +593,26 @@ class Battery(ABC):
         Custom field that the user can define in the BMS settings via the BMS app
         """
 
+        self.current_estimator: CurrentEstimator = None
+        self.current_profile_loaded: bool = False
+        """
+        If the learned current profile was loaded from `utils.PATH_CURRENT_PROFILE`
+        """
+
         self.init_values()
 
+    @property
+    def cells(self) -> CellStore:
+        """
+        The cells of the battery
+        """
+        return self._cells
+
+    @cells.setter
+    def cells(self, cells: Iterable[Cell]) -> None:
+        # drivers assign lists of cells, store them in a `CellStore`
+        self._cells = cells if isinstance(cells, CellStore) else CellStore(cells)
+
     def init_values(self) -> None:
         """
         Used to initialize and reset values, if battery unexpectly disconnects
@@ -211,7 +622,24 @@ class Battery(ABC):
         self.voltage: float = None
         self.current: float = None
         self.current_avg: float = None
-        self.current_avg_lst: list = []
+        self.timeseries: TimeSeries = TimeSeries()
+        """
+        History of the battery values, see `add_timeseries_sample()`
+        """
+        # keep the learned profile, when the values are reset after a disconnect
+        self.current_estimator: CurrentEstimator = CurrentEstimator(
+            self.timeseries,
+            utils.TIME_TO_GO_CURRENT_MODE,
+            utils.TIME_TO_GO_CURRENT_WINDOW,
+            (
+                self.current_estimator.profile
+                if self.current_estimator is not None
+                else None
+            ),
+        )
+        """
+        Average current for Time-To-Go and Time-To-SoC
+        """
         self.current_corrected: float = None
         self.current_external: float = None
         self.capacity_remain: float = None
@@ -227,7 +655,9 @@ class Battery(ABC):
         self.temp3: float = None
         self.temp4: float = None
         self.temp_mos: float = None
-        self.cells: List[Cell] = []
+        self.cells = []
+        self._cell_stats: CellStats = None
+        self._cell_stats_key: tuple = None
         self.control_voltage: float = None
         self.soc_reset_requested: bool = False
         self.soc_reset_last_reached: int = 0  # save state to preserve on restart
@@ -335,6 +765,49 @@ class Battery(ABC):
         """
         return False
 
+    def tier_due(self, tier: str) -> bool:
+        """
+        Check if the data of a read tier has to be read in this poll
+
+        :param tier: One of the `ReadTier` values
+        :return: True if the data has to be read
+        """
+        return tier in self.tiers_due
+
+    def run_read_schedule(self, *args, stop_on_failure: bool = True) -> bool:
+        """
+        Call the read methods of `READ_SCHEDULE`, whose tier is due in this poll.
+        Drivers call this from `refresh_data()`, all methods are called, if the driver is not polled by the scheduler.
+
+        :param args: Passed to each read method, e.g. the open serial port
+        :param stop_on_failure: Skip the remaining methods after a method failed, else read the other data anyway
+        :return: True if all called methods were successful
+        """
+        result = True
+        failed = set()
+        for method, tier in self.READ_SCHEDULE:
+            if tier not in self.tiers_due:
+                continue
+            if failed and stop_on_failure:
+                # the remaining methods are skipped, so their tiers are not read
+                failed.add(tier)
+                continue
+
+            time_start = time()
+            method_result = getattr(self, method)(*args)
+            runtime = time() - time_start
+            if runtime > 0.200:  # TROUBLESHOOTING for no reply errors
+                logger.debug(
+                    f"  |- refresh_data: {method} - result: {method_result} - runtime: {runtime:.1f}s"
+                )
+
+            if not method_result:
+                result = False
+                failed.add(tier)
+
+        self.tiers_read = tuple(tier for tier in self.tiers_due if tier not in failed)
+        return result
+
     @abstractmethod
     def get_settings(self) -> bool:
         """
@@ -1580,19 +2053,10 @@ class Battery(ABC):
 
         :return: The number of the cell with the lowest voltage
         """
-        min_voltage = 9999
-        min_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_min_no"):
             return self.cell_min_no
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and min_voltage > self.cells[c].voltage
-            ):
-                min_voltage = self.cells[c].voltage
-                min_cell = c
-        return min_cell
+        return self.get_cell_stats().min_cell
 
     def get_max_cell(self) -> int:
         """
@@ -1600,19 +2064,10 @@ class Battery(ABC):
 
         :return: The number of the cell with the highest voltage
         """
-        max_voltage = 0
-        max_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_max_no"):
             return self.cell_max_no
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and max_voltage < self.cells[c].voltage
-            ):
-                max_voltage = self.cells[c].voltage
-                max_cell = c
-        return max_cell
+        return self.get_cell_stats().max_cell
 
     def get_min_cell_desc(self) -> Union[str, None]:
         """
@@ -1649,12 +2104,7 @@ class Battery(ABC):
 
         :return: The sum of all cell voltages
         """
-        voltage_sum = 0
-        for i in range(self.cell_count):
-            voltage = self.get_cell_voltage(i)
-            if voltage:
-                voltage_sum += voltage
-        return voltage_sum
+        return self.get_cell_stats().voltage_sum
 
     def get_cell_balancing(self, idx: int) -> Union[int, None]:
         """
@@ -1712,7 +2162,16 @@ class Battery(ABC):
             and percent_per_second != 0
             and (soc_diff > 0 or utils.TIME_TO_SOC_INC_FROM is True)
         ):
-            seconds_to_go = int(soc_diff / percent_per_second)
+            if utils.TIME_TO_GO_CURRENT_MODE == "profile":
+                # predict with the learned load profile instead of a constant current
+                seconds_to_go = self.current_estimator.predict_seconds(
+                    (soc_target - self.soc_calc) / 100 * self.capacity, time()
+                )
+                if seconds_to_go is None:
+                    return None
+                seconds_to_go = int(abs(seconds_to_go))
+            else:
+                seconds_to_go = int(soc_diff / percent_per_second)
             time_to_go_str = ""
 
             if only_number or utils.TIME_TO_SOC_VALUE_TYPE & 1:
@@ -1770,12 +2229,7 @@ class Battery(ABC):
             min_voltage = self.cell_min_voltage
 
         if min_voltage is None:
-            try:
-                min_voltage = min(
-                    c.voltage for c in self.cells if c.voltage is not None
-                )
-            except ValueError:
-                pass
+            min_voltage = self.get_cell_stats().min_voltage
         return min_voltage
 
     def get_max_cell_voltage(self) -> Union[float, None]:
@@ -1784,12 +2238,7 @@ class Battery(ABC):
             max_voltage = self.cell_max_voltage
 
         if max_voltage is None:
-            try:
-                max_voltage = max(
-                    c.voltage for c in self.cells if c.voltage is not None
-                )
-            except ValueError:
-                pass
+            max_voltage = self.get_cell_stats().max_voltage
         return max_voltage
 
     def get_midvoltage(self) -> Tuple[Union[float, None], Union[float, None]]:
@@ -1808,27 +2257,12 @@ class Battery(ABC):
         ):
             return None, None
 
-        halfcount = int(math.floor(self.cell_count / 2))
-        uneven_cells_offset = self.cell_count % 2
-        half1voltage = 0
-        half2voltage = 0
-
-        try:
-            half1voltage = sum(
-                cell.voltage
-                for cell in self.cells[:halfcount]
-                if cell.voltage is not None
-            )
-            half2voltage = sum(
-                cell.voltage
-                for cell in self.cells[halfcount + uneven_cells_offset :]
-                if cell.voltage is not None
-            )
-        except ValueError:
-            pass
+        cell_stats = self.get_cell_stats()
+        half1voltage = cell_stats.half1_voltage
+        half2voltage = cell_stats.half2_voltage
 
         try:
-            extra = 0 if self.cell_count % 2 == 0 else self.cells[halfcount].voltage / 2
+            extra = 0 if self.cell_count % 2 == 0 else cell_stats.middle_voltage / 2
             # get the midpoint of the battery
             midpoint = half1voltage + extra
             return (
@@ -1841,10 +2275,20 @@ class Battery(ABC):
             return None, None
 
     def get_balancing(self) -> int:
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].balance is not None and self.cells[c].balance:
-                return 1
-        return 0
+        return self.get_cell_stats().balancing
+
+    def get_cell_stats(self) -> CellStats:
+        """
+        Get the statistics of all cells. They are calculated only once after the cells changed
+        and shared by all cell getters.
+
+        :return: The cell statistics
+        """
+        key = (self.cells.version, self.cell_count)
+        if self._cell_stats is None or self._cell_stats_key != key:
+            self._cell_stats = CellStats(self.cells, self.cell_count)
+            self._cell_stats_key = key
+        return self._cell_stats
 
     def get_temp(self) -> Union[float, None]:
         try:
@@ -2049,16 +2493,113 @@ class Battery(ABC):
             return self.current_external
         return self.current
 
+    def load_current_profile(self) -> bool:
+        """
+        Load the learned hourly current profile of this battery from `utils.PATH_CURRENT_PROFILE`.
+
+        :return: True, if a profile was found
+        """
+        try:
+            with open(utils.PATH_CURRENT_PROFILE, "r") as file:
+                profiles = json.load(file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(
+                f"Could not read the current profile {utils.PATH_CURRENT_PROFILE}: {e}"
+            )
+            return False
+
+        profile = (
+            profiles.get(self.unique_identifier())
+            if isinstance(profiles, dict)
+            else None
+        )
+        if not isinstance(profile, list) or len(profile) != 24:
+            return False
+
+        # only fill hours that were not learned since the start
+        for hour, value in enumerate(profile):
+            if self.current_estimator.profile[hour] is None and isinstance(
+                value, (int, float)
+            ):
+                self.current_estimator.profile[hour] = float(value)
+        logger.info("Loaded the learned current profile")
+        return True
+
+    def save_current_profile(self) -> None:
+        """
+        Save the learned hourly current profile of this battery to `utils.PATH_CURRENT_PROFILE`.
+        Called once per hour, the profiles of other batteries in the file are kept.
+
+        :return: None
+        """
+        try:
+            with open(utils.PATH_CURRENT_PROFILE, "r") as file:
+                profiles = json.load(file)
+            if not isinstance(profiles, dict):
+                profiles = {}
+        except (OSError, ValueError):
+            profiles = {}
+
+        profiles[self.unique_identifier()] = self.current_estimator.profile
+
+        # write to a temporary file first, so that a power loss does not leave a broken file
+        file_path_tmp = utils.PATH_CURRENT_PROFILE + ".tmp"
+        try:
+            with open(file_path_tmp, "w") as file:
+                json.dump(profiles, file, indent=4, sort_keys=True)
+            os.replace(file_path_tmp, utils.PATH_CURRENT_PROFILE)
+        except OSError as e:
+            logger.warning(
+                f"Could not write the current profile {utils.PATH_CURRENT_PROFILE}: {e}"
+            )
+
+    def add_timeseries_sample(self) -> None:
+        """
+        Add the current values of the battery to the time series. Called once per poll cycle.
+
+        :return: None
+        """
+        timestamp = time()
+        current = self.get_current()
+        if (
+            utils.TIME_TO_GO_CURRENT_MODE == "profile"
+            and not self.current_profile_loaded
+        ):
+            # load it on the first sample, since the unique identifier is only known after the battery was read
+            self.load_current_profile()
+            self.current_profile_loaded = True
+        self.current_estimator.update(timestamp, current)
+        if self.current_estimator.profile_changed:
+            self.current_estimator.profile_changed = False
+            self.save_current_profile()
+        self.timeseries.add(
+            timestamp,
+            voltage=self.voltage,
+            current=current,
+            soc=self.soc_calc if utils.SOC_CALCULATION else self.soc,
+            min_cell_voltage=self.get_min_cell_voltage(),
+            max_cell_voltage=self.get_max_cell_voltage(),
+            temperature=self.get_temp(),
+            min_temperature=self.get_min_temp(),
+            max_temperature=self.get_max_temp(),
+            charge_current_limit=self.control_charge_current,
+            discharge_current_limit=self.control_discharge_current,
+        )
+
     def log_cell_data(self) -> bool:
-        if logger.getEffectiveLevel() > logging.INFO and len(self.cells) == 0:
+        # called every poll, do not format the cells, if the message is not logged anyway
+        if not logger.isEnabledFor(logging.DEBUG) or len(self.cells) == 0:
             return False
 
-        cell_res = ""
-        cell_counter = 1
-        for c in self.cells:
-            cell_res += "[{0}]{1}V ".format(cell_counter, c.voltage)
-            cell_counter = cell_counter + 1
-        logger.debug("Cells:" + cell_res)
+        logger.debug(
+            "Cells:%s",
+            "".join(
+                f"[{index}]{cell.voltage}V "
+                for index, cell in enumerate(self.cells, start=1)
+            ),
+        )
         return True
 
     def log_settings(self) -> None:
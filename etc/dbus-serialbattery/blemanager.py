@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import re
+import sys
+import threading
+from time import sleep, time
+from typing import Coroutine, Dict, List, Optional, Set
+
+from bleak import BleakClient, BleakScanner, BLEDevice
+from bleak.exc import BleakDBusError
+
+from utils import (
+    BLUETOOTH_MAX_CONNECTIONS,
+    BLUETOOTH_SCAN_TIMEOUT,
+    BLUETOOTH_SLOT_TIME,
+    logger,
+)
+
+# longest time in seconds a device or the adapter waits before the next try
+BACKOFF_MAX = 60
+# consecutive adapter errors, after which the Bluetooth stack is restarted
+RESET_AFTER_ERRORS = 5
+# minimum time in seconds between two restarts of the Bluetooth stack
+RESET_MIN_INTERVAL = 300
+# time in seconds the adapter needs after a restart, before it can scan and connect again
+RESET_RECOVERY_TIME = 5
+# command line of hciattach, saved to restore it after the hci_uart module was reloaded
+HCIATTACH_COMMAND_FILE = "/tmp/dbus-blebattery-hciattach"
+
+
+# BlueZ errors, that are caused by a single device, e.g. it went out of range or is connected elsewhere
+DEVICE_DBUS_ERRORS = {
+    "org.bluez.Error.AlreadyConnected",
+    "org.bluez.Error.DoesNotExist",
+    "org.bluez.Error.InProgress",
+    "org.bluez.Error.NotConnected",
+    "org.freedesktop.DBus.Error.UnknownObject",
+}
+# details of the generic org.bluez.Error.Failed, that are caused by a single device
+DEVICE_ERROR_DETAILS = (
+    "le-connection-abort",
+    "br-connection",
+    "Software caused connection abort",
+    "not found",
+)
+
+
+def is_adapter_error(error: BaseException) -> bool:
+    """
+    Check if an exception is caused by the Bluetooth adapter or BlueZ and not by a single device.
+    These errors affect all connections, therefore all devices back off together.
+
+    :param error: The exception
+    :return: True if it is an adapter error
+    """
+    if "Bluetooth adapters" in repr(error):
+        return True
+    if not isinstance(error, BleakDBusError):
+        return False
+    if error.dbus_error in DEVICE_DBUS_ERRORS:
+        return False
+    details = error.dbus_error_details or ""
+    return not any(detail in details for detail in DEVICE_ERROR_DETAILS)
+
+
+def save_hciattach_command() -> None:
+    """
+    Save the command line of hciattach on the first start, or run the saved command line,
+    if hciattach is not running anymore
+    """
+    process_list = os.popen("ps -ww | grep hciattach | grep -v grep").read()
+    if not os.path.isfile(HCIATTACH_COMMAND_FILE):
+        command = re.search("/usr/bin/hciattach.+", process_list)
+        if command is not None:
+            with open(HCIATTACH_COMMAND_FILE, "w") as file:
+                file.write(command.group())
+    elif not process_list:
+        with open(HCIATTACH_COMMAND_FILE, "r") as file:
+            os.system(file.readline())
+
+
+def restart_bluetooth(reload_hci_uart: bool = False) -> None:
+    """
+    Restart the system Bluetooth daemon. Blocks for some seconds.
+
+    :param reload_hci_uart: Also reload the kernel modules of the built in adapter,
+        needed if the adapter disappeared
+    """
+    if reload_hci_uart:
+        os.system("pkill -f 'hciattach'")
+        sleep(0.5)
+        os.system("rmmod hci_uart")
+        os.system("rmmod btbcm")
+        os.system("modprobe hci_uart")
+        os.system("modprobe btbcm")
+        if os.path.isfile(HCIATTACH_COMMAND_FILE):
+            with open(HCIATTACH_COMMAND_FILE, "r") as file:
+                os.system(file.readline())
+            sleep(0.5)
+
+    # process kill is needed, since the service/bluetooth driver is probably freezed
+    os.system('pkill -f "bluetoothd"')
+    # stop will not work, if service/bluetooth driver is stuck
+    # os.system("/etc/init.d/bluetooth stop")
+    sleep(2)
+    os.system("rfkill block bluetooth")
+    os.system("rfkill unblock bluetooth")
+    os.system("/etc/init.d/bluetooth start")
+
+
+class BleManager:
+    """
+    Owns the Bluetooth adapter for all BLE batteries of the process.
+
+    All connections run as coroutines in one thread with an asyncio event loop, instead of one thread
+    and event loop per battery. The manager
+
+    - scans once for all registered addresses and passes each device to its battery as soon as it was seen
+    - connects one device after another and limits the simultaneous connections to `max_connections`,
+      if more devices are waiting, the connected devices hand over their slot after `slot_time` seconds
+    - backs off on errors, per device on device errors and for all devices on adapter errors,
+      and restarts the Bluetooth stack once for all devices, if the adapter does not recover
+    """
+
+    def __init__(
+        self,
+        max_connections: int = BLUETOOTH_MAX_CONNECTIONS,
+        slot_time: float = BLUETOOTH_SLOT_TIME,
+        scan_timeout: float = BLUETOOTH_SCAN_TIMEOUT,
+    ):
+        """
+        :param max_connections: Maximum number of simultaneous connections
+        :param slot_time: Time in seconds a device keeps its connection, while other devices wait for a slot
+        :param scan_timeout: Time in seconds to scan for the registered devices
+        """
+        self.max_connections = max(max_connections, 1)
+        self.slot_time = slot_time
+        self.scan_timeout = scan_timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="BleManager", daemon=True)
+
+        self.wanted: Set[str] = set()
+        """
+        Addresses of the registered devices, a scan looks for all of them at once
+        """
+        self.devices: Dict[str, BLEDevice] = {}
+        """
+        Devices found by the last scans, by address
+        """
+        self._device_waiters: Dict[str, List[asyncio.Future]] = {}
+        self._scan_task: Optional[asyncio.Task] = None
+
+        self.clients: Dict[str, BleakClient] = {}
+        """
+        Connected clients, by address
+        """
+        self.slots: Dict[str, float] = {}
+        """
+        Time a device got its connection slot, by address
+        """
+        self.slots_waiting = 0
+        self.handed_over: Set[str] = set()
+        """
+        Addresses of the devices, that disconnected to hand over their slot and wait for their next turn
+        """
+        self.failures: Dict[str, int] = {}
+        """
+        Failed connection attempts in a row, by address
+        """
+        self.adapter_errors = 0
+        """
+        Adapter errors in a row, over all devices
+        """
+        self.adapter_missing = False
+        self.resume_time = 0.0
+        """
+        No scans and connections are started before this time, while the adapter backs off
+        """
+        self.resetting = False
+        self.last_reset = 0.0
+
+        # created in the thread of the event loop, since Python < 3.10 binds them to the current loop
+        self._slot_semaphore: Optional[asyncio.Semaphore] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+
+    def start(self) -> None:
+        save_hciattach_command()
+        self.thread.start()
+        logger.debug("Started BLE manager thread")
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self._slot_semaphore = asyncio.Semaphore(self.max_connections)
+        self._connect_lock = asyncio.Lock()
+        self.loop.run_forever()
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        Disconnect all devices and stop the event loop
+
+        :param timeout: Time in seconds to wait for the disconnects
+        """
+        if not self.thread.is_alive():
+            return
+        try:
+            self.submit(self.disconnect_all()).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """
+        Run a coroutine in the BLE thread. Can be called from any thread.
+
+        :param coroutine: Coroutine to run
+        :return: Future with the result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def register(self, address: str) -> None:
+        """
+        Register a device, before its battery connects. A scan looks for all registered devices at once,
+        therefore register all devices before the first battery connects.
+
+        :param address: MAC address of the device
+        """
+        self.wanted.add(address.upper())
+
+    async def find_device(self, address: str) -> Optional[BLEDevice]:
+        """
+        Get a device from the last scans or join the running scan until the device was seen
+
+        :param address: MAC address of the device
+        :return: The device or None, if it was not found
+        """
+        address = address.upper()
+        self.wanted.add(address)
+        device = self.devices.get(address)
+        if device is not None:
+            return device
+
+        if self._scan_task is None or self._scan_task.done():
+            self._scan_task = self.loop.create_task(self.scan())
+        found = self.loop.create_future()
+        self._device_waiters.setdefault(address, []).append(found)
+        try:
+            await asyncio.wait(
+                {self._scan_task, found}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            if (
+                address in self._device_waiters
+                and found in self._device_waiters[address]
+            ):
+                self._device_waiters[address].remove(found)
+        return self.devices.get(address)
+
+    async def scan(self) -> None:
+        """
+        Scan for all registered devices, which were not found yet.
+        The scan ends as soon as all of them were seen or after `scan_timeout` seconds.
+        """
+        missing = {address for address in self.wanted if address not in self.devices}
+        if not missing:
+            return
+        await self.wait_adapter()
+
+        complete = asyncio.Event()
+
+        def on_detection(device: BLEDevice, advertisement_data) -> None:
+            address = device.address.upper()
+            if address not in missing:
+                return
+            missing.discard(address)
+            self.devices[address] = device
+            for waiter in self._device_waiters.pop(address, ()):
+                if not waiter.done():
+                    waiter.set_result(device)
+            if not missing:
+                complete.set()
+
+        time_start = time()
+        try:
+            async with BleakScanner(detection_callback=on_detection):
+                try:
+                    await asyncio.wait_for(complete.wait(), self.scan_timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        except Exception:
+            exception_type, exception_object, exception_traceback = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(
+                f"BleakScanner(): Exception occurred: {repr(exception_object)} of type {exception_type} "
+                f"in {file} line #{line}"
+            )
+            self.report_error(None, exception_object)
+            return
+
+        logger.info(
+            f"BLE scan finished after {time() - time_start:.1f} s"
+            + (", not found: " + ", ".join(sorted(missing)) if missing else "")
+        )
+
+    async def acquire_slot(self, address: str) -> None:
+        """
+        Wait for a free connection slot. The slots are given out in the order they were requested.
+
+        :param address: MAC address of the device
+        """
+        self.slots_waiting += 1
+        try:
+            await self._slot_semaphore.acquire()
+        finally:
+            self.slots_waiting -= 1
+        self.slots[address.upper()] = time()
+
+    def release_slot(self, address: str) -> None:
+        """
+        Give the connection slot of a device back, after it was disconnected
+
+        :param address: MAC address of the device
+        """
+        self.clients.pop(address.upper(), None)
+        if self.slots.pop(address.upper(), None) is not None:
+            self._slot_semaphore.release()
+
+    def slot_expired(self, address: str) -> bool:
+        """
+        Check if a connected device should hand over its slot, since other devices are waiting for one
+
+        :param address: MAC address of the device
+        :return: True if the device should disconnect
+        """
+        slot_start = self.slots.get(address.upper())
+        return (
+            self.slots_waiting > 0
+            and slot_start is not None
+            and time() - slot_start >= self.slot_time
+        )
+
+    def hand_over_slot(self, address: str) -> None:
+        """
+        Mark a device, that disconnects to hand over its slot to a waiting device.
+        Until it is connected again, `waiting_for_slot()` is True for it.
+
+        :param address: MAC address of the device
+        """
+        self.handed_over.add(address.upper())
+
+    def waiting_for_slot(self, address: str) -> bool:
+        """
+        Check if a device handed over its slot and waits for its next turn. Its data gets older than usual,
+        but the device is not failing. Can be called from any thread.
+
+        :param address: MAC address of the device
+        :return: True while the device waits for its next turn
+        """
+        return address.upper() in self.handed_over
+
+    async def connect(self, address: str, client: BleakClient) -> None:
+        """
+        Connect a client, one connection attempt at a time, since BlueZ rejects simultaneous attempts.
+        The device needs a slot, see `acquire_slot()`.
+
+        :param address: MAC address of the device
+        :param client: The client of the device
+        """
+        async with self._connect_lock:
+            await self.wait_adapter()
+            await client.connect()
+        self.clients[address.upper()] = client
+        self.failures[address.upper()] = 0
+        self.handed_over.discard(address.upper())
+        self.adapter_errors = 0
+        self.adapter_missing = False
+
+    async def disconnect_all(self) -> None:
+        for client in list(self.clients.values()):
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+
+    def report_error(
+        self, address: Optional[str], error: Optional[BaseException] = None
+    ) -> None:
+        """
+        Count a failed scan or connection. Must be called in the BLE thread.
+
+        :param address: MAC address of the device or None, if the error is not related to a device
+        :param error: The exception, None if the device was not found
+        """
+        if address is not None:
+            address = address.upper()
+            self.failures[address] = self.failures.get(address, 0) + 1
+            # the device is failing, not only waiting for its turn
+            self.handed_over.discard(address)
+
+        if error is None or not is_adapter_error(error):
+            # the device could have changed, e.g. its address type, scan for it again
+            if address is not None:
+                self.devices.pop(address, None)
+            return
+
+        self.adapter_errors += 1
+        if "Bluetooth adapters" in repr(error):
+            self.adapter_missing = True
+        delay = min(BACKOFF_MAX, 2 ** (self.adapter_errors - 1))
+        self.resume_time = max(self.resume_time, time() + delay)
+        logger.warning(
+            f"Bluetooth adapter error {self.adapter_errors} in a row, pausing all BLE connections for {delay} s"
+        )
+
+        if self.adapter_errors >= RESET_AFTER_ERRORS:
+            self.loop.create_task(
+                self.reset_adapter(f"{self.adapter_errors} adapter errors in a row")
+            )
+
+    async def wait_adapter(self) -> None:
+        """
+        Wait while the adapter backs off or is restarted
+        """
+        while self.resetting or self.resume_time > time():
+            await asyncio.sleep(max(self.resume_time - time(), 0.5))
+
+    async def wait_retry(self, address: str) -> None:
+        """
+        Wait before the next connection attempt of a device, the delay doubles with each failed attempt
+
+        :param address: MAC address of the device
+        """
+        failures = self.failures.get(address.upper(), 0)
+        if failures:
+            await asyncio.sleep(min(BACKOFF_MAX, 2 ** (failures - 1)))
+        await self.wait_adapter()
+
+    async def reset_adapter(self, reason: str) -> bool:
+        """
+        Restart the Bluetooth stack for all devices. Only one restart runs at a time
+        and restarts are at least `RESET_MIN_INTERVAL` seconds apart.
+
+        :param reason: Logged with the restart
+        :return: True if the Bluetooth stack was restarted
+        """
+        if self.resetting or time() - self.last_reset < RESET_MIN_INTERVAL:
+            logger.debug("Restart of the Bluetooth stack skipped: %s", reason)
+            return False
+
+        logger.error(
+            f"Restarting the Bluetooth stack for all BLE batteries, reason: {reason}"
+        )
+        self.resetting = True
+        self.last_reset = time()
+        try:
+            await self.loop.run_in_executor(
+                None, restart_bluetooth, self.adapter_missing
+            )
+        finally:
+            self.devices.clear()
+            self.adapter_errors = 0
+            self.adapter_missing = False
+            self.resume_time = time() + RESET_RECOVERY_TIME
+            self.resetting = False
+        logger.error("System Bluetooth daemon should have been restarted")
+        return True
+
+
+_ble_manager: Optional[BleManager] = None
+
+
+def get_ble_manager() -> BleManager:
+    """
+    Get the BLE manager of the process, it is started on the first call
+
+    :return: The BLE manager
+    """
+    global _ble_manager
+    if _ble_manager is None:
+        _ble_manager = BleManager()
+        _ble_manager.start()
+        atexit.register(_ble_manager.stop)
+    return _ble_manager
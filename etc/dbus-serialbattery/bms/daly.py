@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
-from battery import Battery, Cell
-from utils import open_serial_port, logger
+from battery import Battery, Cell, ReadTier
+from utils import serial_port_pool, logger
 import utils
 from struct import unpack_from, pack_into
 from time import sleep, time
@@ -55,6 +55,16 @@ class Daly(Battery):
     command_disable_discharge_mos = b"\xD9"
     command_disable_charge_mos = b"\xDA"
 
+    READ_SCHEDULE = (
+        ("read_soc_data", ReadTier.FAST),
+        ("read_fed_data", ReadTier.FAST),
+        ("read_cell_voltage_range_data", ReadTier.FAST),
+        ("read_alarm_data", ReadTier.FAST),
+        ("read_cells_volts", ReadTier.FAST),
+        ("read_temperature_range_data", ReadTier.MEDIUM),
+        ("read_balance_state", ReadTier.MEDIUM),
+    )
+
     BATTERYTYPE = "Daly"
     LENGTH_CHECK = 1
     LENGTH_POS = 3
@@ -69,7 +79,7 @@ class Daly(Battery):
         """
         result = False
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with serial_port_pool.acquire(self.port, self.baud_rate) as ser:
                 result = self.read_status_data(ser)
                 # get first data to show in startup log, only if result is true
                 result = result and self.read_soc_data(ser)
@@ -107,93 +117,12 @@ class Daly(Battery):
 
         # Open serial port to be used for all data reads instead of opening multiple times
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
-                result = self.read_soc_data(ser)
+            with serial_port_pool.acquire(self.port, self.baud_rate) as ser:
+                # all data is read anyway, even if a request failed
+                result = self.run_read_schedule(ser, stop_on_failure=False)
                 self.reset_soc = self.soc if self.soc else 0
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: read_soc_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_fed_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: read_fed_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_cell_voltage_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: read_cell_voltage_range_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
 
                 self.write_soc_and_datetime(ser)
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: write_soc_and_datetime - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_alarm_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: read_alarm_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_temperature_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: read_temperature_range_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_balance_state(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: read_balance_state - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                # result placed last to ensure all data is read anyway
-                result = self.read_cells_volts(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.debug(
-                        "  |- refresh_data: read_cells_volts - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
 
                 self.write_charge_discharge_mos(ser)
 
@@ -726,6 +655,8 @@ class Daly(Battery):
         ser.flushOutput()
         ser.flushInput()
         ser.write(self.generate_command(command))
+        if utils.frame_trace.enabled:
+            utils.frame_trace.add(self.port, "tx", self.generate_command(command))
 
         reply = bytearray()
         for i in range(sentences_to_receive):
@@ -747,24 +678,26 @@ class Daly(Battery):
         reply = ser.read_until(b"\xA5")
         if not reply or b"\xA5" not in reply:
             logger.debug(
-                f"read_sentence {utils.bytearray_to_string(expected_reply)}: no sentence start received"
+                "read_sentence %s: no sentence start received",
+                utils.HexDump(expected_reply),
             )
             return False
 
         idx = reply.index(b"\xA5")
         reply = reply[idx:]
-        toread = ser.inWaiting()
-        while toread < 12:
-            sleep((12 - toread) * 0.001)
-            toread = ser.inWaiting()
-            time_run = time() - time_start
-            if time_run > timeout:
-                logger.debug(
-                    f"read_sentence {utils.bytearray_to_string(expected_reply)}: timeout"
-                )
+        # block on the port until the rest of the sentence arrived, instead of polling the input buffer
+        wakeups = 1
+        while len(reply) < 13:
+            if time() - time_start > timeout:
+                utils.serial_stats.add(wakeups, len(reply), time() - time_start)
+                logger.debug("read_sentence %s: timeout", utils.HexDump(expected_reply))
                 return False
+            reply += ser.read(13 - len(reply))
+            wakeups += 1
 
-        reply += ser.read(12)
+        utils.serial_stats.add(wakeups, len(reply), time() - time_start)
+        if utils.frame_trace.enabled:
+            utils.frame_trace.add(self.port, "rx", reply)
         try:
             _, id, cmd, length = unpack_from(">BBBB", reply)
         except Exception:
@@ -774,14 +707,14 @@ class Daly(Battery):
 
         if id != 1 or length != 8 or cmd != expected_reply[0]:
             logger.debug(
-                f"read_sentence {utils.bytearray_to_string(expected_reply)}: wrong header"
+                "read_sentence %s: wrong header", utils.HexDump(expected_reply)
             )
             return False
 
         chk = unpack_from(">B", reply, 12)[0]
         if sum(reply[:12]) & 0xFF != chk:
             logger.debug(
-                f"read_sentence {utils.bytearray_to_string(expected_reply)}: wrong checksum"
+                "read_sentence %s: wrong checksum", utils.HexDump(expected_reply)
             )
             return False
 
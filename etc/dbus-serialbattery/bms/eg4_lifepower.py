@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 from battery import Battery, Cell
+from decoding import unpack_array
 from utils import read_serial_data, logger
 import utils
-from struct import unpack_from
 import re
 import sys
 
@@ -100,15 +100,10 @@ class EG4_Lifepower(Battery):
             # So the first group might be:
             # 01 02 0a 0b 0c 0d
             group_len = status_data[i + 1]
-            end = i + 2 + (group_len * 2)
-            group_payload = status_data[i + 2 : end]
-            groups.append(
-                [
-                    unpack_from(">H", group_payload, i)[0]
-                    for i in range(0, len(group_payload), 2)
-                ]
-            )
-            i = end
+            # a truncated group contains only the complete values
+            count = max(min(group_len, (len(status_data) - i - 2) // 2), 0)
+            groups.append(unpack_array(status_data, count, i + 2))
+            i += 2 + (group_len * 2)
 
         # Cells
         self.cell_count = len(groups[0])
@@ -116,11 +111,10 @@ class EG4_Lifepower(Battery):
         self.min_battery_voltage = utils.MIN_CELL_VOLTAGE * self.cell_count
 
         self.cells = [Cell(True) for _ in range(0, self.cell_count)]
-        for i, cell in enumerate(self.cells):
-            # there is a situation where the MSB bit of the high byte may come set
-            # I got that when I got a high voltage alarm from the unit.
-            # make sure that bit is 0, by doing an AND with 32767 (01111111 1111111)
-            cell.voltage = (groups[0][i] & 32767) / 1000
+        # there is a situation where the MSB bit of the high byte may come set
+        # I got that when I got a high voltage alarm from the unit.
+        # make sure that bit is 0, by doing an AND with 32767 (01111111 1111111)
+        self.cells.set_voltages((value & 32767 for value in groups[0]), 1000)
 
         # Current
         self.current = (30000 - groups[1][0]) / 100
@@ -3,9 +3,10 @@
 # Notes
 # Added by https://github.com/tuxntoast
 
-from battery import Battery, Cell
+from battery import Battery, Cell, ReadTier
 
 # from batters import Protection
+from decoding import FrameLayout, unpack_array
 from utils import logger, read_serial_data
 from struct import unpack_from
 import utils
@@ -69,11 +70,32 @@ class EG4_LL(Battery):
     debug_config_hex = False
     debug_config = False
     balancing = 0
+    # one request returns all values that change, the version and the config are only read on startup
+    READ_SCHEDULE = (("read_cell_data", ReadTier.FAST),)
+
     BATTERYTYPE = "EG4 LL"
     LENGTH_CHECK = 0
     LENGTH_POS = 2  # offset starting from 0
     LENGTH_FIXED = -1
 
+    # values of the stats reply, the cell voltages start at position 7
+    STATS_LAYOUT = FrameLayout(
+        (
+            ("voltage", 3, "H"),
+            ("current", 5, "h"),
+            ("temp1", 39, "h"),
+            ("capacity_remain", 45, "H"),
+            ("max_charge_current", 47, "H"),
+            ("soh", 49, "H"),
+            ("soc", 51, "H"),
+            ("charge_cycles", 61, "L"),
+            ("capacity", 65, "L"),
+            ("temp2", 69, "b"),
+            ("temp_mos", 70, "b"),
+            ("cell_count", 75, "H"),
+        )
+    )
+
     def unique_identifier(self) -> str:
         return self.serial_number
 
@@ -146,7 +168,7 @@ class EG4_LL(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
-        return self.read_cell_data()
+        return self.run_read_schedule()
 
     def read_gen_data(self):
 
@@ -165,7 +187,7 @@ class EG4_LL(Battery):
     def read_cell_data(self):
         packet = self.read_serial_data_eg4_ll(self.command_get_stats)
 
-        if packet is False:
+        if packet is False or len(packet) < self.STATS_LAYOUT.size:
             return False
 
         if self.debug_hex:
@@ -187,49 +209,38 @@ class EG4_LL(Battery):
             logger.info(f'Avg Temp Raw: {packet[41:43].hex(":").upper()}')
             logger.info(f'Temp Max Raw: {packet[43:45].hex(":").upper()}')
 
-        self.voltage = int.from_bytes(packet[3:5], "big") / 100
-        self.current = int.from_bytes(packet[5:7], "big", signed=True) / 100
-        self.capacity_remain = int.from_bytes(packet[45:47], "big")
-        self.capacity = int.from_bytes(packet[65:69], "big") / 3600 / 1000
-        self.max_battery_charge_current = int.from_bytes(packet[47:49], "big")
-        self.soc = int.from_bytes(packet[51:53], "big")
-        self.soh = int.from_bytes(packet[49:51], "big")
-        self.history.charge_cycles = int.from_bytes(packet[61:65], "big")
-        self.temp1 = int.from_bytes(packet[39:41], "big", signed=True)
-        self.temp2 = int.from_bytes(packet[69:70], "big", signed=True)
-        self.temp_mos = int.from_bytes(packet[70:71], "big", signed=True)
-        self.cell_count = int.from_bytes(packet[75:77], "big")
+        values = self.STATS_LAYOUT.unpack(packet)
+        self.voltage = values["voltage"] / 100
+        self.current = values["current"] / 100
+        self.capacity_remain = values["capacity_remain"]
+        self.capacity = values["capacity"] / 3600 / 1000
+        self.max_battery_charge_current = values["max_charge_current"]
+        self.soc = values["soc"]
+        self.soh = values["soh"]
+        self.history.charge_cycles = values["charge_cycles"]
+        self.temp1 = values["temp1"]
+        self.temp2 = values["temp2"]
+        self.temp_mos = values["temp_mos"]
+        self.cell_count = values["cell_count"]
         status_hex = packet[54:55].hex().upper()
         warning_hex = packet[55:57].hex().upper()
         protection_hex = packet[57:59].hex().upper()
         error_hex = packet[59:61].hex().upper()
         heater_status = packet[53:54].hex().upper()
 
-        cell_average = cell_total = 0
-        cell_start_pos = 7
-        cell_end_pos = 9
-        self.cell_min = 3.6
-        self.cell_max = 0
-
         if len(self.cells) != self.cell_count:
             self.cells = []
             for idx in range(self.cell_count):
                 self.cells.append(Cell(False))
 
-        for c in range(self.cell_count):
-            cell_voltage = (
-                int.from_bytes(packet[cell_start_pos:cell_end_pos], "big") / 1000
-            )
-            if self.cell_min > cell_voltage:
-                self.cell_min = cell_voltage
-            if self.cell_max < cell_voltage:
-                self.cell_max = cell_voltage
-            cell_total += cell_voltage
-            cell_average += cell_voltage
-            cell_start_pos += 2
-            cell_end_pos += 2
-            self.cells[c].voltage = cell_voltage
-        self.cell_average = cell_average / self.cell_count
+        cell_voltages = [
+            value / 1000 for value in unpack_array(packet, self.cell_count, 7)
+        ]
+        self.cells.set_voltages(cell_voltages)
+        self.cell_min = min([3.6, *cell_voltages])
+        self.cell_max = max([0, *cell_voltages])
+        cell_total = sum(cell_voltages)
+        self.cell_average = cell_total / self.cell_count
 
         if status_hex == "00":
             status_code = "Standby"
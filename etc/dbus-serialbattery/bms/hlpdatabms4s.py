@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from battery import Battery, Cell
-from utils import logger
+from utils import logger, serial_port_pool
 import serial
 from time import sleep
 import sys
@@ -202,7 +202,7 @@ class HLPdataBMS4S(Battery):
 
 def read_serial_data(command, port, baud, time, min_len):
     try:
-        with serial.Serial(port, baudrate=baud, timeout=0.5) as ser:
+        with serial_port_pool.acquire(port, baud, timeout=0.5) as ser:
             ret = read_serialport_data(ser, command, time, min_len)
         return ret
 
@@ -234,6 +234,8 @@ def read_serialport_data(ser, command, time, min_len):
 
     except serial.SerialException as e:
         logger.error(e)
+        # close the port, it's reopened on the next request
+        serial_port_pool.discard(ser)
         return False
 
 
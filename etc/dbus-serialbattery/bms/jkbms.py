@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from battery import Battery, Cell
+from decoding import FrameLayout, unpack_array
 from utils import is_bit_set, read_serial_data, logger
 import utils
-from struct import unpack_from
+from functools import lru_cache
+from struct import calcsize, unpack_from
 from re import sub
+import struct
 import sys
 
 
@@ -24,6 +27,28 @@ class Jkbms(Battery):
     # to test with a RS485 adapter where the address can be set
     command_status = b"\x4E\x57\x00\x13\x00\x00\x00\x00\x06\x03\x00\x00\x00\x00\x00\x00\x68\x00\x00\x01\x29"
 
+    # fields of the status data as (name, id code, position of the id code behind the cell voltages, format)
+    STATUS_FIELDS = (
+        ("temp_mos", 0x80, 3, "H"),
+        ("temp1", 0x81, 6, "H"),
+        ("temp2", 0x82, 9, "H"),
+        ("voltage", 0x83, 12, "H"),
+        ("current", 0x84, 15, "H"),
+        ("soc", 0x85, 18, "B"),
+        ("charge_cycles", 0x87, 22, "H"),
+        ("cell_count", 0x8A, 30, "H"),
+        ("protection", 0x8B, 33, "H"),
+        ("fet", 0x8C, 36, "H"),
+        ("max_discharge_current", 0x97, 66, "H"),
+        ("max_charge_current", 0x99, 72, "H"),
+        ("balance", 0x9D, 84, "B"),
+        ("capacity", 0xAA, 121, "L"),
+        ("custom_field", 0xB4, 155, "8s"),
+        ("production", 0xB5, 164, "4s"),
+        ("version", 0xB7, 174, "15s"),
+        ("unique_identifier", 0xBA, 197, "24s"),
+    )
+
     def test_connection(self):
         """
         call a function that will connect to the battery, send a command and retrieve the result.
@@ -87,6 +112,48 @@ class Jkbms(Battery):
             return False
         return bytes[start + 1 : start + length + 1]
 
+    @staticmethod
+    @lru_cache(maxsize=4)
+    def status_layout(cellbyte_count: int) -> FrameLayout:
+        """
+        Layout of the status data, the positions depend on the number of bytes of the cell voltages.
+        Each value is preceded by its id code.
+        """
+        fields = []
+        for name, _, position, value_format in Jkbms.STATUS_FIELDS:
+            fields.append((name + "_id", cellbyte_count + position, "B"))
+            fields.append((name, cellbyte_count + position + 1, value_format))
+        return FrameLayout(fields)
+
+    def decode_status_values(self, status_data, cellbyte_count) -> dict:
+        """
+        Unpack all values of the status data at once. If an id code is not at the expected position,
+        the values are searched with `get_data()` one by one.
+        """
+        try:
+            values = self.status_layout(cellbyte_count).unpack(status_data)
+            if all(
+                values[name + "_id"] == idcode
+                for name, idcode, _, _ in self.STATUS_FIELDS
+            ):
+                return values
+        except struct.error:
+            pass
+
+        logger.debug("status data has an unexpected layout, searching the id codes")
+        values = {}
+        for name, idcode, position, value_format in self.STATUS_FIELDS:
+            values[name] = unpack_from(
+                ">" + value_format,
+                self.get_data(
+                    status_data,
+                    bytes([idcode]),
+                    cellbyte_count + position,
+                    calcsize(">" + value_format),
+                ),
+            )[0]
+        return values
+
     def read_status_data(self):
         status_data = self.read_serial_data_jkbms(self.command_status)
         # check if connection success
@@ -99,39 +166,28 @@ class Jkbms(Battery):
             ">B", self.get_data(status_data, b"\x79", offset, 1)
         )[0]
 
-        offset = cellbyte_count + 30
-        self.cell_count = unpack_from(
-            ">H", self.get_data(status_data, b"\x8A", offset, 2)
-        )[0]
+        values = self.decode_status_values(status_data, cellbyte_count)
+        self.cell_count = values["cell_count"]
 
         if cellbyte_count == 3 * self.cell_count and self.cell_count == len(self.cells):
-            offset = 1
-            celldata = self.get_data(status_data, b"\x79", offset, 1 + cellbyte_count)
-            for c in range(self.cell_count):
-                self.cells[c].voltage = (
-                    unpack_from(">xH", celldata, c * 3 + 1)[0] / 1000
-                )
+            # each voltage is preceded by the cell number
+            self.cells.set_voltages(
+                unpack_array(status_data, self.cell_count, 3, "xH"), 1000
+            )
 
         # MOSFET temperature
-        offset = cellbyte_count + 3
-        temp_mos = unpack_from(">H", self.get_data(status_data, b"\x80", offset, 2))[0]
+        temp_mos = values["temp_mos"]
         self.to_temp(0, temp_mos if temp_mos < 99 else (100 - temp_mos))
 
         # Temperature sensors
-        offset = cellbyte_count + 6
-        temp1 = unpack_from(">H", self.get_data(status_data, b"\x81", offset, 2))[0]
-
-        offset = cellbyte_count + 9
-        temp2 = unpack_from(">H", self.get_data(status_data, b"\x82", offset, 2))[0]
+        temp1 = values["temp1"]
+        temp2 = values["temp2"]
         self.to_temp(1, temp1 if temp1 < 99 else (100 - temp1))
         self.to_temp(2, temp2 if temp2 < 99 else (100 - temp2))
 
-        offset = cellbyte_count + 12
-        voltage = unpack_from(">H", self.get_data(status_data, b"\x83", offset, 2))[0]
-        self.voltage = voltage / 100
+        self.voltage = values["voltage"] / 100
 
-        offset = cellbyte_count + 15
-        current = unpack_from(">H", self.get_data(status_data, b"\x84", offset, 2))[0]
+        current = values["current"]
         self.current = (
             current / -100
             if current < self.CURRENT_ZERO_CONSTANT
@@ -139,88 +195,50 @@ class Jkbms(Battery):
         )
 
         # Continued discharge current
-        offset = cellbyte_count + 66
-        self.max_battery_discharge_current = float(
-            unpack_from(">H", self.get_data(status_data, b"\x97", offset, 2))[0]
-        )
+        self.max_battery_discharge_current = float(values["max_discharge_current"])
 
         # Continued charge current
-        offset = cellbyte_count + 72
-        self.max_battery_charge_current = float(
-            unpack_from(">H", self.get_data(status_data, b"\x99", offset, 2))[0]
-        )
+        self.max_battery_charge_current = float(values["max_charge_current"])
 
         # the JKBMS resets to
         # 95% SoC, if all cell voltages are above or equal to OVPR (Over Voltage Protection Recovery)
         # 100% Soc, if all cell voltages are above or equal to OVP (Over Voltage Protection)
-        offset = cellbyte_count + 18
-        self.soc = unpack_from(">B", self.get_data(status_data, b"\x85", offset, 1))[0]
+        self.soc = values["soc"]
 
-        offset = cellbyte_count + 22
-        self.history.charge_cycles = unpack_from(
-            ">H", self.get_data(status_data, b"\x87", offset, 2)
-        )[0]
+        self.history.charge_cycles = values["charge_cycles"]
 
         # offset = cellbyte_count + 25
         # self.capacity_remain = unpack_from('>L', self.get_data(status_data, b'\x89', offset, 4))[0]
-        offset = cellbyte_count + 121
-        self.capacity = unpack_from(
-            ">L", self.get_data(status_data, b"\xAA", offset, 4)
-        )[0]
+        self.capacity = values["capacity"]
 
-        offset = cellbyte_count + 33
-        self.to_protection_bits(
-            unpack_from(">H", self.get_data(status_data, b"\x8B", offset, 2))[0]
-        )
+        self.to_protection_bits(values["protection"])
 
-        offset = cellbyte_count + 36
-        self.to_fet_bits(
-            unpack_from(">H", self.get_data(status_data, b"\x8C", offset, 2))[0]
-        )
+        self.to_fet_bits(values["fet"])
 
-        offset = cellbyte_count + 84
-        self.to_balance_bits(
-            unpack_from(">B", self.get_data(status_data, b"\x9D", offset, 1))[0]
-        )
+        self.to_balance_bits(values["balance"])
 
         # "User Private Data" field in APP
-        offset = cellbyte_count + 155
         tmp = sub(
             " +",
             " ",
-            (
-                unpack_from(">8s", self.get_data(status_data, b"\xB4", offset, 8))[0]
-                .decode()
-                .replace("\x00", " ")
-                .strip()
-            ),
+            (values["custom_field"].decode().replace("\x00", " ").strip()),
         )
         self.custom_field = tmp if tmp != "Input Us" else None
 
         # production date
         try:
-            offset = cellbyte_count + 164
-            tmp = unpack_from(">4s", self.get_data(status_data, b"\xB5", offset, 4))[
-                0
-            ].decode()
+            tmp = values["production"].decode()
             self.production = "20" + tmp + "01" if tmp and tmp != "" else None
         except UnicodeDecodeError:
             self.production = None
 
-        offset = cellbyte_count + 174
-        self.version = (
-            unpack_from(">15s", self.get_data(status_data, b"\xB7", offset, 15))[0]
-            .decode()
-            .replace("_", " ")
-            .strip()
-        )
+        self.version = values["version"].decode().replace("_", " ").strip()
 
-        offset = cellbyte_count + 197
         self.unique_identifier_tmp = sub(
             " +",
             "_",
             (
-                unpack_from(">24s", self.get_data(status_data, b"\xBA", offset, 24))[0]
+                values["unique_identifier"]
                 .decode()
                 .replace("\x00", " ")
                 .replace("Input Userda", "")
@@ -229,11 +247,11 @@ class Jkbms(Battery):
         )
 
         # show wich cells are balancing
-        if self.get_min_cell() is not None and self.get_max_cell() is not None:
+        min_cell = self.get_min_cell()
+        max_cell = self.get_max_cell()
+        if min_cell is not None and max_cell is not None:
             for c in range(self.cell_count):
-                if self.balancing and (
-                    self.get_min_cell() == c or self.get_max_cell() == c
-                ):
+                if self.balancing and (min_cell == c or max_cell == c):
                     self.cells[c].balance = True
                 else:
                     self.cells[c].balance = False
@@ -369,7 +387,7 @@ class Jkbms(Battery):
 
         s = sum(data[0:-4])
 
-        logger.debug("bytearray: " + utils.bytearray_to_string(data))
+        logger.debug("bytearray: %s", utils.HexDump(data))
 
         if start == 0x4E57 and end == 0x68 and s == crc_lo:
             return data[10 : length - 7]
@@ -20,7 +20,7 @@ class Jkbms_Ble(Battery):
         super(Jkbms_Ble, self).__init__(port, baud, address)
         self.address = address
         self.type = self.BATTERYTYPE
-        self.jk = Jkbms_Brn(address, lambda: self.reset_bluetooth())
+        self.jk = Jkbms_Brn(address)
         self.unique_identifier_tmp = ""
 
         logger.info("Init of Jkbms_Ble at " + address)
@@ -46,11 +46,11 @@ class Jkbms_Ble(Battery):
             if result:
                 # start scraping
                 self.jk.start_scraping()
-                tries = 1
+                # the device could be found only at the end of the scan
+                timeout = time() + utils.BLUETOOTH_SCAN_TIMEOUT + 10
 
-                while self.jk.get_status() is None and tries < 20:
+                while self.jk.get_status() is None and time() < timeout:
                     sleep(0.5)
-                    tries += 1
 
                 # load initial data, from here on get_status has valid values to be served to the dbus
                 status = self.jk.get_status()
@@ -151,7 +151,13 @@ class Jkbms_Ble(Battery):
             return False
 
         last_update = int(time() - st["last_update"])
-        if last_update >= 15 and last_update % 15 == 0:
+        # the data is older than usual, while the BMS handed over its connection to other BMS
+        # and waits for its next turn, this is no interrupted connection
+        if (
+            last_update >= 15
+            and last_update % 15 == 0
+            and not self.jk.manager.waiting_for_slot(self.address)
+        ):
             logger.info(
                 f"Jkbms_Ble: Bluetooth connection interrupted. Got no fresh data since {last_update}s."
             )
@@ -273,15 +279,11 @@ class Jkbms_Ble(Battery):
             else:
                 logger.warning("Scraping was unable to stop, issuing sys-commands")
 
-        # process kill is needed, since the service/bluetooth driver is probably freezed
-        os.system('pkill -f "bluetoothd"')
-        # stop will not work, if service/bluetooth driver is stuck
-        # os.system("/etc/init.d/bluetooth stop")
-        sleep(2)
-        os.system("rfkill block bluetooth")
-        os.system("rfkill unblock bluetooth")
-        os.system("/etc/init.d/bluetooth start")
-        logger.info("System Bluetooth daemon should have been restarted")
+        # the BLE manager restarts the Bluetooth stack once for all BMS of the process
+        # and skips the restart, if an other BMS triggered it shortly before
+        self.jk.manager.submit(
+            self.jk.manager.reset_adapter(f"no data from {self.address}")
+        ).result()
 
     def get_balancing(self):
         return 1 if self.balancing else 0
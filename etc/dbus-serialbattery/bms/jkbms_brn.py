@@ -1,22 +1,33 @@
-from struct import unpack_from, calcsize
+import re
+from struct import Struct, calcsize
+from typing import Callable, Dict, List, Tuple, Union
 from bleak import BleakScanner, BleakClient, exc
 from time import sleep, time
 import asyncio
+import concurrent.futures
+import logging
 import threading
+import os
 import sys
 
 # if used as standalone script then use custom logger
 # else import logger from utils
 if __name__ == "__main__":
-    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger(__name__)
 
-    logger = logging.basicConfig(level=logging.DEBUG)
+    # the shared BLE manager lives in the driver folder
+    sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
     def bytearray_to_string(data):
         return "".join("\\x" + format(byte, "02x") for byte in data)
 
+    HexDump = bytearray_to_string
+
 else:
-    from utils import bytearray_to_string, logger
+    from utils import HexDump, logger
+
+from blemanager import get_ble_manager  # noqa: E402
 
 # zero means parse all incoming data (every second)
 CELL_INFO_REFRESH_S = 0
@@ -41,6 +52,10 @@ protocol_version = PROTOCOL_VERSION_JK02
 MIN_RESPONSE_SIZE = 300
 MAX_RESPONSE_SIZE = 320
 
+FRAME_HEADER = b"\x55\xaa\xeb\x90"
+# the checksum is always at position 300, independent of the actual frame length
+CRC_POSITION = MIN_RESPONSE_SIZE - 1
+
 TRANSLATE_DEVICE_INFO = [
     [["device_info", "hw_rev"], 22, "8s"],
     [["device_info", "sw_rev"], 30, "8s"],
@@ -67,13 +82,14 @@ TRANSLATE_SETTINGS = [
     [["settings", "balancing_switch"], 126, "4?"],
 ]
 
+# the arrays of the 24S frame have 24 slots, 32 would overlap the following fields
 TRANSLATE_CELL_INFO_24S = [
-    [["cell_info", "voltages", 32], 6, "<H", 0.001],
+    [["cell_info", "voltages", 24], 6, "<H", 0.001],
     [["cell_info", "average_cell_voltage"], 58, "<H", 0.001],
     [["cell_info", "delta_cell_voltage"], 60, "<H", 0.001],
     [["cell_info", "max_voltage_cell"], 62, "<B"],
     [["cell_info", "min_voltage_cell"], 63, "<B"],
-    [["cell_info", "resistances", 32], 64, "<H", 0.001],
+    [["cell_info", "resistances", 24], 64, "<H", 0.001],
     [["cell_info", "total_voltage"], 118, "<H", 0.001],
     [["cell_info", "current"], 126, "<l", 0.001],
     [["cell_info", "temperature_sensor_1"], 130, "<H", 0.1],
@@ -116,13 +132,124 @@ TRANSLATE_CELL_INFO_32S = [
 ]
 
 
-class Jkbms_Brn:
-    # entries for translating the bytearray to py-object via unpack
-    # [[py dict entry as list, each entry ] ]
+def offset_32s(offset: int) -> int:
+    """
+    Offset of a field in the 32S cell info frame, the 32S frame has 8 more cell voltages and resistances
+    """
+    if offset >= 112:
+        return offset + 32
+    if offset >= 54:
+        return offset + 16
+    return offset
+
+
+class FrameLayout:
+    """
+    Precompiled layout of one frame type, unpacks all fields of a translation table with one
+    `Struct.unpack_from()` call directly from the frame buffer.
+
+    :param translation: Translation table, entries are `[[keys..., array length], offset, format, factor]`,
+        the array length and the factor are optional. A format like "4?" unpacks only the first value.
+    :param offset: Function that maps the offset of the table to the offset in the frame
+    """
+
+    def __init__(
+        self,
+        translation: List[list],
+        offset: Callable[[int], int] = lambda offset: offset,
+    ):
+        entries = []
+        for keys, position, field_format, *factor in translation:
+            length = None
+            if isinstance(keys[-1], int):
+                keys, length = keys[:-1], keys[-1]
+            entries.append(
+                (offset(position), field_format.lstrip("<"), keys, length, factor)
+            )
+        entries.sort(key=lambda entry: entry[0])
+
+        struct_format = "<"
+        position = 0
+        index = 0
+        previous = None
+        self.fields: List[
+            Tuple[Tuple[str, ...], int, Union[int, None], float, bool]
+        ] = []
+        """
+        Tuples of (keys, index of the first value, array length, factor, is text)
+        """
+        for field_offset, field_format, keys, length, factor in entries:
+            count, code = re.fullmatch(r"(\d*)(\D)", field_format).groups()
+            count = int(count or 1)
+            factor = factor[0] if factor else None
+
+            if field_offset < position:
+                # the same field is published under another name
+                if previous != (field_offset, field_format):
+                    raise ValueError(f"Field {keys} overlaps the previous field")
+                self.fields.append(
+                    (tuple(keys), self.fields[-1][1], length, factor, code == "s")
+                )
+                continue
+
+            if field_offset > position:
+                struct_format += f"{field_offset - position}x"
+
+            if code == "s":
+                struct_format += f"{count}s"
+            elif length is not None:
+                struct_format += f"{length}{code}"
+            else:
+                # unpack only the first value, skip the rest
+                size = calcsize("<" + code)
+                struct_format += code + (f"{(count - 1) * size}x" if count > 1 else "")
+
+            self.fields.append((tuple(keys), index, length, factor, code == "s"))
+            index += length or 1
+            position = field_offset + calcsize("<" + field_format) * (length or 1)
+            previous = (field_offset, field_format)
+
+        self.struct = Struct(struct_format)
+
+    def unpack(self, frame: Union[bytes, bytearray, memoryview], status: Dict) -> None:
+        """
+        Unpack the fields of a frame into the nested status dict
+
+        :param frame: Frame, has to be at least `struct.size` bytes long
+        :param status: Dict to write the values to
+        """
+        values = self.struct.unpack_from(frame)
+        for keys, index, length, factor, text in self.fields:
+            target = status
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+
+            if length is not None:
+                array = values[index : index + length]
+                target[keys[-1]] = (
+                    [value * factor for value in array] if factor else list(array)
+                )
+                continue
+
+            value = values[index]
+            if text:
+                try:
+                    value = value.decode("utf-8").rstrip(" \t\n\r\0")
+                except UnicodeDecodeError:
+                    value = ""
+            elif factor is not None:
+                value = value * factor
+            target[keys[-1]] = value
 
-    frame_buffer = bytearray()
-    bms_status = {}
 
+DEVICE_INFO_LAYOUT = FrameLayout(TRANSLATE_DEVICE_INFO)
+SETTINGS_LAYOUT = FrameLayout(TRANSLATE_SETTINGS)
+CELL_INFO_LAYOUT_24S = FrameLayout(TRANSLATE_CELL_INFO_24S)
+CELL_INFO_LAYOUT_32S = FrameLayout(TRANSLATE_CELL_INFO_32S, offset_32s)
+ERROR_BITMASK = Struct("<H")
+
+
+class Jkbms_Brn:
     waiting_for_response = ""
     last_cell_info = 0
 
@@ -138,16 +265,24 @@ class Jkbms_Brn:
     # will be set by get_bms_max_cell_count()
     bms_max_cell_count = None
 
-    # translate info placeholder, since it depends on the bms_max_cell_count
-    translate_cell_info = []
+    # cell info layout placeholder, since it depends on the bms_max_cell_count
+    cell_info_layout = None
 
-    def __init__(self, addr, reset_bt_callback=None):
+    def __init__(self, addr):
         self.address = addr
-        self.bt_thread = None
-        self.bt_thread_monitor = threading.Thread(
-            target=self.monitor_scraping, name="Thread-JKBMS-Monitor"
-        )
-        self.bt_reset = reset_bt_callback
+        # per instance, since one process can scrape multiple BMS
+        self.bms_status = {}
+        # the frames are assembled in place, the buffer is allocated only once
+        self.frame_buffer = bytearray(MAX_RESPONSE_SIZE)
+        self.frame_view = memoryview(self.frame_buffer)
+        # number of bytes of the frame received so far, 0 while waiting for the beginning of a frame
+        self.frame_length = 0
+        # sum of the received bytes in front of the checksum
+        self.frame_checksum = 0
+        # the connection runs as coroutine in the thread of the BLE manager
+        self.manager = get_ble_manager()
+        self.manager.register(addr)
+        self.scrape_task: Union[concurrent.futures.Future, None] = None
         self.should_be_scraping = False
         self.trigger_soc_reset = False
 
@@ -158,9 +293,8 @@ class Jkbms_Brn:
 
     # check where the bms data starts and
     # if the bms is a 24s or 32s type
-    def get_bms_max_cell_count(self):
-        fb = self.frame_buffer
-        logger.debug(self.frame_buffer)
+    def get_bms_max_cell_count(self, fb: memoryview):
+        logger.debug("%s", HexDump(fb))
 
         # old check to recognize 32s
         # what does this check validate?
@@ -169,84 +303,27 @@ class Jkbms_Brn:
 
         # logger can be removed after releasing next stable
         # current version v1.0.20231102dev
-        logger.debug(f"fb[38]: {fb[36]}.{fb[37]}.{fb[38]}.{fb[39]}.{fb[40]}")
-        logger.debug(f"fb[54]: {fb[52]}.{fb[53]}.{fb[54]}.{fb[55]}.{fb[56]}")
-        logger.debug(f"fb[70]: {fb[68]}.{fb[69]}.{fb[70]}.{fb[71]}.{fb[72]}")
-        logger.debug(f"fb[134]: {fb[132]}.{fb[133]}.{fb[134]}.{fb[135]}.{fb[136]}")
-        logger.debug(f"fb[144]: {fb[142]}.{fb[143]}.{fb[144]}.{fb[145]}.{fb[146]}")
-        logger.debug(f"fb[289]: {fb[287]}.{fb[288]}.{fb[289]}.{fb[290]}.{fb[291]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"fb[38]: {fb[36]}.{fb[37]}.{fb[38]}.{fb[39]}.{fb[40]}")
+            logger.debug(f"fb[54]: {fb[52]}.{fb[53]}.{fb[54]}.{fb[55]}.{fb[56]}")
+            logger.debug(f"fb[70]: {fb[68]}.{fb[69]}.{fb[70]}.{fb[71]}.{fb[72]}")
+            logger.debug(f"fb[134]: {fb[132]}.{fb[133]}.{fb[134]}.{fb[135]}.{fb[136]}")
+            logger.debug(f"fb[144]: {fb[142]}.{fb[143]}.{fb[144]}.{fb[145]}.{fb[146]}")
+            logger.debug(f"fb[289]: {fb[287]}.{fb[288]}.{fb[289]}.{fb[290]}.{fb[291]}")
 
         # if BMS has a max of 32s the data at fb[287] is not empty
         if fb[287] > 0:
             self.bms_max_cell_count = 32
-            self.translate_cell_info = TRANSLATE_CELL_INFO_32S
+            self.cell_info_layout = CELL_INFO_LAYOUT_32S
         # if BMS has a max of 24s the data ends at fb[219]
         else:
             self.bms_max_cell_count = 24
-            self.translate_cell_info = TRANSLATE_CELL_INFO_24S
+            self.cell_info_layout = CELL_INFO_LAYOUT_24S
 
         logger.debug(f"bms_max_cell_count recognized: {self.bms_max_cell_count}")
 
-    # iterative implementation maybe later due to referencing
-    def translate(self, fb, translation, o, f32s=False, i=0):
-        if i == len(translation[0]) - 1:
-            # keep things universal by using an n=1 list
-            kees = (
-                range(0, translation[0][i])
-                if isinstance(translation[0][i], int)
-                else [translation[0][i]]
-            )
-            offset = 0
-            if f32s:
-                if translation[1] >= 112:
-                    offset = 32
-                elif translation[1] >= 54:
-                    offset = 16
-            i = 0
-            for j in kees:
-                if isinstance(translation[2], int):
-                    # handle raw bytes without unpack_from;
-                    # 3. param gives no format but number of bytes
-                    val = bytearray(
-                        fb[
-                            translation[1]
-                            + i
-                            + offset : translation[1]
-                            + i
-                            + translation[2]
-                            + offset
-                        ]
-                    )
-                    i += translation[2]
-                else:
-                    val = unpack_from(
-                        translation[2], bytearray(fb), translation[1] + i + offset
-                    )[0]
-                    # calculate stepping in case of array
-                    i = i + calcsize(translation[2])
-
-                if isinstance(val, bytes):
-                    try:
-                        val = val.decode("utf-8").rstrip(" \t\n\r\0")
-                    except UnicodeDecodeError:
-                        val = ""
-
-                elif isinstance(val, int) and len(translation) == 4:
-                    val = val * translation[3]
-                o[j] = val
-        else:
-            if translation[0][i] not in o:
-                if len(translation[0]) == i + 2 and isinstance(
-                    translation[0][i + 1], int
-                ):
-                    o[translation[0][i]] = [None] * translation[0][i + 1]
-                else:
-                    o[translation[0][i]] = {}
-
-            self.translate(fb, translation, o[translation[0][i]], f32s=f32s, i=i + 1)
-
     def decode_warnings(self, fb):
-        val = unpack_from("<H", bytearray(fb), 136)[0]
+        val = ERROR_BITMASK.unpack_from(fb, 136)[0]
 
         self.bms_status["cell_info"]["error_bitmask_16"] = hex(val)
         self.bms_status["cell_info"]["error_bitmask_2"] = format(val, "016b")
@@ -265,40 +342,28 @@ class Jkbms_Brn:
         self.bms_status["warnings"]["discharge_overcurrent"] = bool(val & (1 << 13))
         # bis hierhin verifiziert, rest zu testen
 
-    def decode_device_info_jk02(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_DEVICE_INFO:
-            self.translate(fb, t, self.bms_status)
+    def decode_device_info_jk02(self, fb: memoryview):
+        DEVICE_INFO_LAYOUT.unpack(fb, self.bms_status)
 
-    def decode_cellinfo_jk02(self):
-        fb = self.frame_buffer
-        has32s = self.bms_max_cell_count == 32
-        for t in self.translate_cell_info:
-            self.translate(fb, t, self.bms_status, f32s=has32s)
+    def decode_cellinfo_jk02(self, fb: memoryview):
+        # the arrays contain all slots of the frame, only the first `cell_count` cells are used
+        self.cell_info_layout.unpack(fb, self.bms_status)
         self.decode_warnings(fb)
-        logger.debug("decode_cellinfo_jk02(): self.frame_buffer")
-        logger.debug(self.frame_buffer)
-        logger.debug(self.bms_status)
+        logger.debug("decode_cellinfo_jk02(): %s", HexDump(fb))
+        logger.debug("%s", self.bms_status)
 
-    def decode_settings_jk02(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_SETTINGS:
-            self.translate(fb, t, self.bms_status)
-        logger.debug(self.bms_status)
+    def decode_settings_jk02(self, fb: memoryview):
+        SETTINGS_LAYOUT.unpack(fb, self.bms_status)
+        logger.debug("%s", self.bms_status)
 
-    def decode(self):
+    def decode(self, fb: memoryview):
         # check what kind of info the frame contains
-        info_type = self.frame_buffer[4]
-        self.get_bms_max_cell_count()
+        info_type = fb[4]
+        self.get_bms_max_cell_count(fb)
         if info_type == 0x01:
             logger.debug("Processing frame with settings info")
             if protocol_version == PROTOCOL_VERSION_JK02:
-                self.decode_settings_jk02()
-                # adapt translation table for cell array lengths
-                ccount = self.bms_status["settings"]["cell_count"]
-                for i, t in enumerate(self.translate_cell_info):
-                    if t[0][-2] == "voltages" or t[0][-2] == "voltages":
-                        self.translate_cell_info[i][0][-1] = ccount
+                self.decode_settings_jk02(fb)
                 self.bms_status["last_update"] = time()
 
         elif info_type == 0x02:
@@ -309,7 +374,7 @@ class Jkbms_Brn:
                 self.last_cell_info = time()
                 logger.debug("processing frame with battery cell info")
                 if protocol_version == PROTOCOL_VERSION_JK02:
-                    self.decode_cellinfo_jk02()
+                    self.decode_cellinfo_jk02(fb)
                     self.bms_status["last_update"] = time()
                 # power is calculated from voltage x current as
                 # register 122 contains unsigned power-value
@@ -323,7 +388,7 @@ class Jkbms_Brn:
         elif info_type == 0x03:
             logger.debug("processing frame with device info")
             if protocol_version == PROTOCOL_VERSION_JK02:
-                self.decode_device_info_jk02()
+                self.decode_device_info_jk02(fb)
                 self.bms_status["last_update"] = time()
             else:
                 return
@@ -334,49 +399,57 @@ class Jkbms_Brn:
         self._new_data_callback = callback
 
     def assemble_frame(self, data: bytearray):
-        logger.debug(
-            f"--> assemble_frame() -> self.frame_buffer (before extend) -> lenght:  {len(self.frame_buffer)}"
-        )
-        logger.debug(self.frame_buffer)
-        if len(self.frame_buffer) > MAX_RESPONSE_SIZE:
-            logger.debug(
-                "data dropped because it alone was longer than max frame length"
+        """
+        Assemble the notifications to frames in the preallocated buffer and decode complete frames.
+        The checksum is summed up while the bytes arrive.
+        """
+        if data[:4] == FRAME_HEADER:
+            # beginning of new frame, drop the incomplete frame
+            self.frame_length = 0
+            self.frame_checksum = 0
+        elif self.frame_length == 0:
+            # waiting for the beginning of a frame, skip everything in front of it
+            start = data.find(FRAME_HEADER)
+            if start == -1:
+                logger.debug("data dropped, waiting for the beginning of a frame")
+                return
+            data = memoryview(data)[start:]
+
+        length = self.frame_length
+        count = min(len(data), MAX_RESPONSE_SIZE - length)
+        self.frame_view[length : length + count] = data[:count]
+        if length < CRC_POSITION:
+            self.frame_checksum += sum(
+                self.frame_view[length : min(length + count, CRC_POSITION)]
             )
-            self.frame_buffer = []
+        length += count
 
-        if data[0] == 0x55 and data[1] == 0xAA and data[2] == 0xEB and data[3] == 0x90:
-            # beginning of new frame, clear buffer
-            self.frame_buffer = []
+        logger.debug("--> assemble_frame() -> frame length:  %d", length)
+        if length < MIN_RESPONSE_SIZE:
+            self.frame_length = length
+            return
 
-        self.frame_buffer.extend(data)
+        # the frame is complete, the following data belongs to the next frame
+        self.frame_length = 0
+        ccrc = self.frame_checksum & 0xFF
+        rcrc = self.frame_buffer[CRC_POSITION]
+        logger.debug("compair recvd. crc: %d vs calc. crc: %d", rcrc, ccrc)
+        if ccrc != rcrc:
+            logger.debug("data dropped, frame checksum does not match")
+            return
 
-        logger.debug(
-            f"--> assemble_frame() -> self.frame_buffer (after extend) -> lenght:  {len(self.frame_buffer)}"
-        )
-        logger.debug(self.frame_buffer)
-        if len(self.frame_buffer) >= MIN_RESPONSE_SIZE:
-            # check crc; always at position 300, independent of
-            # actual frame-lentgh, so crc up to 299
-            ccrc = self.crc(self.frame_buffer, 300 - 1)
-            rcrc = self.frame_buffer[300 - 1]
-            logger.debug(f"compair recvd. crc: {rcrc} vs calc. crc: {ccrc}")
-            if ccrc == rcrc:
-                logger.debug("great success! frame complete and sane, lets decode")
-                self.decode()
-                self.frame_buffer = []
-                if self._new_data_callback is not None:
-                    self._new_data_callback()
+        logger.debug("great success! frame complete and sane, lets decode")
+        self.decode(self.frame_view[:length])
+        if self._new_data_callback is not None:
+            self._new_data_callback()
 
     def ncallback(self, sender: int, data: bytearray):
-        logger.debug(f"--> NEW PACKAGE! lenght:  {len(data)}")
-        logger.debug("ncallback(): " + bytearray_to_string(data))
+        logger.debug("--> NEW PACKAGE! lenght:  %d", len(data))
+        logger.debug("ncallback(): %s", HexDump(data))
         self.assemble_frame(data)
 
     def crc(self, arr: bytearray, length: int) -> int:
-        crc = 0
-        for a in arr[:length]:
-            crc = crc + a
-        return crc.to_bytes(2, "little")[0]
+        return sum(arr[:length]) & 0xFF
 
     async def write_register(
         self,
@@ -455,134 +528,130 @@ class Jkbms_Brn:
         else:
             return None
 
-    def connect_and_scrape(self):
-        asyncio.run(self.asy_connect_and_scrape())
+    async def scrape(self):
+        """
+        Connect to the BMS and reconnect, until the scraping is stopped.
+        Runs in the thread of the BLE manager.
+        """
+        while self.should_be_scraping and self.main_thread.is_alive():
+            await self.manager.wait_retry(self.address)
+            await self.asy_connect_and_scrape()
 
-    # self.bt_thread
     async def asy_connect_and_scrape(self):
         logger.debug(
             "--> asy_connect_and_scrape(): Connect and scrape on address: "
             + self.address
         )
         self.run = True
-        while self.run and self.main_thread.is_alive():  # autoreconnect
-            client = BleakClient(self.address)
-            logger.debug("--> asy_connect_and_scrape(): btloop")
+        device = await self.manager.find_device(self.address)
+        if device is None:
+            logger.info(
+                f"--> asy_connect_and_scrape(): device not found: {self.address}"
+            )
+            self.manager.report_error(self.address)
+            return
+
+        client = None
+        try:
+            await self.manager.acquire_slot(self.address)
+            client = BleakClient(device)
+            logger.debug("--> asy_connect_and_scrape(): reconnect")
+            await self.manager.connect(self.address, client)
 
+            # try to get MODEL_NBR_UUID, since not all JKBMS send it
             try:
-                logger.debug("--> asy_connect_and_scrape(): reconnect")
-                await client.connect()
+                self.bms_status["model_nbr"] = (
+                    await client.read_gatt_char(MODEL_NBR_UUID)
+                ).decode("utf-8")
+            except exc.BleakError:
+                (
+                    exception_type,
+                    exception_object,
+                    exception_traceback,
+                ) = sys.exc_info()
+                logger.debug(
+                    f'Error getting UUID "{MODEL_NBR_UUID}": {repr(exception_object)} -> failover'
+                )
+                self.bms_status["model_nbr"] = "JK-BMS-Unknown-Model"
 
-                # try to get MODEL_NBR_UUID, since not all JKBMS send it
-                try:
-                    self.bms_status["model_nbr"] = (
-                        await client.read_gatt_char(MODEL_NBR_UUID)
-                    ).decode("utf-8")
-                except exc.BleakError:
-                    (
-                        exception_type,
-                        exception_object,
-                        exception_traceback,
-                    ) = sys.exc_info()
+            # some JKBMS trow an error
+            # BleakError('Multiple Characteristics with this UUID, refer to your desired
+            #             characteristic by the `handle` attribute instead.')
+            # failover in this case and use handle instead of UUID
+            try:
+                await client.start_notify(CHAR_HANDLE, self.ncallback)
+            except exc.BleakError:
+                (
+                    exception_type,
+                    exception_object,
+                    exception_traceback,
+                ) = sys.exc_info()
+                logger.debug(
+                    f'Error getting UUID "{CHAR_HANDLE}": {repr(exception_object)} -> failover'
+                )
+                await client.start_notify(CHAR_HANDLE_FAILOVER, self.ncallback)
+
+            await self.request_bt("device_info", client)
+
+            await self.request_bt("cell_info", client)
+            # await self.enable_charging(client)
+            # last_dev_info = time()
+            while client.is_connected and self.run and self.main_thread.is_alive():
+                if self.trigger_soc_reset:
+                    self.trigger_soc_reset = False
+                    await self.reset_soc_jk(client)
+                # other BMS are waiting for a connection, reconnect after them
+                if self.manager.slot_expired(self.address):
                     logger.debug(
-                        f'Error getting UUID "{MODEL_NBR_UUID}": {repr(exception_object)} -> failover'
+                        "--> asy_connect_and_scrape(): handing over the connection slot"
                     )
-                    self.bms_status["model_nbr"] = "JK-BMS-Unknown-Model"
+                    self.manager.hand_over_slot(self.address)
+                    break
+                # the BMS pushes its data, only the SOC reset trigger is checked here
+                await asyncio.sleep(0.1)
 
-                # some JKBMS trow an error
-                # BleakError('Multiple Characteristics with this UUID, refer to your desired
-                #             characteristic by the `handle` attribute instead.')
-                # failover in this case and use handle instead of UUID
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.info(
+                f"--> asy_connect_and_scrape(): error while connecting to bt: {repr(exception_object)} "
+                + f"of type {exception_type} in {file} line #{line}"
+            )
+            self.manager.report_error(self.address, exception_object)
+
+        finally:
+            self.run = False
+            if client is not None and client.is_connected:
                 try:
-                    await client.start_notify(CHAR_HANDLE, self.ncallback)
-                except exc.BleakError:
+                    await client.disconnect()
+                except Exception:
                     (
                         exception_type,
                         exception_object,
                         exception_traceback,
                     ) = sys.exc_info()
-                    logger.debug(
-                        f'Error getting UUID "{CHAR_HANDLE}": {repr(exception_object)} -> failover'
+                    file = exception_traceback.tb_frame.f_code.co_filename
+                    line = exception_traceback.tb_lineno
+                    logger.info(
+                        f"--> asy_connect_and_scrape(): error while disconnecting: {repr(exception_object)} "
+                        + f"of type {exception_type} in {file} line #{line}"
                     )
-                    await client.start_notify(CHAR_HANDLE_FAILOVER, self.ncallback)
-
-                await self.request_bt("device_info", client)
-
-                await self.request_bt("cell_info", client)
-                # await self.enable_charging(client)
-                # last_dev_info = time()
-                while client.is_connected and self.run and self.main_thread.is_alive():
-                    if self.trigger_soc_reset:
-                        self.trigger_soc_reset = False
-                        await self.reset_soc_jk(client)
-                    await asyncio.sleep(0.01)
-
-            except exc.BleakDeviceNotFoundError:
-                logger.info(
-                    f"--> asy_connect_and_scrape(): device not found: {self.address}"
-                )
-                self.run = False
-
-            except Exception:
-                (
-                    exception_type,
-                    exception_object,
-                    exception_traceback,
-                ) = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logger.info(
-                    f"--> asy_connect_and_scrape(): error while connecting to bt: {repr(exception_object)} "
-                    + f"of type {exception_type} in {file} line #{line}"
-                )
-                self.run = False
-
-            finally:
-                self.run = False
-                if client.is_connected:
-                    try:
-                        await client.disconnect()
-                    except Exception:
-                        (
-                            exception_type,
-                            exception_object,
-                            exception_traceback,
-                        ) = sys.exc_info()
-                        file = exception_traceback.tb_frame.f_code.co_filename
-                        line = exception_traceback.tb_lineno
-                        logger.info(
-                            f"--> asy_connect_and_scrape(): error while disconnecting: {repr(exception_object)} "
-                            + f"of type {exception_type} in {file} line #{line}"
-                        )
+            self.manager.release_slot(self.address)
 
         logger.info("--> asy_connect_and_scrape(): Exit")
 
-    def monitor_scraping(self):
-        while self.should_be_scraping is True:
-            self.bt_thread = threading.Thread(
-                target=self.connect_and_scrape, name="Thread-JKBMS-Connect-and-Scrape"
-            )
-            self.bt_thread.start()
-            logger.debug(
-                "scraping thread started -> main thread id: "
-                + str(self.main_thread.ident)
-                + " scraping thread: "
-                + str(self.bt_thread.ident)
-            )
-            self.bt_thread.join()
-            if self.should_be_scraping is True:
-                logger.debug("scraping thread ended: reseting bluetooth and restarting")
-                if self.bt_reset is not None:
-                    self.bt_reset()
-                sleep(2)
-
     def start_scraping(self):
         self.main_thread = threading.current_thread()
         if self.is_running():
             logger.debug("scraping thread already running")
             return
         self.should_be_scraping = True
-        self.bt_thread_monitor.start()
+        self.scrape_task = self.manager.submit(self.scrape())
 
     def stop_scraping(self):
         self.run = False
@@ -591,12 +660,14 @@ class Jkbms_Brn:
         while self.is_running():
             sleep(0.1)
             if time() - stop > 10:
+                # e.g. still waiting for a connection slot
+                self.scrape_task.cancel()
                 return False
         return True
 
     def is_running(self):
-        if self.bt_thread is not None:
-            return self.bt_thread.is_alive()
+        if self.scrape_task is not None:
+            return not self.scrape_task.done()
         return False
 
     async def enable_charging(self, c):
@@ -650,10 +721,7 @@ class Jkbms_Brn:
 
 if __name__ == "__main__":
     jk = Jkbms_Brn(sys.argv[1])
-    if not jk.test_connection():
-        logger.error(">>> ERROR: Unable to connect")
-    else:
-        jk.start_scraping()
-        while True:
-            logger.debug(jk.get_status())
-            sleep(5)
+    jk.start_scraping()
+    while jk.is_running():
+        logger.debug(jk.get_status())
+        sleep(5)
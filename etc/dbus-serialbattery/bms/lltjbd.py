@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from battery import Protection, Battery, Cell
+from battery import Protection, Battery, Cell, ReadTier
+from decoding import unpack_array
 from utils import is_bit_set, read_serial_data, logger
 import utils
 from struct import unpack_from, pack
@@ -231,6 +232,13 @@ class LltJbdProtection(Protection):
 
 
 class LltJbd(Battery):
+    # the general data contains all values except the cell voltages, both change every poll.
+    # The hardware info and the EEPROM settings are only read once by test_connection() and get_settings()
+    READ_SCHEDULE = (
+        ("read_gen_data", ReadTier.FAST),
+        ("read_cell_data", ReadTier.FAST),
+    )
+
     def __init__(self, port, baud, address):
         super(LltJbd, self).__init__(port, baud, address)
         self.protection = LltJbdProtection()
@@ -481,7 +489,7 @@ class LltJbd(Battery):
     def refresh_data(self):
         self.write_charge_discharge_mos()
         self.write_balancer()
-        return self.read_gen_data() and self.read_cell_data()
+        return self.run_read_schedule()
 
     def to_protection_bits(self, byte_data):
         tmp = bin(byte_data)[2:].rjust(13, utils.ZERO_CHAR)
@@ -639,13 +647,7 @@ class LltJbd(Battery):
         if cell_data is False or len(cell_data) < self.cell_count * 2:
             return False
 
-        for c in range(self.cell_count):
-            try:
-                cell_volts = unpack_from(">H", cell_data, c * 2)
-                if len(cell_volts) != 0:
-                    self.cells[c].voltage = cell_volts[0] / 1000
-            except struct.error:
-                self.cells[c].voltage = 0
+        self.cells.set_voltages(unpack_array(cell_data, self.cell_count), 1000)
         return True
 
     def read_hardware_data(self):
@@ -667,7 +669,7 @@ class LltJbd(Battery):
 
         start, op, status, payload_length = unpack_from("BBBB", data)
 
-        logger.debug("bytearray: " + utils.bytearray_to_string(data))
+        logger.debug("bytearray: %s", utils.HexDump(data))
 
         if start != 0xDD:
             logger.error(
@@ -1,16 +1,14 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import atexit
-import functools
-import os
+import concurrent.futures
 import threading
 import sys
-import re
 from asyncio import CancelledError
-from time import sleep
-from typing import Union, Optional
-from utils import logger
-from bleak import BleakClient, BleakScanner, BLEDevice
+from time import time
+from typing import Dict, Iterable, Union, Optional
+from blemanager import get_ble_manager
+from utils import BLUETOOTH_SCAN_TIMEOUT, logger, serial_stats
+from bleak import BleakClient, BLEDevice
 from bleak.exc import BleakDBusError
 from bms.lltjbd import LltJbdProtection, LltJbd
 
@@ -19,10 +17,19 @@ BLE_CHARACTERISTICS_TX_UUID = "0000ff02-0000-1000-8000-00805f9b34fb"
 BLE_CHARACTERISTICS_RX_UUID = "0000ff01-0000-1000-8000-00805f9b34fb"
 MIN_RESPONSE_SIZE = 6
 MAX_RESPONSE_SIZE = 256
+# time in seconds to wait for the reply to a command
+REPLY_TIMEOUT = 5
+# time in seconds to wait for the first connection, the device could be found only at the end of the scan
+CONNECT_TIMEOUT = BLUETOOTH_SCAN_TIMEOUT + 10
 
 
 class LltJbd_Ble(LltJbd):
     BATTERYTYPE = "LLT/JBD BLE"
+    # read methods of the READ_SCHEDULE and their commands, which are sent at once
+    PIPELINED_COMMANDS = {
+        "read_gen_data": "command_general",
+        "read_cell_data": "command_cell",
+    }
 
     def __init__(self, port: Optional[str], baud: Optional[int], address: str):
         super(LltJbd_Ble, self).__init__(port, -1, address)
@@ -33,28 +40,24 @@ class LltJbd_Ble(LltJbd):
         self.main_thread = threading.current_thread()
         self.data: bytearray = bytearray()
         self.run = True
-        self.bt_thread = threading.Thread(
-            name="LltJbd_Ble_Loop", target=self.background_loop, daemon=True
-        )
+        # the connection runs as coroutine in the thread of the BLE manager
+        self.manager = get_ble_manager()
+        self.manager.register(address)
+        self.bt_task: Optional[concurrent.futures.Future] = None
         self.bt_loop: Optional[asyncio.AbstractEventLoop] = None
         self.bt_client: Optional[BleakClient] = None
         self.device: Optional[BLEDevice] = None
-        self.response_queue: Optional[asyncio.Queue] = None
-        self.ready_event: Optional[asyncio.Event] = None
-
-        self.hci_uart_ok = True
-        if not os.path.isfile("/tmp/dbus-blebattery-hciattach"):
-            execfile = open("/tmp/dbus-blebattery-hciattach", "w")
-            execpath = os.popen("ps -ww | grep hciattach | grep -v grep").read()
-            execpath = re.search("/usr/bin/hciattach.+", execpath)
-            execfile.write(execpath.group())
-            execfile.close()
-        else:
-            execpath = os.popen("ps -ww | grep hciattach | grep -v grep").read()
-            if not execpath:
-                execfile = open("/tmp/dbus-blebattery-hciattach", "r")
-                os.system(execfile.readline())
-                execfile.close()
+        self.ready_event = threading.Event()
+
+        # the notifications are subscribed once per connection, the replies are assigned to the
+        # requests by the register byte, that the BMS echoes in the reply
+        self.rx_buffer = bytearray()
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.request_time: Dict[int, float] = {}
+
+        # send the read commands of a poll at once, disabled if the BMS drops a pipelined request
+        self.pipeline = True
+        self.prefetched: Dict[bytes, concurrent.futures.Future] = {}
 
         logger.info("Init of LltJbd_Ble at " + address)
 
@@ -65,61 +68,88 @@ class LltJbd_Ble(LltJbd):
         return self.device.name
 
     def on_disconnect(self, client):
-        logger.info("BLE client disconnected")
+        logger.info("BLE client " + self.address + " disconnected")
+        # do not let the waiting requests run into the timeout
+        for future in self.pending.values():
+            if not future.done():
+                future.set_result(False)
+        self.pending.clear()
 
-    async def bt_main_loop(self):
-        try:
-            self.device = await BleakScanner.find_device_by_address(
-                self.address, cb=dict(use_bdaddr=True)
-            )
+    def on_notification(self, sender, data: bytearray) -> None:
+        """
+        Assemble the notifications to frames and pass each frame to the waiting request
+        """
+        buffer = self.rx_buffer
+        buffer.extend(data)
+        while buffer:
+            # skip everything in front of the start byte
+            if buffer[0] != 0xDD:
+                start = buffer.find(b"\xdd")
+                del buffer[: len(buffer) if start == -1 else start]
+                continue
+
+            if len(buffer) <= self.LENGTH_POS:
+                return
+            # start, register, status, length, payload, checksum (2 bytes), end
+            frame_length = buffer[self.LENGTH_POS] + 7
+            if len(buffer) < frame_length:
+                return
 
-        except Exception:
-            exception_type, exception_object, exception_traceback = sys.exc_info()
-            file = exception_traceback.tb_frame.f_code.co_filename
-            line = exception_traceback.tb_lineno
-            if "Bluetooth adapters" in repr(exception_object):
-                self.reset_hci_uart()
-            else:
-                logger.error(
-                    f"BleakScanner(): Exception occurred: {repr(exception_object)} of type {exception_type} "
-                    f"in {file} line #{line}"
-                )
-
-            self.device = None
-            await asyncio.sleep(0.5)
-            # allow the bluetooth connection to recover
-            sleep(5)
+            frame = bytes(buffer[:frame_length])
+            del buffer[:frame_length]
+            self.on_reply(frame)
 
+    def on_reply(self, frame: bytes) -> None:
+        register = frame[1]
+        future = self.pending.pop(register, None)
+        if future is None or future.done():
+            logger.debug("BLE reply without request for register 0x%02X", register)
+            return
+
+        # the round trip is published with the serial wait time in /Debug/Perf
+        latency = time() - self.request_time[register]
+        serial_stats.add(1, len(frame), latency)
+        logger.debug(
+            "BLE reply for register 0x%02X after %.0f ms", register, latency * 1000
+        )
+        future.set_result(frame)
+
+    async def bt_main_loop(self):
+        """
+        Connect to the BMS and reconnect, until the battery is stopped.
+        Runs in the thread of the BLE manager.
+        """
+        while self.run and self.main_thread.is_alive():
+            await self.manager.wait_retry(self.address)
+            await self.bt_connection()
+
+    async def bt_connection(self):
+        self.device = await self.manager.find_device(self.address)
         if not self.device:
-            self.run = False
+            logger.error(">>> ERROR: BLE device " + self.address + " not found")
+            self.manager.report_error(self.address)
             return
 
+        client = None
         try:
-            async with BleakClient(
-                self.device, disconnected_callback=self.on_disconnect
-            ) as client:
-                self.bt_client = client
-                self.bt_loop = asyncio.get_event_loop()
-                self.response_queue = asyncio.Queue()
-                self.ready_event.set()
-                while self.run and client.is_connected and self.main_thread.is_alive():
-                    await asyncio.sleep(0.1)
-            self.bt_loop = None
+            await self.manager.acquire_slot(self.address)
+            client = BleakClient(self.device, disconnected_callback=self.on_disconnect)
+            await self.manager.connect(self.address, client)
+            self.rx_buffer.clear()
+            await client.start_notify(BLE_CHARACTERISTICS_RX_UUID, self.on_notification)
+            self.bt_client = client
+            self.bt_loop = asyncio.get_event_loop()
+            self.ready_event.set()
+            while self.run and client.is_connected and self.main_thread.is_alive():
+                # other BMS are waiting for a connection, reconnect after them
+                if not self.pending and self.manager.slot_expired(self.address):
+                    logger.debug("Handing over the BLE connection slot")
+                    self.manager.hand_over_slot(self.address)
+                    break
+                await asyncio.sleep(0.1)
 
         # Exception occurred: TimeoutError() of type <class 'asyncio.exceptions.TimeoutError'>
-        except asyncio.exceptions.TimeoutError:
-            exception_type, exception_object, exception_traceback = sys.exc_info()
-            file = exception_traceback.tb_frame.f_code.co_filename
-            line = exception_traceback.tb_lineno
-            logger.error(
-                f"BleakClient(): asyncio.exceptions.TimeoutError: {repr(exception_object)} of type {exception_type} "
-                f"in {file} line #{line}"
-            )
-            # needed?
-            self.run = False
-            return
-
-        except TimeoutError:
+        except (asyncio.exceptions.TimeoutError, TimeoutError):
             exception_type, exception_object, exception_traceback = sys.exc_info()
             file = exception_traceback.tb_frame.f_code.co_filename
             line = exception_traceback.tb_lineno
@@ -127,9 +157,7 @@ class LltJbd_Ble(LltJbd):
                 f"BleakClient(): TimeoutError: {repr(exception_object)} of type {exception_type} "
                 f"in {file} line #{line}"
             )
-            # needed?
-            self.run = False
-            return
+            self.manager.report_error(self.address, exception_object)
 
         except Exception:
             exception_type, exception_object, exception_traceback = sys.exc_info()
@@ -139,32 +167,17 @@ class LltJbd_Ble(LltJbd):
                 f"BleakClient(): Exception occurred: {repr(exception_object)} of type {exception_type} "
                 f"in {file} line #{line}"
             )
-            # needed?
-            self.run = False
-            return
+            self.manager.report_error(self.address, exception_object)
 
-    def background_loop(self):
-        while self.run and self.main_thread.is_alive():
-            asyncio.run(self.bt_main_loop())
-
-    async def async_test_connection(self):
-        if self.hci_uart_ok:
-            self.ready_event = asyncio.Event()
-            if not self.bt_thread.is_alive():
-                self.bt_thread.start()
-
-                def shutdown_ble_atexit(thread):
-                    self.run = False
-                    thread.join()
-
-                atexit.register(shutdown_ble_atexit, self.bt_thread)
-            try:
-                return await asyncio.wait_for(self.ready_event.wait(), timeout=5)
-            except asyncio.TimeoutError:
-                logger.error(">>> ERROR: Unable to connect with BLE device")
-                return False
-        else:
-            return False
+        finally:
+            self.bt_loop = None
+            self.bt_client = None
+            if client is not None and client.is_connected:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+            self.manager.release_slot(self.address)
 
     def test_connection(self):
         # call a function that will connect to the battery, send a command and retrieve the result.
@@ -175,11 +188,17 @@ class LltJbd_Ble(LltJbd):
         try:
             if self.address:
                 result = True
-            if result and asyncio.run(self.async_test_connection()):
-                result = True
+            if result:
+                if self.bt_task is None or self.bt_task.done():
+                    self.run = True
+                    self.bt_task = self.manager.submit(self.bt_main_loop())
+                result = self.ready_event.wait(CONNECT_TIMEOUT)
+                if not result:
+                    logger.error(">>> ERROR: Unable to connect with BLE device")
             if result:
                 result = super().test_connection()
             if not result:
+                # keep connecting in the background, the driver tests the BMS again later
                 logger.error("No BMS found at " + self.address)
         except Exception:
             exception_type, exception_object, exception_traceback = sys.exc_info()
@@ -202,80 +221,107 @@ class LltJbd_Ble(LltJbd):
         string = self.address.replace(":", "").lower()
         return string
 
-    async def send_command(self, command) -> Union[bytearray, bool]:
-        if not self.bt_client:
+    async def send_command(self, command: bytes) -> Union[bytes, bool]:
+        """
+        Send a command and wait for the reply. Runs in the event loop of the BLE thread.
+
+        :param command: The command, the third byte is the register
+        :return: The reply frame or False
+        """
+        if not self.bt_client or not self.bt_client.is_connected:
             logger.error(">>> ERROR: No BLE client connection - returning")
             return False
 
-        fut = self.bt_loop.create_future()
-
-        def rx_callback(future: asyncio.Future, data: bytearray, sender, rx: bytearray):
-            data.extend(rx)
-            if len(data) < (self.LENGTH_POS + 1):
-                return
-
-            length = data[self.LENGTH_POS]
-            if len(data) <= length + self.LENGTH_POS + 1:
-                return
-            if not future.done():
-                future.set_result(data)
+        register = command[2]
+        previous = self.pending.get(register)
+        if previous is not None and not previous.done():
+            # the replies to the same register can not be told apart, wait for the previous one
+            await asyncio.wait([previous], timeout=REPLY_TIMEOUT)
 
-        rx_collector = functools.partial(rx_callback, fut, bytearray())
-        await self.bt_client.start_notify(BLE_CHARACTERISTICS_RX_UUID, rx_collector)
+        future = self.bt_loop.create_future()
+        self.pending[register] = future
+        self.request_time[register] = time()
         await self.bt_client.write_gatt_char(
             BLE_CHARACTERISTICS_TX_UUID, command, False
         )
-        result = await fut
-        await self.bt_client.stop_notify(BLE_CHARACTERISTICS_RX_UUID)
+        try:
+            return await asyncio.wait_for(future, REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            if self.pending.get(register) is future:
+                del self.pending[register]
+            return False
 
-        return result
+    def prefetch(self, commands: Iterable[bytes]) -> None:
+        """
+        Send the commands at once, without waiting for the replies in between.
+        `read_serial_data_llt()` takes the reply, when the command is read.
 
-    async def async_read_serial_data_llt(self, command):
-        if self.hci_uart_ok:
-            try:
-                bt_task = asyncio.run_coroutine_threadsafe(
-                    self.send_command(command), self.bt_loop
-                )
-                result = await asyncio.wait_for(asyncio.wrap_future(bt_task), 20)
-                return result
-            except asyncio.TimeoutError:
-                logger.error(">>> ERROR: No reply - returning")
-                return False
-            except BleakDBusError:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logger.error(
-                    f"BleakDBusError: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
-                )
-                self.reset_bluetooth()
-                return False
-            except Exception:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logger.error(
-                    f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
-                )
-                self.reset_bluetooth()
-                return False
-        else:
-            return False
+        :param commands: The read commands
+        """
+        if not self.bt_loop:
+            return
+        for command in commands:
+            self.prefetched[command] = asyncio.run_coroutine_threadsafe(
+                self.send_command(command), self.bt_loop
+            )
+
+    def refresh_data(self):
+        # the BMS handed over its connection to other BMS and waits for its next turn,
+        # keep the last values instead of counting the missing data as failed read
+        if self.manager.waiting_for_slot(self.address):
+            return True
+
+        self.write_charge_discharge_mos()
+        self.write_balancer()
+        if self.pipeline:
+            self.prefetch(
+                getattr(self, self.PIPELINED_COMMANDS[method])
+                for method, tier in self.READ_SCHEDULE
+                if method in self.PIPELINED_COMMANDS and self.tier_due(tier)
+            )
+        return self.run_read_schedule()
 
     def read_serial_data_llt(self, command):
         if not self.bt_loop:
             return False
         try:
-            data = asyncio.run(self.async_read_serial_data_llt(command))
+            data = False
+            prefetched = self.prefetched.pop(command, None)
+            if prefetched is not None:
+                data = prefetched.result(REPLY_TIMEOUT + 1)
+                if data is False and self.bt_client and self.bt_client.is_connected:
+                    logger.warning(
+                        "BLE BMS did not answer a pipelined request, sending the requests one by one"
+                    )
+                    self.pipeline = False
+
+            if data is False:
+                data = asyncio.run_coroutine_threadsafe(
+                    self.send_command(command), self.bt_loop
+                ).result(REPLY_TIMEOUT + 1)
+
+            if data is False:
+                logger.error(">>> ERROR: No reply - returning")
+                return False
             return self.validate_packet(data)
-        except CancelledError as e:
+        except (CancelledError, concurrent.futures.CancelledError) as e:
             logger.error(">>> ERROR: No reply - canceled - returning")
             logger.error(e)
             return False
-        # except Exception as e:
-        #     logger.error(">>> ERROR: No reply - returning")
-        #     logger.error(e)
-        #     return False
+        except concurrent.futures.TimeoutError:
+            logger.error(">>> ERROR: No reply - returning")
+            return False
+        except BleakDBusError:
+            exception_type, exception_object, exception_traceback = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(
+                f"BleakDBusError: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
+            )
+            self.manager.loop.call_soon_threadsafe(
+                self.manager.report_error, self.address, exception_object
+            )
+            return False
         except Exception:
             exception_type, exception_object, exception_traceback = sys.exc_info()
             file = exception_traceback.tb_frame.f_code.co_filename
@@ -285,41 +331,6 @@ class LltJbd_Ble(LltJbd):
             )
             return False
 
-    def reset_bluetooth(self):
-        logger.error("Reset of system Bluetooth daemon triggered")
-        self.bt_loop = False
-
-        # process kill is needed, since the service/bluetooth driver is probably freezed
-        # os.system('pkill -f "bluetoothd"')
-        # stop will not work, if service/bluetooth driver is stuck
-        os.system("/etc/init.d/bluetooth stop")
-        sleep(2)
-        os.system("rfkill block bluetooth")
-        os.system("rfkill unblock bluetooth")
-        os.system("/etc/init.d/bluetooth start")
-        logger.error("System Bluetooth daemon should have been restarted")
-        sleep(5)
-        sys.exit(1)
-
-    def reset_hci_uart(self):
-        logger.error("Reset of hci_uart stack... Reconnecting to: " + self.address)
-        self.run = False
-        os.system("pkill -f 'hciattach'")
-        sleep(0.5)
-        os.system("rmmod hci_uart")
-        os.system("rmmod btbcm")
-        os.system("modprobe hci_uart")
-        os.system("modprobe btbcm")
-        sys.exit(1)
-        # execfile = open("/tmp/dbus-blebattery-hciattach", "r")
-        # sleep(5)
-        # os.system(execfile.readline())
-        # os.system(execfile.readline())
-        # execfile.close()
-        # sleep(0.5)
-        # os.system("bluetoothctl connect " + self.address)
-        # self.run = True
-
 
 if __name__ == "__main__":
     bat = LltJbd_Ble("Foo", -1, sys.argv[1])
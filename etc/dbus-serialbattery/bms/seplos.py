@@ -5,9 +5,11 @@
 # https://github.com/Louisvdw/dbus-serialbattery/pull/530
 
 from battery import Protection, Battery, Cell
-from utils import logger
+from decoding import FrameLayout, unpack_array
+from utils import logger, serial_port_pool
+import binascii
+import logging
 import utils
-import serial
 import sys
 
 
@@ -25,6 +27,20 @@ class Seplos(Battery):
     COMMAND_PROTOCOL_VERSION = 0x4F
     COMMAND_VENDOR_INFO = 0x51
 
+    # values of the hex decoded status data, the cell voltages start at position 3
+    STATUS_LAYOUT = FrameLayout(
+        (
+            ("cell_count", 2, "B"),
+            ("temps", 36, "6H"),
+            ("current", 48, "h"),
+            ("voltage", 50, "H"),
+            ("capacity_remain", 52, "H"),
+            ("capacity", 55, "H"),
+            ("soc", 57, "H"),
+            ("charge_cycles", 61, "H"),
+        )
+    )
+
     @staticmethod
     def int_from_1byte_hex_ascii(data: bytes, offset: int, signed=False):
         return int.from_bytes(
@@ -160,8 +176,8 @@ class Seplos(Battery):
 
         try:
             logger.debug("alarm info raw {}".format(data))
-            return self.decode_alarm_data(bytes.fromhex(data.decode("ascii")))
-        except (ValueError, UnicodeDecodeError) as e:
+            return self.decode_alarm_data(binascii.unhexlify(data))
+        except ValueError as e:
             logger.warning("could not hex-decode raw alarm data", exc_info=e)
             return False
 
@@ -232,38 +248,21 @@ class Seplos(Battery):
         return True
 
     def decode_status_data(self, data):
-        cell_count_offset = 4
-        voltage_offset = 6
-        temps_offset = 72
-        self.cell_count = Seplos.int_from_1byte_hex_ascii(
-            data=data, offset=cell_count_offset
-        )
+        # the data is transmitted as ASCII hex characters, decode all of it at once
+        data = binascii.unhexlify(data)
+        values = self.STATUS_LAYOUT.unpack(data)
+        self.cell_count = values["cell_count"]
         if self.cell_count == len(self.cells):
-            for i in range(self.cell_count):
-                voltage = (
-                    Seplos.int_from_2byte_hex_ascii(data, voltage_offset + i * 4) / 1000
-                )
-                self.cells[i].voltage = voltage
-                logger.debug("Voltage cell[{}]={}V".format(i, voltage))
-
-        self.temp1 = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 0 * 4) - 2731
-        ) / 10
-        self.temp2 = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 1 * 4) - 2731
-        ) / 10
-        self.temp3 = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 2 * 4) - 2731
-        ) / 10
-        self.temp4 = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 3 * 4) - 2731
-        ) / 10
-        temp_environment = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 4 * 4) - 2731
-        ) / 10  # currently not available in the Battery class
-        self.temp_mos = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 5 * 4) - 2731
-        ) / 10
+            self.cells.set_voltages(unpack_array(data, self.cell_count, 3), 1000)
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, cell in enumerate(self.cells):
+                    logger.debug("Voltage cell[{}]={}V".format(i, cell.voltage))
+
+        temps = [(value - 2731) / 10 for value in values["temps"]]
+        self.temp1, self.temp2, self.temp3, self.temp4 = temps[:4]
+        # currently not available in the Battery class
+        temp_environment = temps[4]
+        self.temp_mos = temps[5]
         logger.debug("Temp cell1={}°C".format(self.temp1))
         logger.debug("Temp cell2={}°C".format(self.temp2))
         logger.debug("Temp cell3={}°C".format(self.temp3))
@@ -274,14 +273,12 @@ class Seplos(Battery):
             )
         )
 
-        self.current = (
-            Seplos.int_from_2byte_hex_ascii(data, offset=96, signed=True) / 100
-        )
-        self.voltage = Seplos.int_from_2byte_hex_ascii(data, offset=100) / 100
-        self.capacity_remain = Seplos.int_from_2byte_hex_ascii(data, offset=104) / 100
-        self.capacity = Seplos.int_from_2byte_hex_ascii(data, offset=110) / 100
-        self.soc = Seplos.int_from_2byte_hex_ascii(data, offset=114) / 10
-        self.history.charge_cycles = Seplos.int_from_2byte_hex_ascii(data, offset=122)
+        self.current = values["current"] / 100
+        self.voltage = values["voltage"] / 100
+        self.capacity_remain = values["capacity_remain"] / 100
+        self.capacity = values["capacity"] / 100
+        self.soc = values["soc"] / 10
+        self.history.charge_cycles = values["charge_cycles"]
         self.hardware_version = "Seplos BMS {}S".format(self.cell_count)
         logger.debug("Current = {}A , Voltage = {}V".format(self.current, self.voltage))
         logger.debug(
@@ -321,7 +318,7 @@ class Seplos(Battery):
     def read_serial_data_seplos(self, command):
         logger.debug("read serial data seplos")
 
-        with serial.Serial(self.port, baudrate=self.baud_rate, timeout=1) as ser:
+        with serial_port_pool.acquire(self.port, self.baud_rate, timeout=1) as ser:
             ser.flushOutput()
             ser.flushInput()
             written = ser.write(command)
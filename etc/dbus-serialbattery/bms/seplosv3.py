@@ -10,13 +10,25 @@ from typing import Union
 
 import minimalmodbus
 import serial
-from battery import Battery, Cell, Protection
+from battery import Battery, Cell, Protection, ReadTier
 from utils import logger, SEPLOS_USE_BMS_VALUES
 
 RETRYCNT = 3
 
 
 class Seplosv3(Battery):
+    READ_SCHEDULE = (
+        # cell count, capacity and settings, with SEPLOS_USE_BMS_VALUES also the charge limits of the BMS
+        (
+            "read_system_parameters",
+            ReadTier.MEDIUM if SEPLOS_USE_BMS_VALUES else ReadTier.SLOW,
+        ),
+        ("read_pack_info", ReadTier.FAST),
+        ("read_cell_info", ReadTier.FAST),
+        ("read_system_control", ReadTier.FAST),
+        ("read_alarm_info", ReadTier.FAST),
+    )
+
     def __init__(self, port, baud, address):
         super(Seplosv3, self).__init__(port, baud, address)
         self.type = "Seplosv3_BMS_modbus"
@@ -148,33 +160,50 @@ class Seplosv3(Battery):
         self.load_connected = True
         return True
 
-    def read_device_date(self):
-        spa, pia, pib, sca, pic, sfa = None, None, None, None, None, None
+    def read_block(
+        self, address: int, count: int, bits: bool = False
+    ) -> Union[list, None]:
+        """
+        Read a block of input registers or discrete inputs
+
+        :param address: First register
+        :param count: Number of registers or bits
+        :param bits: Read discrete inputs instead of registers
+        :return: List of values or None, if the BMS did not answer
+        """
         try:
             mb = self.get_modbus(self.slaveaddress)
-            spa = mb.read_registers(
-                registeraddress=0x1300, number_of_registers=0x6A, functioncode=4
-            )
-            pia = mb.read_registers(
-                registeraddress=0x1000, number_of_registers=0x12, functioncode=4
-            )
-            pib = mb.read_registers(
-                registeraddress=0x1100, number_of_registers=0x1A, functioncode=4
-            )
-            sca = mb.read_registers(
-                registeraddress=0x1500, number_of_registers=0x04, functioncode=4
-            )
-            pic = mb.read_bits(0x1200, number_of_bits=0x90, functioncode=1)
-            sfa = mb.read_bits(0x1400, number_of_bits=0x50, functioncode=1)
-            logger.debug(f"spa: {spa}")
-            logger.debug(f"pia: {pia}")
-            logger.debug(f"pib: {pib}")
-            logger.debug(f"sca: {sca}")
-            logger.debug(f"sfa: {sfa}")
-            logger.debug(f"pic: {pic}")
+            if bits:
+                data = mb.read_bits(address, number_of_bits=count, functioncode=1)
+            else:
+                data = mb.read_registers(
+                    registeraddress=address, number_of_registers=count, functioncode=4
+                )
+            logger.debug(f"0x{address:04X}: {data}")
+            return data
         except Exception as e:
             logger.info(f"Error getting data {e}")
-        return spa, pia, pib, sca, pic, sfa
+            return None
+
+    def read_system_parameters(self) -> bool:
+        spa = self.read_block(0x1300, 0x6A)
+        return spa is not None and self.update_sysinfo(spa)
+
+    def read_pack_info(self) -> bool:
+        pia = self.read_block(0x1000, 0x12)
+        return pia is not None and self.update_pack_info(pia)
+
+    def read_cell_info(self) -> bool:
+        pib = self.read_block(0x1100, 0x1A)
+        return pib is not None and self.update_cells(pib)
+
+    def read_system_control(self) -> bool:
+        pic = self.read_block(0x1200, 0x90, bits=True)
+        return pic is not None and self.update_system_control(pic)
+
+    def read_alarm_info(self) -> bool:
+        sfa = self.read_block(0x1400, 0x50, bits=True)
+        return sfa is not None and self.update_alarms(sfa)
 
     def update_cells(self, pib) -> bool:
         try:
@@ -277,7 +306,7 @@ class Seplosv3(Battery):
             return False
         return True
 
-    def update_system_control(self, pic, sca) -> bool:
+    def update_system_control(self, pic) -> bool:
         try:
             self.discharge_fet = True if pic[0x78] == 1 else False
             self.charge_fet = True if pic[0x79] == 1 else False
@@ -292,39 +321,10 @@ class Seplosv3(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
-        spa, pia, pib, sca, pic, sfa = self.read_device_date()
-        results = []
-        if spa is None:
-            results.append(False)
-        else:
-            results.append(self.update_sysinfo(spa))
-
-        if pia is None:
-            results.append(False)
-        else:
-            results.append(self.update_pack_info(pia))
-
-        if pib is None:
-            results.append(False)
-        else:
-            results.append(self.update_cells(pib))
-
-        if sca is None or pic is None:
-            results.append(False)
-        else:
-            results.append(self.update_system_control(pic, sca))
-            pass
-
-        if sfa is None:
-            results.append(False)
-        else:
-            results.append(self.update_alarms(sfa))
-
-        for result in results:
-            if result is False:
-                logger.info(
-                    f"Updating Seplos v3 {self.hardware_version} {self.serialnumber} failed: {results}"
-                )
-                return False
+        if not self.run_read_schedule():
+            logger.info(
+                f"Updating Seplos v3 {self.hardware_version} {self.serialnumber} failed"
+            )
+            return False
         logger.debug(f"Updating Seplos v3 {self.hardware_version} {self.serialnumber}")
         return True
@@ -5,9 +5,18 @@
 # https://github.com/Louisvdw/dbus-serialbattery/commit/7aab4c850a5c8d9c205efefc155fe62bb527da8e
 
 from battery import Battery, Cell
-from utils import kelvin_to_celsius, read_serial_data, logger
+from utils import (
+    Framing,
+    kelvin_to_celsius,
+    read_serial_data,
+    read_serialport_data,
+    serial_port_pool,
+    logger,
+)
 import utils
 from struct import unpack_from
+from time import time
+import serial
 import sys
 
 
@@ -16,6 +25,25 @@ class Sinowealth(Battery):
         super(Sinowealth, self).__init__(port, baud, address)
         self.poll_interval = 2000
         self.type = self.BATTERYTYPE
+        self.batch_read = utils.SINOWEALTH_BATCH_READ
+        self.batch_verified = set()
+        """
+        First registers of the batched reads, that were compared with a single read
+        """
+        self.batch_failures = 0
+        """
+        Number of batched requests that failed in a row
+        """
+        self.batch_retry_time = None
+        """
+        Timestamp when batched reads are tried again, after they were disabled
+        """
+        self.transactions = 0
+        """
+        Number of requests sent in the current poll cycle
+        """
+        self.transactions_last_cycle = 0
+        self._ser = None
 
     # command bytes [StartFlag=0A][Command byte][response dataLength=2 to 20 bytes][checksum]
     command_base = b"\x0A\x00\x04"
@@ -38,6 +66,17 @@ class Sinowealth(Battery):
     BATTERYTYPE = "Sinowealth"
     LENGTH_CHECK = 0
     LENGTH_POS = 0
+    REGISTER_LENGTH = 4
+    # the BMS answers with 2 to 20 bytes, this are 10 registers of 2 bytes each
+    MAX_BATCH_REGISTERS = 10
+    # maximum difference of a register between a batched and a single read, e.g. a cell voltage
+    # in mV or a temperature in 0.1 K that changed between the two requests
+    BATCH_VERIFY_TOLERANCE = 50
+    # batched reads are disabled after this number of failed batched requests in a row,
+    # a single failure is often just a disturbed frame
+    BATCH_MAX_FAILURES = 3
+    # seconds after that disabled batched reads are tried again
+    BATCH_RETRY_INTERVAL = 600
 
     def test_connection(self):
         """
@@ -89,6 +128,35 @@ class Sinowealth(Battery):
         return True
 
     def refresh_data(self):
+        self.transactions = 0
+        if (
+            not self.batch_read
+            and self.batch_retry_time is not None
+            and time() >= self.batch_retry_time
+        ):
+            logger.info(">>> INFO: Trying batched reads again")
+            self.batch_read = True
+            self.batch_retry_time = None
+        try:
+            # keep the port for the whole cycle, registers that have to be read singly
+            # are sent back to back without acquiring the port for each request
+            with serial_port_pool.acquire(self.port, self.baud_rate) as ser:
+                self._ser = ser
+                result = self.read_data()
+        # e.g. the USB adapter was unplugged, same as read_serial_data() the poll fails
+        except (serial.SerialException, OSError) as e:
+            logger.error(e)
+            result = False
+        finally:
+            self._ser = None
+
+        self.transactions_last_cycle = self.transactions
+        logger.debug(
+            ">>> INFO: Requests in this cycle: %u", self.transactions_last_cycle
+        )
+        return result
+
+    def read_data(self):
         result = self.read_soc()
         result = result and self.read_status_data()
         result = result and self.read_battery_status()
@@ -244,10 +312,101 @@ class Sinowealth(Battery):
         if self.cell_count is None:
             self.read_pack_config_data()
 
+        if self.batch_read:
+            cell_data = self.read_registers(self.command_cell_base[0], self.cell_count)
+            if cell_data is not False:
+                self.cells.set_voltages(
+                    unpack_from(">%dH" % self.cell_count, cell_data), 1000
+                )
+                return True
+
         for c in range(self.cell_count):
             self.cells[c].voltage = self.read_cell_voltage(c + 1)
         return True
 
+    def read_registers(self, start, count):
+        """
+        Read `count` consecutive 2 byte registers beginning at register `start`
+        with as few requests as possible.
+        If a batched request fails, False is returned, so that the caller can fall back to single register reads.
+        Batched reads are disabled for `BATCH_RETRY_INTERVAL` seconds, if the batched and the single read
+        do not match or `BATCH_MAX_FAILURES` batched requests failed in a row.
+
+        The third byte of a request is the number of data bytes the BMS answers with, not a register count.
+        The single reads always request 4 bytes, since some registers (current, capacity) are 32 bit values,
+        the 16 bit registers only use the first 2 bytes of the reply. A batch of 16 bit registers
+        (cell voltages, temperatures) therefore requests 2 bytes per register. There is no protocol
+        documentation that confirms, that the BMS answers with the following registers,
+        so the first batch of each start register is compared with a single read of its last register.
+
+        :param start: First register
+        :param count: Number of registers
+        :return: The register data without checksums or False
+        """
+        data = bytearray()
+        for offset in range(0, count, self.MAX_BATCH_REGISTERS):
+            registers = min(self.MAX_BATCH_REGISTERS, count - offset)
+            register_data = self.read_serial_data_sinowealth(
+                (start + offset).to_bytes(1, byteorder="little"), registers * 2
+            )
+            # the reply holds the requested bytes and the checksum, a shorter reply would shift all registers
+            if register_data is False or len(register_data) < registers * 2 + 1:
+                logger.warning(
+                    ">>> WARNING: Batched read of registers %u-%u failed, falling back to single reads",
+                    start + offset,
+                    start + offset + registers - 1,
+                )
+                self.batch_failed()
+                return False
+            data += register_data[: registers * 2]
+
+        if start not in self.batch_verified:
+            last_register = self.read_serial_data_sinowealth(
+                (start + count - 1).to_bytes(1, byteorder="little")
+            )
+            if last_register is False:
+                self.batch_failed()
+                return False
+            if (
+                abs(
+                    unpack_from(">H", data, len(data) - 2)[0]
+                    - unpack_from(">H", last_register)[0]
+                )
+                > self.BATCH_VERIFY_TOLERANCE
+            ):
+                logger.warning(
+                    ">>> WARNING: Batched read of registers %u-%u does not match the single read",
+                    start,
+                    start + count - 1,
+                )
+                self.disable_batch_read()
+                return False
+            self.batch_verified.add(start)
+
+        self.batch_failures = 0
+        return data
+
+    def batch_failed(self):
+        """
+        Count a failed batched request and disable batched reads after `BATCH_MAX_FAILURES` in a row
+        """
+        self.batch_failures += 1
+        if self.batch_failures >= self.BATCH_MAX_FAILURES:
+            self.disable_batch_read()
+
+    def disable_batch_read(self):
+        """
+        Use single reads for `BATCH_RETRY_INTERVAL` seconds, then verify the batched reads again
+        """
+        logger.warning(
+            ">>> WARNING: Batched reads disabled, trying again in %u s",
+            self.BATCH_RETRY_INTERVAL,
+        )
+        self.batch_read = False
+        self.batch_retry_time = time() + self.BATCH_RETRY_INTERVAL
+        self.batch_failures = 0
+        self.batch_verified.clear()
+
     def read_cell_voltage(self, cell_index):
         cell_data = self.read_serial_data_sinowealth(
             cell_index.to_bytes(1, byteorder="little")
@@ -264,6 +423,30 @@ class Sinowealth(Battery):
         if self.temp_sensors is None:
             return False
 
+        if self.batch_read:
+            # external 1, external 2, internal 1 and internal 2 are consecutive registers
+            temp_data = self.read_registers(self.command_temp_ext1[0], 4)
+            if temp_data is not False:
+                temp_ext1, temp_ext2, temp_int1, temp_int2 = unpack_from(
+                    ">HHHH", temp_data
+                )
+                self.to_temp(1, kelvin_to_celsius(temp_ext1 / 10))
+                logger.debug(">>> INFO: BMS external temperature 1: %f C", self.temp1)
+                if self.temp_sensors == 2:
+                    self.to_temp(2, kelvin_to_celsius(temp_ext2 / 10))
+                    logger.debug(
+                        ">>> INFO: BMS external temperature 2: %f C", self.temp2
+                    )
+                logger.debug(
+                    ">>> INFO: BMS internal temperature 1: %f C",
+                    kelvin_to_celsius(temp_int1 / 10),
+                )
+                logger.debug(
+                    ">>> INFO: BMS internal temperature 2: %f C",
+                    kelvin_to_celsius(temp_int2 / 10),
+                )
+                return True
+
         temp_ext1_data = self.read_serial_data_sinowealth(self.command_temp_ext1)
         if temp_ext1_data is False:
             return False
@@ -304,20 +487,26 @@ class Sinowealth(Battery):
         )
         return True
 
-    def generate_command(self, command):
+    def generate_command(self, command, length=REGISTER_LENGTH):
         buffer = bytearray(self.command_base)
         buffer[1] = command[0]
+        buffer[2] = length
         return buffer
 
-    def read_serial_data_sinowealth(self, command):
-        data = read_serial_data(
-            self.generate_command(command),
-            self.port,
-            self.baud_rate,
-            self.LENGTH_POS,
-            self.LENGTH_CHECK,
-            int(self.generate_command(command)[2]),
-        )
+    def read_serial_data_sinowealth(self, command, length=REGISTER_LENGTH):
+        framing = Framing(self.LENGTH_POS, self.LENGTH_CHECK, length_fixed=length)
+        self.transactions += 1
+        if self._ser is not None:
+            data = read_serialport_data(
+                self._ser, self.generate_command(command, length), framing=framing
+            )
+        else:
+            data = read_serial_data(
+                self.generate_command(command, length),
+                self.port,
+                self.baud_rate,
+                framing=framing,
+            )
         if data is False:
             return False
 
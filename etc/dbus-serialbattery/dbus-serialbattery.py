@@ -2,11 +2,12 @@
 # -*- coding: utf-8 -*-
 from typing import Union
 
-from time import sleep
-from datetime import datetime
+from time import sleep, time
 from dbus.mainloop.glib import DBusGMainLoop
 
+import signal
 import sys
+import threading
 
 from gi.repository import GLib as gobject
 
@@ -14,166 +15,60 @@ from gi.repository import GLib as gobject
 # from ve_utils import exit_on_error
 
 from dbushelper import DbusHelper
+from detection import BmsDetector, DetectionCache
+from iocore import IoCore
+from registry import CAN_BMS_TYPES, SERIAL_BMS_TYPES, get_bms_types
+from scheduler import BusScheduler
+import serialtrace
 from utils import logger
 import utils
 from battery import Battery
-import math
-
-# import battery classes
-from bms.daly import Daly
-from bms.ecs import Ecs
-from bms.eg4_lifepower import EG4_Lifepower
-from bms.eg4_ll import EG4_LL
-from bms.heltecmodbus import HeltecModbus
-from bms.hlpdatabms4s import HLPdataBMS4S
-from bms.jkbms import Jkbms
-from bms.jkbms_pb import Jkbms_pb
-from bms.lltjbd import LltJbd
-from bms.renogy import Renogy
-from bms.seplos import Seplos
-from bms.seplosv3 import Seplosv3
-
-# enabled only if explicitly set in config under "BMS_TYPE"
-if "ANT" in utils.BMS_TYPE:
-    from bms.ant import ANT
-if "MNB" in utils.BMS_TYPE:
-    from bms.mnb import MNB
-if "Sinowealth" in utils.BMS_TYPE:
-    from bms.sinowealth import Sinowealth
-
-supported_bms_types = [
-    {"bms": Daly, "baud": 9600, "address": b"\x40"},
-    {"bms": Daly, "baud": 9600, "address": b"\x80"},
-    {"bms": Ecs, "baud": 19200},
-    {"bms": EG4_Lifepower, "baud": 9600, "address": b"\x01"},
-    {"bms": EG4_LL, "baud": 9600, "address": b"\x01"},
-    {"bms": HeltecModbus, "baud": 9600, "address": b"\x01"},
-    {"bms": HLPdataBMS4S, "baud": 9600},
-    {"bms": Jkbms, "baud": 115200},
-    {"bms": Jkbms_pb, "baud": 115200, "address": b"\x01"},
-    {"bms": LltJbd, "baud": 9600},
-    {"bms": Renogy, "baud": 9600, "address": b"\x30"},
-    {"bms": Renogy, "baud": 9600, "address": b"\xF7"},
-    {"bms": Seplos, "baud": 19200, "address": b"\x00"},
-    {"bms": Seplosv3, "baud": 19200},
-]
-
-# enabled only if explicitly set in config under "BMS_TYPE"
-if "ANT" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": ANT, "baud": 19200})
-if "MNB" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": MNB, "baud": 9600})
-if "Sinowealth" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": Sinowealth, "baud": 9600})
-
-expected_bms_types = [
-    battery_type
-    for battery_type in supported_bms_types
-    if battery_type["bms"].__name__ in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0
-]
 
-logger.info("")
-logger.info("Starting dbus-serialbattery")
+# the battery classes are imported only when they are tested, see registry.py
+expected_bms_types = get_bms_types(SERIAL_BMS_TYPES, utils.BMS_TYPE)
 
+# time in seconds between the connection attempts to Bluetooth BMS, that were not reachable at startup
+BLE_RETRY_INTERVAL = 60
 
-# count loops
-loop_count = 0
+logger.info("")
+logger.info("Starting dbus-serialbattery")
 
 
 def main():
     # NameError: free variable 'expected_bms_types' referenced before assignment in enclosing scope
     global expected_bms_types
 
-    def poll_battery(loop) -> bool:
+    time_start = time()
+    first_poll = True
+
+    def poll_battery(loop, force: bool = False) -> bool:
         """
         Polls the battery for data and updates it on the dbus
         """
-        global loop_count
-
-        # count execution time in milliseconds
-        start = datetime.now()
-
-        for key_address in battery:
-            helper[key_address].publish_battery(loop)
-
-        runtime = (datetime.now() - start).total_seconds()
-        logger.debug(f"Polling data took {runtime:.3f} seconds")
-
-        # check if polling took too long and adjust poll interval, but only after 5 loops
-        # since the first polls are always slower
-        if loop_count > 5 and runtime > battery[first_key].poll_interval / 1000:
-            new_poll_interval = math.ceil(runtime + 0.8) * 1000
-            battery[first_key].poll_interval = new_poll_interval
-            logger.warning(
-                f"Polling took too long. Set to {new_poll_interval/1000:.3f} s"
+        nonlocal first_poll
+        # each battery is published as soon as its data was read, slow addresses
+        # get their own poll interval instead of slowing down all batteries
+        result = scheduler.run_cycle(loop, force)
+        if first_poll:
+            first_poll = False
+            logger.info(
+                f"Startup: first data published after {time() - time_start:.3f} s"
             )
-
-        loop_count += 1
-
-        return True
+        return result
 
     def get_battery(_port: str, _modbus_address: hex = None) -> Union[Battery, None]:
         # all the different batteries the driver support and need to test for
         # try to establish communications with the battery 3 times, else exit
-        retry = 1
-        retries = 3
-        while retry <= retries:
-            logger.info(
-                "-- Testing BMS: " + str(retry) + " of " + str(retries) + " rounds"
-            )
-            # create a new battery object that can read the battery and run connection test
-            for test in expected_bms_types:
-                # noinspection PyBroadException
-                try:
-                    if _modbus_address is not None:
-                        # convert hex string to bytes
-                        _bms_address = bytes.fromhex(_modbus_address.replace("0x", ""))
-                    elif "address" in test:
-                        _bms_address = test["address"]
-                    else:
-                        _bms_address = None
-
-                    logger.info(
-                        "Testing "
-                        + test["bms"].__name__
-                        + (
-                            ' at address "'
-                            + utils.bytearray_to_string(_bms_address)
-                            + '"'
-                            if _bms_address is not None
-                            else ""
-                        )
-                    )
-                    batteryClass = test["bms"]
-                    baud = test["baud"]
-                    battery: Battery = batteryClass(
-                        port=_port, baud=baud, address=_bms_address
-                    )
-                    if battery.test_connection() and battery.validate_data():
-                        logger.info(
-                            "Connection established to " + battery.__class__.__name__
-                        )
-                        return battery
-                except KeyboardInterrupt:
-                    return None
-                except Exception:
-                    (
-                        exception_type,
-                        exception_object,
-                        exception_traceback,
-                    ) = sys.exc_info()
-                    file = exception_traceback.tb_frame.f_code.co_filename
-                    line = exception_traceback.tb_lineno
-                    logger.error(
-                        "Non blocking exception occurred: "
-                        + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}"
-                    )
-                    # Ignore any malfunction test_function()
-                    pass
-            retry += 1
-            sleep(0.5)
-
-        return None
+        detector = BmsDetector(
+            _port,
+            expected_bms_types,
+            _modbus_address,
+            DetectionCache() if utils.BMS_DETECTION_CACHE else None,
+        )
+        try:
+            return detector.detect(3)
+        except KeyboardInterrupt:
+            return None
 
     def get_port() -> str:
         # Get the port we need to use from the argument
@@ -206,61 +101,68 @@ def main():
 
     port = get_port()
     battery = {}
+    # Bluetooth BMS, that were not reachable at startup, they are retried in the background
+    ble_pending = []
+
+    # record the serial traffic, to replay it with serialtrace.py
+    if utils.SERIAL_TRACE_FILE is not None:
+        serialtrace.start_capture(utils.SERIAL_TRACE_FILE)
 
     # wait some seconds to be sure that the serial connection is ready
     # else the error throw a lot of timeouts
     sleep(16)
 
-    if port.endswith("_Ble"):
+    if port == "Ble" or port.endswith("_Ble"):
         """
         Import ble classes only, if it's a ble port, else the driver won't start due to missing python modules
         This prevent problems when using the driver only with a serial connection
         """
 
-        if len(sys.argv) <= 2:
-            logger.error("Bluetooth address is missing in the command line arguments")
+        # one BMS: <BMS type> <MAC address>
+        # multiple BMS sharing the Bluetooth adapter: Ble <BMS type> <MAC address> [<BMS type> <MAC address> ...]
+        if port == "Ble":
+            ble_devices = list(zip(sys.argv[2::2], sys.argv[3::2]))
         else:
-            ble_address = sys.argv[2]
-
-            if port == "Jkbms_Ble":
-                # noqa: F401 --> ignore flake "imported but unused" error
-                from bms.jkbms_ble import Jkbms_Ble  # noqa: F401
+            ble_devices = [(port, sys.argv[2])] if len(sys.argv) > 2 else []
 
-            if port == "LltJbd_Ble":
-                # noqa: F401 --> ignore flake "imported but unused" error
-                from bms.lltjbd_ble import LltJbd_Ble  # noqa: F401
+        if not ble_devices:
+            logger.error("Bluetooth address is missing in the command line arguments")
 
-            class_ = eval(port)
+        # create all batteries first, so that the BLE manager scans for all of them at once
+        ble_batteries = []
+        for ble_type, ble_address in ble_devices:
+            if ble_type == "Jkbms_Ble":
+                from bms.jkbms_ble import Jkbms_Ble as class_
+            elif ble_type == "LltJbd_Ble":
+                from bms.lltjbd_ble import LltJbd_Ble as class_
+            else:
+                logger.error("Unknown Bluetooth BMS type " + ble_type)
+                continue
 
             # do not remove ble_ prefix, since the dbus service cannot be only numbers
-            testbms = class_(
-                "ble_" + ble_address.replace(":", "").lower(), 9600, ble_address
+            ble_batteries.append(
+                class_("ble_" + ble_address.replace(":", "").lower(), 9600, ble_address)
             )
 
+        for testbms in ble_batteries:
             if testbms.test_connection():
-                logger.info("Connection established to " + testbms.__class__.__name__)
-                battery[0] = testbms
+                logger.info(
+                    "Connection established to "
+                    + testbms.__class__.__name__
+                    + " at "
+                    + testbms.address
+                )
+                battery[testbms.address] = testbms
+            else:
+                ble_pending.append(testbms)
 
     elif port.startswith("can"):
         """
         Import CAN classes only, if it's a can port, else the driver won't start due to missing python modules
         This prevent problems when using the driver only with a serial connection
         """
-        from bms.daly_can import Daly_Can
-        from bms.jkbms_can import Jkbms_Can
-
         # only try CAN BMS on CAN port
-        supported_bms_types = [
-            {"bms": Daly_Can, "baud": 250000},
-            {"bms": Jkbms_Can, "baud": 250000},
-        ]
-
-        expected_bms_types = [
-            battery_type
-            for battery_type in supported_bms_types
-            if battery_type["bms"].__name__ in utils.BMS_TYPE
-            or len(utils.BMS_TYPE) == 0
-        ]
+        expected_bms_types = get_bms_types(CAN_BMS_TYPES, utils.BMS_TYPE)
 
         battery[0] = get_battery(port)
 
@@ -273,6 +175,8 @@ def main():
         else:
             battery[0] = get_battery(port)
 
+    logger.info(f"Startup: BMS detection finished after {time() - time_start:.3f} s")
+
     # check if at least one BMS was found
     battery_found = False
 
@@ -289,9 +193,6 @@ def main():
                 + str(key_address)
             )
 
-    # get first key from battery dict
-    first_key = list(battery.keys())[0]
-
     if not battery_found:
         logger.error(
             "ERROR >>> No battery connection at "
@@ -304,6 +205,21 @@ def main():
         )
         sys.exit(1)
 
+    # get first key from battery dict
+    first_key = list(battery.keys())[0]
+
+    for key_address in battery:
+        serialtrace.note(
+            port,
+            bms=type(battery[key_address]).__name__,
+            address=(
+                battery[key_address].address.hex()
+                if isinstance(battery[key_address].address, bytes)
+                else None
+            ),
+            baud=battery[key_address].baud_rate,
+        )
+
     # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
     DBusGMainLoop(set_as_default=True)
     if sys.version_info.major == 2:
@@ -314,7 +230,13 @@ def main():
     helper = {}
 
     for key_address in battery:
-        helper[key_address] = DbusHelper(battery[key_address], key_address)
+        # each Bluetooth BMS has its own port, it keeps the service name it had in its own process
+        helper[key_address] = DbusHelper(
+            battery[key_address],
+            0 if battery[key_address].port.startswith("ble_") else key_address,
+        )
+        # a failed battery must not take down the other batteries of the process
+        helper[key_address].quit_on_failure = len(battery) + len(ble_pending) == 1
         if not helper[key_address].setup_vedbus():
             logger.error(
                 "ERROR >>> Problem with battery set up at "
@@ -327,12 +249,33 @@ def main():
             )
             sys.exit(1)
 
-    # try using active callback on this battery (normally only used for Bluetooth BMS)
-    if not battery[first_key].use_callback(lambda: poll_battery(mainloop)):
-        # change poll interval if set in config
-        if utils.POLL_INTERVAL is not None:
-            battery[first_key].poll_interval = utils.POLL_INTERVAL
+    # change poll interval if set in config
+    if utils.POLL_INTERVAL is not None:
+        battery[first_key].poll_interval = utils.POLL_INTERVAL
+
+    # read the data in a separate thread, so that a slow BMS does not block the dbus service
+    io_core = None
+    if utils.IO_THREAD:
+        io_core = IoCore()
+        io_core.start()
+
+    # the scheduler polls all batteries on this port and adapts the poll interval of each battery
+    # between the poll interval and POLL_INTERVAL_MAX
+    scheduler = BusScheduler(
+        battery,
+        helper,
+        battery[first_key].poll_interval,
+        io_core,
+        utils.POLL_INTERVAL_MAX,
+    )
 
+    # try using active callback on this battery (normally only used for Bluetooth BMS)
+    # the callback polls all batteries, therefore multiple batteries are polled by the timer
+    if (
+        len(battery) > 1
+        or ble_pending
+        or not battery[first_key].use_callback(lambda: poll_battery(mainloop, True))
+    ):
         logger.info(f"Polling data every {battery[first_key].poll_interval/1000:.3f} s")
 
         # if not possible, poll the battery every poll_interval milliseconds
@@ -356,9 +299,9 @@ def main():
         if (
             utils.EXTERNAL_CURRENT_SENSOR_DBUS_DEVICE is not None
             and utils.EXTERNAL_CURRENT_SENSOR_DBUS_PATH is not None
-            and battery[0] is not None
+            and battery[first_key] is not None
         ):
-            battery[0].monitor_external_current()
+            battery[first_key].monitor_external_current()
     except Exception:
         # set to None to avoid crashing, fallback to battery current
         utils.EXTERNAL_CURRENT_SENSOR_DBUS_DEVICE = None
@@ -375,11 +318,70 @@ def main():
             + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}"
         )
 
+    def add_ble_battery(ble_battery: Battery) -> bool:
+        """
+        Publish a Bluetooth BMS, that connected after the start. Runs in the GLib main loop.
+        """
+        ble_helper = DbusHelper(ble_battery, 0)
+        if not ble_helper.setup_vedbus():
+            logger.error("ERROR >>> Problem with battery set up at " + ble_battery.port)
+            return False
+        ble_helper.quit_on_failure = False
+        ble_battery.log_settings()
+        if not utils.validate_config_values():
+            ble_battery.state = 10
+            ble_battery.error_code = 119
+        scheduler.add_battery(ble_battery.address, ble_battery, ble_helper)
+        return False
+
+    def retry_ble_batteries() -> None:
+        """
+        Retry the Bluetooth BMS, that were not reachable at startup, until all of them are connected
+        """
+        while ble_pending:
+            sleep(BLE_RETRY_INTERVAL)
+            for ble_battery in list(ble_pending):
+                if ble_battery.test_connection():
+                    logger.info(
+                        "Connection established to "
+                        + ble_battery.__class__.__name__
+                        + " at "
+                        + ble_battery.address
+                    )
+                    ble_pending.remove(ble_battery)
+                    gobject.idle_add(add_ble_battery, ble_battery)
+
+    if ble_pending:
+        logger.warning(
+            "Not connected to "
+            + ", ".join(ble_battery.address for ble_battery in ble_pending)
+            + ", retrying in the background"
+        )
+        threading.Thread(
+            target=retry_ble_batteries, name="BleRetry", daemon=True
+        ).start()
+
+    # stop the main loop on SIGTERM (e.g. svc -d), so that the settings are saved before exiting
+    def quit_mainloop() -> bool:
+        logger.info("Stopping dbus-serialbattery")
+        mainloop.quit()
+        return False
+
+    gobject.unix_signal_add(gobject.PRIORITY_HIGH, signal.SIGTERM, quit_mainloop)
+
     # Run the main loop
     try:
         mainloop.run()
     except KeyboardInterrupt:
         pass
+    finally:
+        if io_core is not None:
+            io_core.stop()
+
+        # write the settings that are still queued
+        for key_address in helper:
+            if helper[key_address].settings_writer is not None:
+                helper[key_address].settings_writer.close()
 
 
 if __name__ == "__main__":
@@ -4,12 +4,15 @@ import os
 import platform
 import dbus
 import traceback
-from time import sleep, time
-from utils import logger, publish_config_variables
+from time import perf_counter, sleep, time
+from utils import logger, publish_config_variables, serial_stats
 import utils
+from perf import PerfStats
+from persistence import SettingsWriter
 from xml.etree import ElementTree
 import requests
 import threading
+from typing import Dict, Union
 
 # add path to velib_python
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
@@ -35,6 +38,17 @@ def get_bus() -> dbus.bus.BusConnection:
 class DbusHelper:
     EMPTY_DICT = {}
 
+    settings_cache: Dict[str, dict] = {}
+    """
+    Settings read by `getSettings()`, shared by all instances of this process
+    """
+
+    # changes smaller than these values are not published to suppress sensor noise,
+    # the current is published with 10 mA resolution, so its deadband has to be larger
+    DEADBAND_CELL_VOLTAGE = 0.001
+    DEADBAND_CURRENT = 0.05
+    DEADBAND_POWER = 1
+
     def __init__(self, battery, bms_address=None):
         self.battery = battery
         self.instance = 1
@@ -47,24 +61,45 @@ class DbusHelper:
             + ("__" + str(bms_address) if bms_address is not None else "")
         )
         self._dbusservice = VeDbusService(self._dbusname, get_bus(), register=False)
+        self._publish_target = self._dbusservice
+        """
+        Object the values are written to while publishing, the service or a `ServiceContext` of the service
+        """
         self.bms_id = "".join(
             # remove all non alphanumeric characters from the identifier
             c if c.isalnum() else "_"
             for c in self.battery.unique_identifier()
         )
         self.path_battery = None
-        self.save_charge_details_last = {
-            "allow_max_voltage": self.battery.allow_max_voltage,
-            "max_voltage_start_time": self.battery.max_voltage_start_time,
-            "soc_reset_last_reached": self.battery.soc_reset_last_reached,
-            "soc_calc": (
-                self.battery.soc_calc if self.battery.soc_calc is not None else ""
-            ),
-        }
+        self.settings_writer: SettingsWriter = None
+        """
+        Writes the battery state to `com.victronenergy.settings` in the background
+        """
         self.telemetry_upload_error_count: int = 0
         self.telemetry_upload_interval: int = 60 * 60 * 24 * 7  # 1 week
         self.telemetry_upload_last: int = 0
         self.telemetry_upload_running: bool = False
+        self.published_snapshots: dict = {}
+        """
+        Last published state of a group of paths, to skip the whole group, if nothing changed
+        """
+        self.publish_stats: dict = {"published": 0, "suppressed": 0}
+        """
+        Number of published and suppressed path updates since the driver started
+        """
+        self.perf: PerfStats = PerfStats(utils.PERF_STATS_DUMP_FILE)
+        """
+        Time spent in each phase of the poll cycle
+        """
+        self.poll_stats = None
+        """
+        `AddressStats` of the `BusScheduler` that polls this battery, published under "/Debug/Scheduler/"
+        """
+        self.quit_on_failure: bool = True
+        """
+        Quit the driver, if the battery failed completely. False if the process serves more than one battery,
+        then only the failed battery is kept offline and blocked, until it answers again.
+        """
 
     def create_pid_file(self) -> None:
         """
@@ -167,12 +202,12 @@ class DbusHelper:
         logger.debug("setup_instance(): SettingsDevice")
 
         # get all the settings from the dbus
-        settings_from_dbus = self.getSettingsWithValues(
+        settings_from_dbus = self.getSettings(
             get_bus(),
             "com.victronenergy.settings",
             "/Settings/Devices",
         )
-        logger.debug("setup_instance(): getSettingsWithValues")
+        logger.debug("setup_instance(): getSettings")
         # output:
         # {
         #     "Settings": {
@@ -208,6 +243,9 @@ class DbusHelper:
         #     }
         # }
 
+        # entries removed from com.victronenergy.settings, removed from the cached settings after the loop
+        removed_keys = []
+
         # loop through devices in dbus settings
         if (
             "Settings" in settings_from_dbus
@@ -353,6 +391,7 @@ class DbusHelper:
                                 "UniqueIdentifier",
                             ],
                         )
+                        removed_keys.append(key)
                         logger.info(
                             f"Remove /Settings/Devices/{key} from dbus. Delete result: {del_return}"
                         )
@@ -365,6 +404,7 @@ class DbusHelper:
                             "/Settings/Devices/" + key,
                             ["ClassAndVrmInstance"],
                         )
+                        removed_keys.append(key)
                         logger.info(
                             f"Remove /Settings/Devices/{key} from dbus. "
                             + f"Old entry. Delete result: {del_return}"
@@ -383,6 +423,7 @@ class DbusHelper:
                             "/Settings/Devices/" + key,
                             ["CustomName", "Enabled", "TemperatureType"],
                         )
+                        removed_keys.append(key)
                         logger.info(
                             f"Remove /Settings/Devices/{key} from dbus. "
                             + f"Ruuvi tag was disabled and had no ClassAndVrmInstance. Delete result: {del_return}"
@@ -462,6 +503,27 @@ class DbusHelper:
         self.settings.addSettings(settings)
         self.battery.role, self.instance = self.get_role_instance()
 
+        # save the battery state in the background, the values read above are already stored
+        self.settings_writer = SettingsWriter(
+            get_bus(),
+            "com.victronenergy.settings",
+            self.path_battery,
+            utils.SAVE_SETTINGS_INTERVAL * 1000,
+            self.getCurrentBatteryState(),
+            self.settings_write_failed,
+        )
+        self.settings_writer.start()
+
+        # keep the cached settings in sync, the next battery on this port reads them from the cache
+        devices = settings_from_dbus.setdefault("Settings", {}).setdefault(
+            "Devices", {}
+        )
+        for key in removed_keys:
+            devices.pop(key, None)
+        devices[self.path_battery[self.path_battery.rfind("/") + 1 :]] = {
+            name: str(self.settings[name]) for name in settings
+        }
+
         # create pid file
         self.create_pid_file()
 
@@ -782,6 +844,27 @@ class DbusHelper:
         if utils.PUBLISH_CONFIG_VALUES:
             publish_config_variables(self._dbusservice)
 
+        # poll interval and poll durations, set by the scheduler
+        self._dbusservice.add_path("/Debug/Scheduler/PollInterval", None)
+        self._dbusservice.add_path("/Debug/Scheduler/LatencyLast", None)
+        self._dbusservice.add_path("/Debug/Scheduler/LatencyP90", None)
+        self._dbusservice.add_path("/Debug/Scheduler/Polls", None)
+        self._dbusservice.add_path("/Debug/Scheduler/Deferred", None)
+        self._dbusservice.add_path("/Debug/Scheduler/TiersDue", None)
+        self._dbusservice.add_path("/Debug/Scheduler/Requests", None)
+
+        # record the raw frames of all batteries, see utils.FrameTrace
+        self._dbusservice.add_path(
+            "/Debug/FrameTrace",
+            1 if utils.frame_trace.enabled else 0,
+            writeable=True,
+            onchangecallback=self.frame_trace_callback,
+        )
+
+        if utils.PERF_STATS:
+            for path, value in self.perf.paths():
+                self._dbusservice.add_path(path, value)
+
         if self.battery.has_settings:
             self._dbusservice.add_path("/Settings/HasSettings", 1, writeable=False)
             self._dbusservice.add_path(
@@ -798,18 +881,44 @@ class DbusHelper:
 
         return True
 
-    def publish_battery(self, loop):
+    def publish_battery(self, loop) -> bool:
         # This is called every battery.poll_interval milli second as set up per battery type to read and update the data
+        # returns the result of refresh_data()
         try:
             # Call the battery's refresh_data function
+            time_start = perf_counter()
+            serial_wait_start = serial_stats.wait_time
             result = self.battery.refresh_data()
+            self.perf.add_refresh(
+                perf_counter() - time_start, serial_stats.wait_time - serial_wait_start
+            )
+        except Exception:
+            traceback.print_exc()
+            loop.quit()
+            return False
+
+        self.publish_refresh_result(loop, result)
+
+        return result
+
+    def publish_refresh_result(self, loop, result: bool) -> bool:
+        """
+        Update the state of the battery after `refresh_data()` and publish it on the dbus.
+        Has to be called in the GLib main loop.
+
+        :param loop: The main loop, needed to quit on fatal errors
+        :param result: Return value of `refresh_data()`
+        :return: Always False, to not repeat the call when used as GLib idle callback
+        """
+        time_start = perf_counter()
+        try:
             if result:
                 # reset error variables
                 self.error["count"] = 0
                 self.battery.online = True
 
-                # unblock charge/discharge, if it was blocked when battery went offline
-                if utils.BLOCK_ON_DISCONNECT:
+                # unblock charge/discharge, if it was blocked when battery went offline or failed
+                if self.battery.block_because_disconnect:
                     self.battery.block_because_disconnect = False
 
             else:
@@ -843,20 +952,30 @@ class DbusHelper:
                         self.battery.block_because_disconnect = True
 
                 # if the battery did not update in 60 second, it's assumed to be completely failed
-                if time_since_first_error >= 60 and (
-                    utils.BLOCK_ON_DISCONNECT or not self.cell_voltages_good
-                ):
-                    loop.quit()
-
                 # if the cells are between 3.2 and 3.3 volt we can continue for some time
-                if time_since_first_error >= 60 * 20 and not utils.BLOCK_ON_DISCONNECT:
-                    loop.quit()
+                if (
+                    time_since_first_error >= 60
+                    and (utils.BLOCK_ON_DISCONNECT or not self.cell_voltages_good)
+                ) or (
+                    time_since_first_error >= 60 * 20 and not utils.BLOCK_ON_DISCONNECT
+                ):
+                    if self.quit_on_failure:
+                        loop.quit()
+                    elif not self.battery.block_because_disconnect:
+                        # the other batteries of the process keep running, block only this one
+                        logger.error(
+                            f"Battery {self.battery.connection_name()} failed, blocking charge/discharge "
+                            + "until it answers again"
+                        )
+                        self.battery.block_because_disconnect = True
 
             # This is to manage CVCL
-            self.battery.manage_charge_voltage()
+            with self.perf.measure("ManageChargeVoltage"):
+                self.battery.manage_charge_voltage()
 
             # This is to manage CCL\DCL
-            self.battery.manage_charge_current()
+            with self.perf.measure("ManageChargeCurrent"):
+                self.battery.manage_charge_current()
 
             # Manage battery state, if not set to error (10)
             # change state from initializing to running, if there is no error
@@ -878,8 +997,24 @@ class DbusHelper:
             ):
                 self.battery.state = 9
 
+            # record the values of this cycle in the time series
+            self.battery.add_timeseries_sample()
+
             # publish all the data from the battery object to dbus
-            self.publish_dbus()
+            if utils.PUBLISH_ITEMS_CHANGED:
+                # collect all changes of this cycle and send them in one ItemsChanged signal
+                with self._dbusservice as context:
+                    self._publish_target = context
+                    try:
+                        with self.perf.measure("PublishDbus"):
+                            self.publish_dbus()
+                        self.publish_perf()
+                    finally:
+                        self._publish_target = self._dbusservice
+            else:
+                with self.perf.measure("PublishDbus"):
+                    self.publish_dbus()
+                self.publish_perf()
 
             # upload telemetry data
             self.telemetry_upload()
@@ -888,250 +1023,387 @@ class DbusHelper:
             traceback.print_exc()
             loop.quit()
 
+        self.perf.end_cycle(perf_counter() - time_start)
+
+        return False
+
+    def publish_scheduler(self) -> None:
+        """
+        Publish the poll interval and the poll durations of this battery to "/Debug/Scheduler/"
+        """
+        latency_p90 = self.poll_stats.latencies.percentile(90)
+        self.publish_path("/Debug/Scheduler/PollInterval", self.poll_stats.interval)
+        self.publish_path(
+            "/Debug/Scheduler/LatencyLast",
+            (
+                round(self.poll_stats.latency_last * 1000)
+                if self.poll_stats.latency_last is not None
+                else None
+            ),
+            10,
+        )
+        self.publish_path(
+            "/Debug/Scheduler/LatencyP90",
+            round(latency_p90) if latency_p90 is not None else None,
+            10,
+        )
+        self.publish_path("/Debug/Scheduler/Polls", self.poll_stats.polls)
+        self.publish_path("/Debug/Scheduler/Deferred", self.poll_stats.deferred)
+        self.publish_path("/Debug/Scheduler/TiersDue", ",".join(self.battery.tiers_due))
+        self.publish_path(
+            "/Debug/Scheduler/Requests", self.battery.transactions_last_cycle
+        )
+
+    def publish_perf(self) -> None:
+        """
+        Publish the performance statistics to "/Debug/Perf/" and write the dump file, every
+        `PerfStats.PUBLISH_INTERVAL` seconds
+        """
+        if not utils.PERF_STATS and self.perf.dump_file is None:
+            return
+
+        if not self.perf.due():
+            return
+
+        if utils.PERF_STATS:
+            for path, value in self.perf.paths():
+                self.publish_path(path, value)
+
+        self.perf.dump()
+
+    def publish_path(self, path: str, value, deadband: float = 0) -> None:
+        """
+        Set the value of a D-Bus path, but only if it differs from the value of the path.
+        This saves the D-Bus signal for unchanged values. The value is read from the path instead of
+        remembering the last published value, since most paths are writeable and can be changed from outside.
+
+        :param path: The D-Bus path
+        :param value: The new value
+        :param deadband: Numeric changes smaller than this are not published, e.g. to suppress sensor noise
+        :return: None
+        """
+        published = self._publish_target[path]
+        if value == published or (
+            deadband > 0
+            and value is not None
+            and published is not None
+            and round(abs(value - published), 6) < deadband
+        ):
+            self.publish_stats["suppressed"] += 1
+            return
+
+        self._publish_target[path] = value
+        self.publish_stats["published"] += 1
+
+    def snapshot_changed(self, group: str, snapshot: tuple) -> bool:
+        """
+        Check if the state of a group of paths changed since it was published the last time
+
+        :param group: Name of the group
+        :param snapshot: Tuple with all values of the group
+        :return: True if the group changed and has to be published
+        """
+        if self.published_snapshots.get(group) == snapshot:
+            return False
+        self.published_snapshots[group] = snapshot
+        return True
+
     def publish_dbus(self):
+        publish_stats_start = self.publish_stats.copy()
+
+        # read the values that are used multiple times only once per cycle
+        current = self.battery.get_current()
+        min_cell_voltage = self.battery.get_min_cell_voltage()
+        max_cell_voltage = self.battery.get_max_cell_voltage()
+
         # Update SOC, DC and System items
-        self._dbusservice["/System/NrOfCellsPerBattery"] = self.battery.cell_count
+        self.publish_path("/System/NrOfCellsPerBattery", self.battery.cell_count)
         if utils.SOC_CALCULATION:
-            self._dbusservice["/Soc"] = (
-                round(self.battery.soc_calc, 2)
-                if self.battery.soc_calc is not None
-                else None
+            self.publish_path(
+                "/Soc",
+                (
+                    round(self.battery.soc_calc, 2)
+                    if self.battery.soc_calc is not None
+                    else None
+                ),
             )
             # add original SOC for comparing
-            self._dbusservice["/SocBms"] = (
-                round(self.battery.soc, 2) if self.battery.soc is not None else None
+            self.publish_path(
+                "/SocBms",
+                round(self.battery.soc, 2) if self.battery.soc is not None else None,
             )
         else:
-            self._dbusservice["/Soc"] = (
-                round(self.battery.soc, 2) if self.battery.soc is not None else None
+            self.publish_path(
+                "/Soc",
+                round(self.battery.soc, 2) if self.battery.soc is not None else None,
             )
-        self._dbusservice["/Dc/0/Voltage"] = (
-            round(self.battery.voltage, 2) if self.battery.voltage is not None else None
+        self.publish_path(
+            "/Dc/0/Voltage",
+            (
+                round(self.battery.voltage, 2)
+                if self.battery.voltage is not None
+                else None
+            ),
         )
-        self._dbusservice["/Dc/0/Current"] = (
-            round(self.battery.get_current(), 2)
-            if self.battery.get_current() is not None
-            else None
+        self.publish_path(
+            "/Dc/0/Current",
+            round(current, 2) if current is not None else None,
+            self.DEADBAND_CURRENT,
         )
-        self._dbusservice["/Dc/0/Power"] = (
-            round(self.battery.voltage * self.battery.get_current(), 2)
-            if self.battery.get_current() is not None
-            and self.battery.get_current() is not None
-            else None
+        self.publish_path(
+            "/Dc/0/Power",
+            (
+                round(self.battery.voltage * current, 2)
+                if self.battery.voltage is not None and current is not None
+                else None
+            ),
+            self.DEADBAND_POWER,
         )
-        self._dbusservice["/Dc/0/Temperature"] = self.battery.get_temp()
-        self._dbusservice["/Capacity"] = self.battery.get_capacity_remain()
-        self._dbusservice["/ConsumedAmphours"] = (
-            None
-            if self.battery.capacity is None
-            or self.battery.get_capacity_remain() is None
-            else self.battery.capacity - self.battery.get_capacity_remain()
+        self.publish_path("/Dc/0/Temperature", self.battery.get_temp())
+        self.publish_path("/Capacity", self.battery.get_capacity_remain())
+        self.publish_path(
+            "/ConsumedAmphours",
+            (
+                None
+                if self.battery.capacity is None
+                or self.battery.get_capacity_remain() is None
+                else self.battery.capacity - self.battery.get_capacity_remain()
+            ),
         )
 
         midpoint, deviation = self.battery.get_midvoltage()
         if midpoint is not None:
-            self._dbusservice["/Dc/0/MidVoltage"] = midpoint
-            self._dbusservice["/Dc/0/MidVoltageDeviation"] = deviation
+            self.publish_path("/Dc/0/MidVoltage", midpoint)
+            self.publish_path("/Dc/0/MidVoltageDeviation", deviation)
 
         # Update battery extras
-        self._dbusservice["/State"] = self.battery.state
+        self.publish_path("/State", self.battery.state)
         # https://github.com/victronenergy/veutil/blob/master/inc/veutil/ve_regs_payload.h
         # https://github.com/victronenergy/veutil/blob/master/src/qt/bms_error.cpp
-        self._dbusservice["/ErrorCode"] = self.battery.error_code
+        self.publish_path("/ErrorCode", self.battery.error_code)
 
-        self._dbusservice["/History/DeepestDischarge"] = (
-            self.battery.history.deepest_discharge
-        )
-        self._dbusservice["/History/LastDischarge"] = (
-            self.battery.history.last_discharge
-        )
-        self._dbusservice["/History/AverageDischarge"] = (
-            self.battery.history.average_discharge
-        )
-        self._dbusservice["/History/ChargeCycles"] = self.battery.history.charge_cycles
-        self._dbusservice["/History/FullDischarges"] = (
-            self.battery.history.full_discharges
-        )
-        self._dbusservice["/History/TotalAhDrawn"] = self.battery.history.total_ah_drawn
-        self._dbusservice["/History/MinimumVoltage"] = (
-            self.battery.history.minimum_voltage
-        )
-        self._dbusservice["/History/MaximumVoltage"] = (
-            self.battery.history.maximum_voltage
-        )
-        self._dbusservice["/History/MinimumCellVoltage"] = (
-            self.battery.history.minimum_cell_voltage
-        )
-        self._dbusservice["/History/MaximumCellVoltage"] = (
-            self.battery.history.maximum_cell_voltage
-        )
-        self._dbusservice["/History/TimeSinceLastFullCharge"] = (
-            self.battery.history.time_since_last_full_charge
-        )
-        self._dbusservice["/History/LowVoltageAlarms"] = (
-            self.battery.history.low_voltage_alarms
-        )
-        self._dbusservice["/History/HighVoltageAlarms"] = (
-            self.battery.history.high_voltage_alarms
-        )
-        self._dbusservice["/History/DischargedEnergy"] = (
-            self.battery.history.discharged_energy
-        )
-        self._dbusservice["/History/ChargedEnergy"] = (
-            self.battery.history.charged_energy
-        )
+        # the history changes rarely, skip it completely, if nothing changed
+        if self.snapshot_changed("history", tuple(vars(self.battery.history).values())):
+            self.publish_path(
+                "/History/DeepestDischarge", self.battery.history.deepest_discharge
+            )
+            self.publish_path(
+                "/History/LastDischarge", self.battery.history.last_discharge
+            )
+            self.publish_path(
+                "/History/AverageDischarge", self.battery.history.average_discharge
+            )
+            self.publish_path(
+                "/History/ChargeCycles", self.battery.history.charge_cycles
+            )
+            self.publish_path(
+                "/History/FullDischarges", self.battery.history.full_discharges
+            )
+            self.publish_path(
+                "/History/TotalAhDrawn", self.battery.history.total_ah_drawn
+            )
+            self.publish_path(
+                "/History/MinimumVoltage", self.battery.history.minimum_voltage
+            )
+            self.publish_path(
+                "/History/MaximumVoltage", self.battery.history.maximum_voltage
+            )
+            self.publish_path(
+                "/History/MinimumCellVoltage", self.battery.history.minimum_cell_voltage
+            )
+            self.publish_path(
+                "/History/MaximumCellVoltage", self.battery.history.maximum_cell_voltage
+            )
+            self.publish_path(
+                "/History/TimeSinceLastFullCharge",
+                self.battery.history.time_since_last_full_charge,
+            )
+            self.publish_path(
+                "/History/LowVoltageAlarms", self.battery.history.low_voltage_alarms
+            )
+            self.publish_path(
+                "/History/HighVoltageAlarms", self.battery.history.high_voltage_alarms
+            )
+            self.publish_path(
+                "/History/DischargedEnergy", self.battery.history.discharged_energy
+            )
+            self.publish_path(
+                "/History/ChargedEnergy", self.battery.history.charged_energy
+            )
 
-        self._dbusservice["/Io/AllowToCharge"] = (
-            1 if self.battery.get_allow_to_charge() else 0
-        )
-        self._dbusservice["/Io/AllowToDischarge"] = (
-            1 if self.battery.get_allow_to_discharge() else 0
+        self.publish_path(
+            "/Io/AllowToCharge", 1 if self.battery.get_allow_to_charge() else 0
         )
-        self._dbusservice["/Io/AllowToBalance"] = (
-            1 if self.battery.get_allow_to_balance() else 0
+        self.publish_path(
+            "/Io/AllowToDischarge", 1 if self.battery.get_allow_to_discharge() else 0
         )
-        self._dbusservice["/System/NrOfModulesBlockingCharge"] = (
-            0 if self.battery.get_allow_to_charge() else 1
+        self.publish_path(
+            "/Io/AllowToBalance", 1 if self.battery.get_allow_to_balance() else 0
         )
-        self._dbusservice["/System/NrOfModulesBlockingDischarge"] = (
-            0 if self.battery.get_allow_to_discharge() else 1
+        self.publish_path(
+            "/System/NrOfModulesBlockingCharge",
+            0 if self.battery.get_allow_to_charge() else 1,
         )
-        self._dbusservice["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
-        self._dbusservice["/System/NrOfModulesOffline"] = (
-            0 if self.battery.online else 1
+        self.publish_path(
+            "/System/NrOfModulesBlockingDischarge",
+            0 if self.battery.get_allow_to_discharge() else 1,
         )
-        self._dbusservice["/System/MinCellTemperature"] = self.battery.get_min_temp()
-        self._dbusservice["/System/MinTemperatureCellId"] = (
-            self.battery.get_min_temp_id()
+        self.publish_path("/System/NrOfModulesOnline", 1 if self.battery.online else 0)
+        self.publish_path("/System/NrOfModulesOffline", 0 if self.battery.online else 1)
+        self.publish_path("/System/MinCellTemperature", self.battery.get_min_temp())
+        self.publish_path(
+            "/System/MinTemperatureCellId", self.battery.get_min_temp_id()
         )
-        self._dbusservice["/System/MaxCellTemperature"] = self.battery.get_max_temp()
-        self._dbusservice["/System/MaxTemperatureCellId"] = (
-            self.battery.get_max_temp_id()
+        self.publish_path("/System/MaxCellTemperature", self.battery.get_max_temp())
+        self.publish_path(
+            "/System/MaxTemperatureCellId", self.battery.get_max_temp_id()
         )
-        self._dbusservice["/System/MOSTemperature"] = self.battery.get_mos_temp()
-        self._dbusservice["/System/Temperature1"] = self.battery.temp1
-        self._dbusservice["/System/Temperature1Name"] = utils.TEMP_1_NAME
-        self._dbusservice["/System/Temperature2"] = self.battery.temp2
-        self._dbusservice["/System/Temperature2Name"] = utils.TEMP_2_NAME
-        self._dbusservice["/System/Temperature3"] = self.battery.temp3
-        self._dbusservice["/System/Temperature3Name"] = utils.TEMP_3_NAME
-        self._dbusservice["/System/Temperature4"] = self.battery.temp4
-        self._dbusservice["/System/Temperature4Name"] = utils.TEMP_4_NAME
+        self.publish_path("/System/MOSTemperature", self.battery.get_mos_temp())
+        self.publish_path("/System/Temperature1", self.battery.temp1)
+        self.publish_path("/System/Temperature1Name", utils.TEMP_1_NAME)
+        self.publish_path("/System/Temperature2", self.battery.temp2)
+        self.publish_path("/System/Temperature2Name", utils.TEMP_2_NAME)
+        self.publish_path("/System/Temperature3", self.battery.temp3)
+        self.publish_path("/System/Temperature3Name", utils.TEMP_3_NAME)
+        self.publish_path("/System/Temperature4", self.battery.temp4)
+        self.publish_path("/System/Temperature4Name", utils.TEMP_4_NAME)
 
         # Voltage control
-        self._dbusservice["/Info/MaxChargeVoltage"] = (
-            round(self.battery.control_voltage + utils.VOLTAGE_DROP, 2)
-            if self.battery.control_voltage is not None
-            else None
+        self.publish_path(
+            "/Info/MaxChargeVoltage",
+            (
+                round(self.battery.control_voltage + utils.VOLTAGE_DROP, 2)
+                if self.battery.control_voltage is not None
+                else None
+            ),
         )
 
         # Charge control
-        self._dbusservice["/Info/MaxChargeCurrent"] = (
-            self.battery.control_charge_current
-        )
-        self._dbusservice["/Info/MaxDischargeCurrent"] = (
-            self.battery.control_discharge_current
+        self.publish_path("/Info/MaxChargeCurrent", self.battery.control_charge_current)
+        self.publish_path(
+            "/Info/MaxDischargeCurrent", self.battery.control_discharge_current
         )
 
         # Voltage and charge control info (custom dbus paths)
-        self._dbusservice["/Info/ChargeMode"] = self.battery.charge_mode
-        self._dbusservice["/Info/ChargeModeDebug"] = self.battery.charge_mode_debug
-        self._dbusservice["/Info/ChargeModeDebugFloat"] = (
-            self.battery.charge_mode_debug_float
+        self.publish_path("/Info/ChargeMode", self.battery.charge_mode)
+        self.publish_path("/Info/ChargeModeDebug", self.battery.charge_mode_debug)
+        self.publish_path(
+            "/Info/ChargeModeDebugFloat", self.battery.charge_mode_debug_float
         )
-        self._dbusservice["/Info/ChargeModeDebugBulk"] = (
-            self.battery.charge_mode_debug_bulk
+        self.publish_path(
+            "/Info/ChargeModeDebugBulk", self.battery.charge_mode_debug_bulk
         )
-        self._dbusservice["/Info/ChargeLimitation"] = self.battery.charge_limitation
-        self._dbusservice["/Info/DischargeLimitation"] = (
-            self.battery.discharge_limitation
+        self.publish_path("/Info/ChargeLimitation", self.battery.charge_limitation)
+        self.publish_path(
+            "/Info/DischargeLimitation", self.battery.discharge_limitation
         )
 
         # Updates from cells
-        self._dbusservice["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
-        self._dbusservice["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
-        self._dbusservice["/System/MinCellVoltage"] = (
-            self.battery.get_min_cell_voltage()
+        self.publish_path("/System/MinVoltageCellId", self.battery.get_min_cell_desc())
+        self.publish_path("/System/MaxVoltageCellId", self.battery.get_max_cell_desc())
+        self.publish_path(
+            "/System/MinCellVoltage", min_cell_voltage, self.DEADBAND_CELL_VOLTAGE
         )
-        self._dbusservice["/System/MaxCellVoltage"] = (
-            self.battery.get_max_cell_voltage()
+        self.publish_path(
+            "/System/MaxCellVoltage", max_cell_voltage, self.DEADBAND_CELL_VOLTAGE
         )
-        self._dbusservice["/Balancing"] = self.battery.get_balancing()
+        self.publish_path("/Balancing", self.battery.get_balancing())
 
         # Update the alarms
-        self._dbusservice["/Alarms/LowVoltage"] = self.battery.protection.low_voltage
-        self._dbusservice["/Alarms/LowCellVoltage"] = (
-            self.battery.protection.low_cell_voltage
+        self.publish_path("/Alarms/LowVoltage", self.battery.protection.low_voltage)
+        self.publish_path(
+            "/Alarms/LowCellVoltage", self.battery.protection.low_cell_voltage
         )
         # disable high voltage warning temporarly, if loading to bulk voltage and bulk voltage reached is 30 minutes ago
-        self._dbusservice["/Alarms/HighVoltage"] = (
-            self.battery.protection.high_voltage
-            if (
-                self.battery.soc_reset_requested is False
-                and self.battery.soc_reset_last_reached < int(time()) - (60 * 30)
-            )
-            else 0
+        self.publish_path(
+            "/Alarms/HighVoltage",
+            (
+                self.battery.protection.high_voltage
+                if (
+                    self.battery.soc_reset_requested is False
+                    and self.battery.soc_reset_last_reached < int(time()) - (60 * 30)
+                )
+                else 0
+            ),
         )
-        self._dbusservice["/Alarms/LowSoc"] = self.battery.protection.low_soc
-        self._dbusservice["/Alarms/HighChargeCurrent"] = (
-            self.battery.protection.high_charge_current
+        self.publish_path("/Alarms/LowSoc", self.battery.protection.low_soc)
+        self.publish_path(
+            "/Alarms/HighChargeCurrent", self.battery.protection.high_charge_current
         )
-        self._dbusservice["/Alarms/HighDischargeCurrent"] = (
-            self.battery.protection.high_discharge_current
+        self.publish_path(
+            "/Alarms/HighDischargeCurrent",
+            self.battery.protection.high_discharge_current,
         )
-        self._dbusservice["/Alarms/CellImbalance"] = (
-            self.battery.protection.cell_imbalance
+        self.publish_path(
+            "/Alarms/CellImbalance", self.battery.protection.cell_imbalance
         )
-        self._dbusservice["/Alarms/InternalFailure"] = (
-            self.battery.protection.internal_failure
+        self.publish_path(
+            "/Alarms/InternalFailure", self.battery.protection.internal_failure
         )
-        self._dbusservice["/Alarms/HighChargeTemperature"] = (
-            self.battery.protection.high_charge_temp
+        self.publish_path(
+            "/Alarms/HighChargeTemperature", self.battery.protection.high_charge_temp
         )
-        self._dbusservice["/Alarms/LowChargeTemperature"] = (
-            self.battery.protection.low_charge_temp
+        self.publish_path(
+            "/Alarms/LowChargeTemperature", self.battery.protection.low_charge_temp
         )
-        self._dbusservice["/Alarms/HighTemperature"] = (
-            self.battery.protection.high_temperature
+        self.publish_path(
+            "/Alarms/HighTemperature", self.battery.protection.high_temperature
         )
-        self._dbusservice["/Alarms/LowTemperature"] = (
-            self.battery.protection.low_temperature
+        self.publish_path(
+            "/Alarms/LowTemperature", self.battery.protection.low_temperature
         )
-        self._dbusservice["/Alarms/BmsCable"] = (
-            2 if self.battery.block_because_disconnect else 0
+        self.publish_path(
+            "/Alarms/BmsCable", 2 if self.battery.block_because_disconnect else 0
         )
-        self._dbusservice["/Alarms/HighInternalTemperature"] = (
-            self.battery.protection.high_internal_temp
+        self.publish_path(
+            "/Alarms/HighInternalTemperature",
+            self.battery.protection.high_internal_temp,
         )
-        self._dbusservice["/Alarms/FuseBlown"] = self.battery.protection.fuse_blown
+        self.publish_path("/Alarms/FuseBlown", self.battery.protection.fuse_blown)
 
         # cell voltages
         if utils.BATTERY_CELL_DATA_FORMAT > 0:
             try:
-                voltage_sum = 0
-                for i in range(self.battery.cell_count):
-                    voltage = self.battery.get_cell_voltage(i)
+                voltages = [
+                    self.battery.get_cell_voltage(i)
+                    for i in range(self.battery.cell_count)
+                ]
+                balances = (
+                    [
+                        self.battery.get_cell_balancing(i)
+                        for i in range(self.battery.cell_count)
+                    ]
+                    if utils.BATTERY_CELL_DATA_FORMAT & 1
+                    else []
+                )
+
+                # skip all cell paths, if no cell changed since the last cycle
+                if self.snapshot_changed("cells", (tuple(voltages), tuple(balances))):
                     cellpath = (
                         "/Cell/%s/Volts"
                         if (utils.BATTERY_CELL_DATA_FORMAT & 2)
                         else "/Voltages/Cell%s"
                     )
-                    self._dbusservice[cellpath % (str(i + 1))] = voltage
-                    if utils.BATTERY_CELL_DATA_FORMAT & 1:
-                        self._dbusservice["/Balances/Cell%s" % (str(i + 1))] = (
-                            self.battery.get_cell_balancing(i)
+                    for i, voltage in enumerate(voltages):
+                        self.publish_path(
+                            cellpath % (str(i + 1)),
+                            voltage,
+                            self.DEADBAND_CELL_VOLTAGE,
                         )
-                    if voltage:
-                        voltage_sum += voltage
-                pathbase = (
-                    "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
-                )
-                self._dbusservice["/%s/Sum" % pathbase] = round(voltage_sum, 2)
-                self._dbusservice["/%s/Diff" % pathbase] = round(
-                    self.battery.get_max_cell_voltage()
-                    - self.battery.get_min_cell_voltage(),
-                    3,
-                )
+                    for i, balance in enumerate(balances):
+                        self.publish_path("/Balances/Cell%s" % (str(i + 1)), balance)
+
+                    pathbase = (
+                        "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
+                    )
+                    self.publish_path(
+                        "/%s/Sum" % pathbase,
+                        round(sum(voltage for voltage in voltages if voltage), 2),
+                    )
+                    self.publish_path(
+                        "/%s/Diff" % pathbase,
+                        round(max_cell_voltage - min_cell_voltage, 3),
+                    )
             except Exception:
                 # set state to error, to show in the GUI that something is wrong
                 self.battery.state = 10
@@ -1147,18 +1419,12 @@ class DbusHelper:
 
         # Update TimeToGo and/or TimeToSoC
         try:
-            # calculate current average for the last 300 cycles
-            # if Time-To-Go or Time-To-SoC is enabled
-            if utils.TIME_TO_GO_ENABLE or len(utils.TIME_TO_SOC_POINTS) > 0:
-                if self.battery.get_current() is not None:
-                    self.battery.current_avg_lst.append(self.battery.get_current())
-
-                # delete oldest value
-                if len(self.battery.current_avg_lst) > 300:
-                    del self.battery.current_avg_lst[0]
+            # the current average is calculated as configured in TIME_TO_GO_CURRENT_MODE
+            current_avg = self.battery.current_estimator.average()
 
             if (
                 self.battery.capacity is not None
+                and current_avg is not None
                 and (utils.TIME_TO_GO_ENABLE or len(utils.TIME_TO_SOC_POINTS) > 0)
                 and (
                     int(time()) - self.battery.time_to_soc_update
@@ -1167,13 +1433,9 @@ class DbusHelper:
             ):
                 self.battery.time_to_soc_update = int(time())
 
-                self.battery.current_avg = round(
-                    sum(self.battery.current_avg_lst)
-                    / len(self.battery.current_avg_lst),
-                    2,
-                )
+                self.battery.current_avg = round(current_avg, 2)
 
-                self._dbusservice["/CurrentAvg"] = self.battery.current_avg
+                self.publish_path("/CurrentAvg", self.battery.current_avg)
 
                 percent_per_seconds = (
                     abs(self.battery.current_avg / (self.battery.capacity / 100)) / 3600
@@ -1194,20 +1456,26 @@ class DbusHelper:
                     )
 
                     # Check that time_to_go is not None and current is not near zero
-                    self._dbusservice["/TimeToGo"] = (
-                        abs(int(time_to_go))
-                        if time_to_go is not None
-                        and abs(self.battery.current_avg) > 0.1
-                        else None
+                    self.publish_path(
+                        "/TimeToGo",
+                        (
+                            abs(int(time_to_go))
+                            if time_to_go is not None
+                            and abs(self.battery.current_avg) > 0.1
+                            else None
+                        ),
                     )
 
                 # Update TimeToSoc items
                 if len(utils.TIME_TO_SOC_POINTS) > 0:
                     for num in utils.TIME_TO_SOC_POINTS:
-                        self._dbusservice["/TimeToSoC/" + str(num)] = (
-                            self.battery.get_timeToSoc(num, percent_per_seconds)
-                            if self.battery.current_avg
-                            else None
+                        self.publish_path(
+                            "/TimeToSoC/" + str(num),
+                            (
+                                self.battery.get_timeToSoc(num, percent_per_seconds)
+                                if self.battery.current_avg
+                                else None
+                            ),
                         )
 
         except Exception:
@@ -1223,8 +1491,8 @@ class DbusHelper:
                 + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}"
             )
 
-        # save settings every 15 seconds to dbus
-        if int(time()) % 15:
+        # queue the changed settings, they are written in the background every SAVE_SETTINGS_INTERVAL seconds
+        with self.perf.measure("SaveSettings"):
             self.saveCurrentBatteryState()
 
         if self.battery.soc is not None:
@@ -1232,7 +1500,80 @@ class DbusHelper:
             self.battery.log_cell_data()
 
         if self.battery.has_settings:
-            self._dbusservice["/Settings/ResetSoc"] = self.battery.reset_soc
+            self._publish_target["/Settings/ResetSoc"] = self.battery.reset_soc
+
+        if self.poll_stats is not None:
+            self.publish_scheduler()
+
+        logger.debug(
+            "Published %d paths, suppressed %d unchanged paths (total published: %d, suppressed: %d)",
+            self.publish_stats["published"] - publish_stats_start["published"],
+            self.publish_stats["suppressed"] - publish_stats_start["suppressed"],
+            self.publish_stats["published"],
+            self.publish_stats["suppressed"],
+        )
+
+    def getSettings(self, bus, service: str, object_path: str) -> dict:
+        """
+        Get all settings below a path as nested dict.
+        The settings are read once and then shared by all instances of this process,
+        e.g. if multiple batteries are connected to the same port.
+
+        :param bus: The dbus connection
+        :param service: The service that holds the settings
+        :param object_path: Path of the settings
+        :return: Nested dict with the settings
+        """
+        key = service + object_path
+        if key not in DbusHelper.settings_cache:
+            time_start = time()
+            method = "GetValue"
+            result = self.getSettingsBulk(bus, service, object_path)
+            if result is None:
+                # fall back to read each setting
+                method = "Introspect"
+                result = self.getSettingsWithValues(bus, service, object_path)
+            logger.debug(
+                f"Read settings {key} with {method} in {time() - time_start:.3f} s"
+            )
+            DbusHelper.settings_cache[key] = result
+
+        return DbusHelper.settings_cache[key]
+
+    def getSettingsBulk(self, bus, service: str, object_path: str) -> Union[dict, None]:
+        """
+        Get all settings below a path with a single `GetValue` call.
+        Called on a path that is not a setting, localsettings returns a dict with the values of all
+        settings below that path, where the keys are the paths relative to the called path.
+
+        :param bus: The dbus connection
+        :param service: The service that holds the settings
+        :param object_path: Path of the settings
+        :return: Nested dict with the settings or None, if the service does not support it
+        """
+        try:
+            obj = bus.get_object(service, object_path)
+            settings_iface = dbus.Interface(obj, "com.victronenergy.BusItem")
+            values = settings_iface.get_dbus_method("GetValue")()
+        except dbus.exceptions.DBusException as e:
+            logger.debug(f"getSettingsBulk(): GetValue on {object_path} failed: {e}")
+            return None
+
+        if not isinstance(values, dict):
+            return None
+
+        result = {}
+        for path, value in values.items():
+            if isinstance(value, dict):
+                continue
+            self.merge_dicts(
+                result,
+                self.create_nested_dict(
+                    object_path.rstrip("/") + "/" + str(path).lstrip("/"), str(value)
+                ),
+            )
+
+        return result
 
     def getSettingsWithValues(
         self, bus, service: str, object_path: str, recursive: bool = True
@@ -1353,83 +1694,56 @@ class DbusHelper:
         )
         return value if result else None
 
-    # save current battery states to dbus
-    def saveCurrentBatteryState(self) -> bool:
-        result = True
+    def frame_trace_callback(self, path, value) -> bool:
+        """
+        Start the frame trace with 1, stop it with 0 and write the recorded frames to `utils.PATH_FRAME_TRACE`
+        """
+        if value == 1:
+            utils.frame_trace.start()
+            logger.info("Frame trace started")
+            return True
+        if value == 0:
+            if utils.frame_trace.enabled:
+                count = utils.frame_trace.stop(utils.PATH_FRAME_TRACE)
+                logger.info(
+                    f"Frame trace stopped, wrote {count} frames to {utils.PATH_FRAME_TRACE}"
+                )
+            return True
+        return False
 
-        if (
-            self.battery.allow_max_voltage
-            != self.save_charge_details_last["allow_max_voltage"]
-        ):
-            result = result + self.setSetting(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "AllowMaxVoltage",
-                1 if self.battery.allow_max_voltage else 0,
-            )
-            logger.debug(
-                f"Saved AllowMaxVoltage. Before {self.save_charge_details_last['allow_max_voltage']}, "
-                + f"after {self.battery.allow_max_voltage}"
-            )
-            self.save_charge_details_last["allow_max_voltage"] = (
-                self.battery.allow_max_voltage
-            )
+    # save current battery states to dbus
+    def getCurrentBatteryState(self) -> dict:
+        """
+        Get the battery values that are saved in `com.victronenergy.settings`
 
-        if (
-            self.battery.max_voltage_start_time
-            != self.save_charge_details_last["max_voltage_start_time"]
-        ):
-            result = result and self.setSetting(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "MaxVoltageStartTime",
-                (
-                    self.battery.max_voltage_start_time
-                    if self.battery.max_voltage_start_time is not None
-                    else ""
-                ),
-            )
-            logger.debug(
-                f"Saved MaxVoltageStartTime. Before {self.save_charge_details_last['max_voltage_start_time']}, "
-                + f"after {self.battery.max_voltage_start_time}"
-            )
-            self.save_charge_details_last["max_voltage_start_time"] = (
+        :return: Dict with the setting name as key
+        """
+        return {
+            "AllowMaxVoltage": 1 if self.battery.allow_max_voltage else 0,
+            "MaxVoltageStartTime": (
                 self.battery.max_voltage_start_time
-            )
+                if self.battery.max_voltage_start_time is not None
+                else ""
+            ),
+            "SocCalc": self.battery.soc_calc,
+            "SocResetLastReached": self.battery.soc_reset_last_reached,
+        }
 
-        if self.battery.soc_calc != self.save_charge_details_last["soc_calc"]:
-            result = result and self.setSetting(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "SocCalc",
-                self.battery.soc_calc,
-            )
-            logger.debug(f"soc_calc written to dbus: {self.battery.soc_calc}")
-            self.save_charge_details_last["soc_calc"] = self.battery.soc_calc
+    def saveCurrentBatteryState(self) -> None:
+        """
+        Queue the changed battery values to be saved in `com.victronenergy.settings`.
+        Does not block, the values are written by the `SettingsWriter`.
+        """
+        if self.settings_writer is None:
+            return
 
-        if (
-            self.battery.soc_reset_last_reached
-            != self.save_charge_details_last["soc_reset_last_reached"]
-        ):
-            result = result and self.setSetting(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "SocResetLastReached",
-                self.battery.soc_reset_last_reached,
-            )
-            logger.debug(
-                f"Saved SocResetLastReached. Before {self.save_charge_details_last['soc_reset_last_reached']}, "
-                + f"after {self.battery.soc_reset_last_reached}",
-            )
-            self.save_charge_details_last["soc_reset_last_reached"] = (
-                self.battery.soc_reset_last_reached
-            )
+        for name, value in self.getCurrentBatteryState().items():
+            self.settings_writer.set(name, value)
 
-        return result
+    def settings_write_failed(self, name: str, error: Exception) -> None:
+        # set state to error, to show in the GUI that something is wrong
+        self.battery.state = 10
+        self.battery.error_code = 8
 
     def telemetry_upload(self) -> None:
         """
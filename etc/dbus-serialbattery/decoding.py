@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import binascii
+from functools import lru_cache
+from struct import Struct, calcsize
+from typing import Any, Dict, Hashable, Iterable, List, Tuple, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class FrameLayout:
+    """
+    Fixed layout of a binary frame. The fields are compiled once into a `struct.Struct`,
+    which unpacks all of them with one `unpack_from()` call. The bytes between the fields are skipped.
+
+    :param fields: Tuples of (name, offset, format). The format is a `struct` format character with an optional
+        count, e.g. "H", "h", "L" or "8s". A count with any other character than "s" unpacks an array
+        as tuple, e.g. "6H" for six temperatures.
+    :param byte_order: Byte order character of the `struct` module, ">" for big endian
+    """
+
+    def __init__(
+        self, fields: Iterable[Tuple[Hashable, int, str]], byte_order: str = ">"
+    ):
+        struct_format = byte_order
+        position = 0
+        index = 0
+        self.fields: List[Tuple[Hashable, int, Union[int, None]]] = []
+        """
+        Tuples of (name, index of the first value, array length or None)
+        """
+        for name, offset, field_format in sorted(fields, key=lambda field: field[1]):
+            if offset < position:
+                raise ValueError(f"Field {name} overlaps the previous field")
+            if offset > position:
+                struct_format += f"{offset - position}x"
+            struct_format += field_format
+
+            length = None
+            if field_format[:-1] and field_format[-1] != "s":
+                length = int(field_format[:-1])
+            self.fields.append((name, index, length))
+            index += length or 1
+            position = offset + calcsize(byte_order + field_format)
+
+        self.struct = Struct(struct_format)
+        self.size: int = self.struct.size
+        """
+        Minimum length of a frame
+        """
+
+    def unpack(self, data: Buffer, offset: int = 0) -> Dict[Hashable, Any]:
+        """
+        Unpack all fields of a frame
+
+        :param data: The frame
+        :param offset: Position of the layout in the frame
+        :return: Dict with the field names as keys, arrays are tuples
+        """
+        values = self.struct.unpack_from(data, offset)
+        return {
+            name: values[index] if length is None else values[index : index + length]
+            for name, index, length in self.fields
+        }
+
+    def unpack_hex(self, data: Buffer) -> Dict[Hashable, Any]:
+        """
+        Unpack all fields of a frame, that is transmitted as ASCII hex characters, e.g. "0A1F..."
+
+        :param data: The frame as ASCII hex characters
+        :return: Dict with the field names as keys, arrays are tuples
+        """
+        return self.unpack(binascii.unhexlify(data))
+
+
+@lru_cache(maxsize=64)
+def array_struct(count: int, item_format: str = "H", byte_order: str = ">") -> Struct:
+    """
+    Compiled `struct.Struct` for `count` consecutive values
+
+    :param count: Number of values
+    :param item_format: Format of one value, e.g. "H" or "xH" to skip a byte in front of each value
+    :param byte_order: Byte order character of the `struct` module
+    """
+    if len(item_format) == 1:
+        return Struct(f"{byte_order}{count}{item_format}")
+    return Struct(byte_order + item_format * count)
+
+
+def unpack_array(
+    data: Buffer,
+    count: int,
+    offset: int = 0,
+    item_format: str = "H",
+    byte_order: str = ">",
+) -> Tuple[int, ...]:
+    """
+    Unpack consecutive values at once, e.g. the cell voltages of a frame
+
+    :param data: The frame
+    :param count: Number of values
+    :param offset: Position of the first value in the frame
+    :param item_format: Format of one value, e.g. "H" or "xH" to skip a byte in front of each value
+    :param byte_order: Byte order character of the `struct` module
+    :return: The values
+    """
+    return array_struct(count, item_format, byte_order).unpack_from(data, offset)
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import sys
+from time import sleep, time
+from typing import Dict, List, Pattern, Union
+
+from battery import Battery
+from registry import BmsType
+from utils import logger, read_reply, serial_port_pool
+import utils
+
+PROBE_REPLY_TIMEOUT = 0.5
+"""
+Time in seconds to wait for the reply to a probe
+"""
+
+
+def _address_to_hex(address) -> Union[str, None]:
+    return address.hex() if isinstance(address, (bytes, bytearray)) else None
+
+
+class Candidate:
+    """
+    One BMS type at one address that is tested on the port
+    """
+
+    def __init__(self, bms_type: BmsType, address: Union[bytes, None], likelihood: int):
+        self.bms_type = bms_type
+        self.name: str = bms_type.name
+        self.baud: int = bms_type.baud
+        self.address = address
+        self.likelihood = likelihood
+        """
+        Position in the list of BMS types, the most common BMS types are first
+        """
+
+    def __str__(self) -> str:
+        return self.name + (
+            ' at address "' + utils.bytearray_to_string(self.address) + '"'
+            if self.address is not None
+            else ""
+        )
+
+
+class DetectionCache:
+    """
+    Remembers the detected BMS per port, so that it can be tested first on the next start.
+
+    An entry is only used, if the USB adapter on the port is still the same (vendor, product and serial number).
+    If the USB adapter moved to another port (e.g. `/dev/ttyUSB0` became `/dev/ttyUSB1`), the entry
+    is found by the serial number of the adapter.
+    """
+
+    def __init__(self, file_path: str = utils.PATH_DETECTION_CACHE):
+        self.file_path = file_path
+        self.entries: Dict[str, Dict] = self.load()
+
+    def load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.file_path, "r") as file:
+                entries = json.load(file)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read the detection cache {self.file_path}: {e}")
+            return {}
+
+    def save(self) -> None:
+        # write to a temporary file first, so that a power loss does not leave a broken file
+        file_path_tmp = self.file_path + ".tmp"
+        try:
+            with open(file_path_tmp, "w") as file:
+                json.dump(self.entries, file, indent=4, sort_keys=True)
+            os.replace(file_path_tmp, self.file_path)
+        except OSError as e:
+            logger.warning(f"Could not write the detection cache {self.file_path}: {e}")
+
+    @staticmethod
+    def key(port: str, modbus_address: Union[str, None]) -> str:
+        return port if modbus_address is None else port + "@" + modbus_address
+
+    @staticmethod
+    def usb_info(port: str) -> Dict:
+        """
+        Get the identity of the USB adapter on a port
+
+        :param port: Serial port
+        :return: Dict with `vid`, `pid` and `serial_number`, the values are None if it's no USB adapter
+        """
+        info = {"vid": None, "pid": None, "serial_number": None}
+        try:
+            from serial.tools import list_ports
+
+            device = os.path.realpath(port)
+            for port_info in list_ports.comports():
+                if port_info.device in (port, device):
+                    info["vid"] = port_info.vid
+                    info["pid"] = port_info.pid
+                    info["serial_number"] = port_info.serial_number
+                    break
+        except Exception as e:
+            logger.debug(f"Could not get the USB adapter of {port}: {e}")
+        return info
+
+    def lookup(self, port: str, modbus_address: Union[str, None]) -> Union[Dict, None]:
+        """
+        Get the remembered BMS of a port
+
+        :param port: Serial port
+        :param modbus_address: Address as hex string, if `MODBUS_ADDRESSES` is used
+        :return: Dict with `bms`, `baud` and `address` or None, if nothing matches
+        """
+        usb = self.usb_info(port)
+        entry = self.entries.get(self.key(port, modbus_address))
+        if entry is not None and entry.get("usb") == usb:
+            return entry
+
+        # the adapter moved to another port
+        if usb["serial_number"] is not None:
+            for entry in self.entries.values():
+                if (
+                    entry.get("usb") == usb
+                    and entry.get("modbus_address") == modbus_address
+                ):
+                    return entry
+
+        return None
+
+    def store(
+        self, port: str, modbus_address: Union[str, None], battery: Battery
+    ) -> None:
+        """
+        Remember the detected BMS of a port
+
+        :param port: Serial port
+        :param modbus_address: Address as hex string, if `MODBUS_ADDRESSES` is used
+        :param battery: Detected battery
+        """
+        entry = {
+            "port": port,
+            "modbus_address": modbus_address,
+            "usb": self.usb_info(port),
+            "bms": battery.__class__.__name__,
+            "baud": battery.baud_rate,
+            "address": _address_to_hex(battery.address),
+        }
+        key = self.key(port, modbus_address)
+        if self.entries.get(key) != entry:
+            self.entries[key] = entry
+            self.save()
+
+
+class BmsDetector:
+    """
+    Detects the BMS connected to a port.
+
+    Instead of running the complete `test_connection()` of every BMS type one after another:
+    - the candidates are grouped by baud rate and parity, so the port is reconfigured once per group
+    - each group sends one short probe per BMS type, the most common BMS types first
+    - every reply is matched against the signatures of all BMS types in the group
+    - only a BMS type with a matching reply runs its complete `test_connection()`
+    - the first BMS type that passes the test ends the detection
+
+    BMS types without a probe and CAN ports are tested with `test_connection()` only.
+    The last round tests all BMS types with `test_connection()`, in case a BMS did not answer a probe.
+    """
+
+    def __init__(
+        self,
+        port: str,
+        bms_types: List[BmsType],
+        modbus_address: Union[str, None] = None,
+        cache: Union[DetectionCache, None] = None,
+    ):
+        """
+        :param port: Port to detect the BMS on
+        :param bms_types: BMS types to test, ordered by likelihood
+        :param modbus_address: Address as hex string, overrides the default address of the BMS types
+        :param cache: Cache with the last detected BMS, None to always run the full detection
+        """
+        self.port = port
+        self.modbus_address = modbus_address
+        self.cache = cache
+        self.probing: bool = not port.startswith("can")
+        self.candidates: List[Candidate] = []
+
+        for likelihood, bms_type in enumerate(bms_types):
+            if modbus_address is not None:
+                # convert hex string to bytes
+                address = bytes.fromhex(modbus_address.replace("0x", ""))
+            else:
+                address = bms_type.address
+            self.candidates.append(Candidate(bms_type, address, likelihood))
+
+        self.timings: Dict[str, float] = {}
+        """
+        Time in seconds spent on each BMS type
+        """
+
+    def create_battery(self, candidate: Candidate) -> Battery:
+        return candidate.bms_type.load()(
+            port=self.port, baud=candidate.baud, address=candidate.address
+        )
+
+    def probe_groups(self) -> List[List[Candidate]]:
+        """
+        Group the candidates with probe by baud rate and parity.
+        The group with the most common BMS type is probed first.
+
+        :return: List of groups, each ordered by likelihood
+        """
+        groups: Dict[tuple, List[Candidate]] = {}
+        for candidate in self.candidates:
+            if candidate.bms_type.probe is not None:
+                key = (candidate.baud, candidate.bms_type.parity)
+                groups.setdefault(key, []).append(candidate)
+
+        # the candidates are already sorted, so the first one of each group is the most likely
+        return sorted(groups.values(), key=lambda group: group[0].likelihood)
+
+    def detect(self, rounds: int = 3) -> Union[Battery, None]:
+        """
+        Detect the BMS on the port
+
+        :param rounds: Number of rounds, the last one tests all BMS types with `test_connection()`
+        :return: The battery object or None, if no BMS was found
+        """
+        time_start = time()
+
+        if self.cache is not None:
+            battery = self.detect_cached()
+            if battery is not None:
+                logger.info(
+                    f"Connection established to remembered {battery.__class__.__name__} "
+                    + f"after {time() - time_start:.3f} s"
+                )
+                return battery
+
+        for retry in range(1, rounds + 1):
+            logger.info(
+                "-- Testing BMS: " + str(retry) + " of " + str(rounds) + " rounds"
+            )
+
+            if self.probing and retry < rounds:
+                battery = self.detect_by_probe()
+                if battery is None:
+                    # test the BMS types, that can't be probed
+                    battery = self.detect_by_test(
+                        [
+                            candidate
+                            for candidate in self.candidates
+                            if candidate.bms_type.probe is None
+                        ]
+                    )
+            else:
+                battery = self.detect_by_test(self.candidates)
+
+            if battery is not None:
+                logger.info(
+                    f"Connection established to {battery.__class__.__name__} "
+                    + f"after {time() - time_start:.3f} s"
+                )
+                self.log_timings()
+                if self.cache is not None:
+                    self.cache.store(self.port, self.modbus_address, battery)
+                return battery
+
+            sleep(0.5)
+
+        logger.info(f"No BMS detected after {time() - time_start:.3f} s")
+        self.log_timings()
+        return None
+
+    def detect_cached(self) -> Union[Battery, None]:
+        """
+        Test the BMS that was detected on the last start
+
+        :return: The battery object or None, if there is no entry or the BMS did not answer
+        """
+        entry = self.cache.lookup(self.port, self.modbus_address)
+        if entry is None:
+            return None
+
+        for candidate in self.candidates:
+            if (
+                candidate.name == entry["bms"]
+                and candidate.baud == entry["baud"]
+                and _address_to_hex(candidate.address) == entry["address"]
+            ):
+                logger.info(f"Testing remembered {candidate}")
+                return self.test(candidate)
+
+        # the BMS type is not enabled anymore
+        return None
+
+    def detect_by_probe(self) -> Union[Battery, None]:
+        """
+        Send the probe of each BMS type and test the BMS types, which signature matches the reply
+
+        :return: The battery object or None, if no BMS was found
+        """
+        for group in self.probe_groups():
+            tested = set()
+            for candidate in group:
+                if candidate in tested:
+                    continue
+
+                reply = self.send_probe(candidate)
+                if not reply:
+                    continue
+
+                # a reply can match other BMS types in this group, e.g. Modbus BMS at the same address
+                for matching in self.match(reply, group):
+                    if matching in tested:
+                        continue
+                    tested.add(matching)
+                    battery = self.test(matching)
+                    if battery is not None:
+                        return battery
+
+        return None
+
+    def detect_by_test(self, candidates: List[Candidate]) -> Union[Battery, None]:
+        """
+        Run the complete `test_connection()` of the BMS types
+
+        :param candidates: BMS types to test
+        :return: The battery object or None, if no BMS was found
+        """
+        for candidate in candidates:
+            battery = self.test(candidate)
+            if battery is not None:
+                return battery
+
+        return None
+
+    def send_probe(self, candidate: Candidate) -> bytearray:
+        """
+        Send the probe of a BMS type and read the reply
+
+        :param candidate: BMS type to probe
+        :return: The reply, empty if there was none
+        """
+        time_start = time()
+        reply = bytearray()
+        # noinspection PyBroadException
+        try:
+            command = candidate.bms_type.probe(candidate.address)
+            with serial_port_pool.acquire(
+                self.port, candidate.baud, candidate.bms_type.parity
+            ) as ser:
+                ser.reset_input_buffer()
+                ser.write(command)
+                reply = read_reply(ser, PROBE_REPLY_TIMEOUT)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(
+                "Non blocking exception occurred: "
+                + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}"
+            )
+
+        self.add_timing(candidate, time() - time_start)
+        logger.debug(
+            "Probed %s with %d baud: %s",
+            candidate,
+            candidate.baud,
+            utils.HexDump(reply) if reply else "no reply",
+        )
+        return reply
+
+    def match(self, reply: bytearray, group: List[Candidate]) -> List[Candidate]:
+        """
+        Get the BMS types, which signature matches a reply
+
+        :param reply: Reply to a probe
+        :param group: BMS types that use the same baud rate and parity
+        :return: Matching BMS types, ordered by likelihood
+        """
+        matching = []
+        for candidate in group:
+            pattern: Pattern = re.compile(
+                candidate.bms_type.signature(candidate.address),
+                re.DOTALL,
+            )
+            if pattern.search(reply):
+                matching.append(candidate)
+        return matching
+
+    def test(self, candidate: Candidate) -> Union[Battery, None]:
+        """
+        Run the complete connection test of a BMS type
+
+        :param candidate: BMS type to test
+        :return: The battery object or None, if the test failed
+        """
+        logger.info("Testing " + str(candidate))
+        time_start = time()
+        result = None
+        # noinspection PyBroadException
+        try:
+            battery = self.create_battery(candidate)
+            if battery.test_connection() and battery.validate_data():
+                result = battery
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(
+                "Non blocking exception occurred: "
+                + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}"
+            )
+            # Ignore any malfunction test_function()
+
+        self.add_timing(candidate, time() - time_start)
+        return result
+
+    def add_timing(self, candidate: Candidate, duration: float) -> None:
+        self.timings[candidate.name] = self.timings.get(candidate.name, 0) + duration
+
+    def log_timings(self) -> None:
+        """
+        Log the time spent on each BMS type
+        """
+        for name, duration in sorted(
+            self.timings.items(), key=lambda item: item[1], reverse=True
+        ):
+            logger.info(f"|- {name}: {duration:.3f} s")
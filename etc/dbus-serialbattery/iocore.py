@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import sys
+import threading
+from time import time
+from typing import Any, Callable, Coroutine, Dict, Union
+
+import serial
+
+from utils import (
+    SERIAL_FRAME_TIMEOUT,
+    SERIAL_REPLY_TIMEOUT,
+    Framing,
+    frame_trace,
+    logger,
+    serial_port_pool,
+    serial_stats,
+)
+
+
+class IoCore:
+    """
+    Runs the communication with the batteries in a dedicated thread with an asyncio event loop.
+
+    The GLib main loop only publishes the data, handles D-Bus method calls and callbacks. A slow or not
+    responding BMS therefore does not block the D-Bus service anymore.
+
+    `refresh_data()` of a battery can be a normal function or a coroutine. Coroutines can use
+    `request_async()` to wait for the reply without blocking the event loop. All drivers are still
+    normal functions, so a poll blocks the event loop until the battery answered.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="IoCore", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        logger.debug("Started I/O thread")
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        Stop the event loop and wait for the running request to finish
+
+        :param timeout: Time in seconds to wait for the thread
+        """
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """
+        Run a coroutine in the I/O thread. Can be called from any thread.
+
+        :param coroutine: Coroutine to run
+        :return: Future with the result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    @staticmethod
+    async def call(function: Callable, *args) -> Any:
+        """
+        Call a function, which can be a normal function or a coroutine function
+
+        :param function: Function to call
+        :return: Result of the function
+        """
+        result = function(*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+
+async def wait_readable(ser: serial.Serial, timeout: float) -> bool:
+    """
+    Wait until the serial port has data to read or the timeout expired, without blocking the event loop
+
+    :param ser: Serial port
+    :param timeout: Timeout in seconds
+    :return: True if data is available
+    """
+    if ser.in_waiting > 0:
+        return True
+
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    fd = ser.fileno()
+    loop.add_reader(fd, lambda: readable.done() or readable.set_result(True))
+    try:
+        return await asyncio.wait_for(readable, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+
+
+async def read_frame_async(
+    ser: serial.Serial, framing: Framing, reply_timeout: float = SERIAL_REPLY_TIMEOUT
+) -> Union[bytearray, bool]:
+    """
+    Read one frame described by `framing` from a serial port, same as `utils.read_frame()`,
+    but the event loop can run other coroutines while waiting for the bytes
+
+    :param ser: Serial port
+    :param framing: Description of the frame
+    :param reply_timeout: Time in seconds to wait for the first bytes
+    :return: The frame or False, if no complete frame was received
+    """
+    time_start = time()
+    wakeups = 0
+    data = bytearray()
+
+    deadline = time_start + reply_timeout
+    length = framing.header_length()
+    frame_length = None
+
+    while True:
+        if len(data) >= length:
+            if frame_length is None:
+                # the header is complete, now the length of the frame is known
+                frame_length = framing.frame_length(data)
+                length = frame_length
+                deadline = time() + SERIAL_FRAME_TIMEOUT
+                continue
+            break
+
+        if not await wait_readable(ser, deadline - time()):
+            break
+        data += ser.read(min(ser.in_waiting, length - len(data)) or 1)
+        wakeups += 1
+
+    if len(data) < length:
+        serial_stats.add(wakeups, len(data), time() - time_start)
+        if frame_trace.enabled and data:
+            frame_trace.add(ser.port, "rx", data)
+        logger.error(
+            ">>> ERROR: No reply - returning [len:"
+            + str(len(data))
+            + ("/" + str(frame_length) if frame_length is not None else "")
+            + "]"
+        )
+        return False
+
+    # read the bytes that arrive until the line is silent for 3.5 characters
+    gap = max(35 / ser.baudrate, 0.002)
+    while await wait_readable(ser, gap):
+        chunk = ser.read(ser.in_waiting or 1)
+        wakeups += 1
+        if not chunk:
+            break
+        data += chunk
+
+    serial_stats.add(wakeups, len(data), time() - time_start)
+    if frame_trace.enabled:
+        frame_trace.add(ser.port, "rx", data)
+
+    if not framing.validate(data):
+        logger.error(">>> ERROR: Invalid checksum")
+        return False
+
+    return data
+
+
+_port_locks: Dict[str, asyncio.Lock] = {}
+"""
+One lock per port, so that coroutines do not interleave their requests on the half duplex bus.
+The lock of `serial_port_pool` does not help here, since all coroutines run in the same thread.
+"""
+
+
+async def request_async(
+    port: str, baud: int, command: bytes, framing: Framing
+) -> Union[bytearray, bool]:
+    """
+    Send a command and read the reply, same as `utils.read_serial_data()`, but without blocking the event loop
+
+    :param port: Serial port
+    :param baud: Baud rate
+    :param command: Command to send
+    :param framing: Description of the reply
+    :return: The reply or False, if no valid reply was received
+    """
+    if port not in _port_locks:
+        _port_locks[port] = asyncio.Lock()
+
+    try:
+        async with _port_locks[port]:
+            with serial_port_pool.acquire(port, baud) as ser:
+                ser.reset_output_buffer()
+                ser.reset_input_buffer()
+                ser.write(command)
+                if frame_trace.enabled:
+                    frame_trace.add(port, "tx", command)
+                return await read_frame_async(ser, framing)
+
+    except serial.SerialException as e:
+        logger.error(e)
+        return False
+
+    except Exception:
+        (
+            exception_type,
+            exception_object,
+            exception_traceback,
+        ) = sys.exc_info()
+        file = exception_traceback.tb_frame.f_code.co_filename
+        line = exception_traceback.tb_lineno
+        logger.error(
+            f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
+        )
+        return False
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Dict, Iterator, List, Tuple, Union
+
+from timeseries import RingBuffer
+from utils import logger
+
+
+class RollingHistogram:
+    """
+    Durations of the last `capacity` calls of one phase.
+    Mean, min and max are available in O(1), percentiles and the histogram are calculated on demand.
+
+    :param capacity: Number of durations to keep
+    """
+
+    BUCKETS: Tuple[float, ...] = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+    """
+    Upper bounds of the histogram buckets in milliseconds, the last bucket collects everything above
+    """
+
+    def __init__(self, capacity: int = 300):
+        self.durations = RingBuffer(capacity)
+        """
+        Durations in milliseconds
+        """
+        self.total: int = 0
+        """
+        Number of calls since the start
+        """
+
+    def add(self, duration: float) -> None:
+        """
+        :param duration: Duration in seconds
+        """
+        self.durations.append(duration * 1000)
+        self.total += 1
+
+    def percentile(self, percent: float) -> Union[float, None]:
+        """
+        Get a percentile of the durations in the window
+
+        :param percent: Percentile from 0 to 100
+        :return: Duration in milliseconds or None, if there are no values
+        """
+        values = sorted(value for value in self.durations.values() if value is not None)
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+        return values[index]
+
+    def histogram(self) -> List[int]:
+        """
+        Number of durations in the window per bucket of `BUCKETS`, plus one bucket for longer durations
+        """
+        counts = [0] * (len(self.BUCKETS) + 1)
+        for value in self.durations.values():
+            if value is None:
+                continue
+            index = 0
+            while index < len(self.BUCKETS) and value > self.BUCKETS[index]:
+                index += 1
+            counts[index] += 1
+        return counts
+
+    def summary(self) -> Dict[str, Union[float, int, None]]:
+        """
+        Statistics of the durations in the window in milliseconds
+        """
+        return {
+            "Last": self.durations.latest(),
+            "Avg": self.durations.mean(),
+            "P50": self.percentile(50),
+            "P95": self.percentile(95),
+            "Max": self.durations.max(),
+            "Count": self.total,
+        }
+
+
+class PerfStats:
+    """
+    Time spent in each phase of the poll cycle of one battery, published under `/Debug/Perf/<Phase>/...`
+    """
+
+    PHASES: Tuple[str, ...] = (
+        "Cycle",
+        "RefreshData",
+        "SerialWait",
+        "Decode",
+        "ManageChargeVoltage",
+        "ManageChargeCurrent",
+        "PublishDbus",
+        "SaveSettings",
+    )
+    """
+    `RefreshData` is split into the time waiting for the serial port (`SerialWait`) and the rest (`Decode`)
+    """
+
+    PUBLISH_INTERVAL: int = 10
+    """
+    Interval in seconds to publish the statistics on the dbus and write the dump file
+    """
+
+    def __init__(self, dump_file: Union[str, None] = None):
+        """
+        :param dump_file: File to write the statistics to as JSON, None to not write a file
+        """
+        self.phases: Dict[str, RollingHistogram] = {
+            phase: RollingHistogram() for phase in self.PHASES
+        }
+        self.dump_file = dump_file
+        self.last_published: float = 0
+        self.refresh_duration: float = 0
+        """
+        Duration of the last `refresh_data()` in seconds, part of the cycle time
+        """
+
+    def add(self, phase: str, duration: float) -> None:
+        """
+        :param phase: Name of the phase, one of `PHASES`
+        :param duration: Duration in seconds
+        """
+        self.phases[phase].add(duration)
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """
+        Measure the duration of a block
+
+        :param phase: Name of the phase, one of `PHASES`
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase].add(perf_counter() - start)
+
+    def add_refresh(self, duration: float, serial_wait: float) -> None:
+        """
+        Add the duration of `refresh_data()`
+
+        :param duration: Duration of `refresh_data()` in seconds
+        :param serial_wait: Time spent waiting for the serial port in seconds
+        """
+        self.refresh_duration = duration
+        self.phases["RefreshData"].add(duration)
+        self.phases["SerialWait"].add(serial_wait)
+        self.phases["Decode"].add(max(duration - serial_wait, 0))
+
+    def end_cycle(self, publish_duration: float) -> None:
+        """
+        Add the duration of the whole cycle, `refresh_data()` and publishing the result
+
+        :param publish_duration: Time spent after `refresh_data()` in seconds
+        """
+        self.phases["Cycle"].add(self.refresh_duration + publish_duration)
+        self.refresh_duration = 0
+
+    def paths(self) -> Iterator[Tuple[str, Union[float, int, None]]]:
+        """
+        All dbus paths with their values
+        """
+        for phase, histogram in self.phases.items():
+            for name, value in histogram.summary().items():
+                yield (
+                    f"/Debug/Perf/{phase}/{name}",
+                    round(value, 3) if isinstance(value, float) else value,
+                )
+
+    def due(self) -> bool:
+        """
+        Check if the statistics have to be published, resets the timer
+        """
+        now = time()
+        if now - self.last_published < self.PUBLISH_INTERVAL:
+            return False
+        self.last_published = now
+        return True
+
+    def dump(self) -> None:
+        """
+        Write the statistics and histograms to the dump file
+        """
+        if self.dump_file is None:
+            return
+
+        data = {
+            "timestamp": int(time()),
+            "buckets_ms": list(RollingHistogram.BUCKETS),
+            "phases": {
+                phase: dict(histogram.summary(), Histogram=histogram.histogram())
+                for phase, histogram in self.phases.items()
+            },
+        }
+        file_path_tmp = self.dump_file + ".tmp"
+        try:
+            with open(file_path_tmp, "w") as file:
+                json.dump(data, file, indent=4)
+            os.replace(file_path_tmp, self.dump_file)
+        except OSError as e:
+            logger.warning(f"Could not write the performance statistics: {e}")
+            self.dump_file = None
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+from time import time
+from typing import Any, Callable, Dict, Union
+
+import dbus
+from gi.repository import GLib
+
+from utils import logger
+
+
+class SettingsWriter:
+    """
+    Write-behind cache for settings in `com.victronenergy.settings`.
+
+    Changed values are only queued by `set()`, which never blocks. The queue is written in the background
+    every `interval` milliseconds with asynchronous D-Bus calls, so the poll cycle never waits for the settings
+    daemon. Multiple changes of the same setting between two flushes are coalesced into one write and values
+    that did not change since the last write are not written at all.
+    """
+
+    def __init__(
+        self,
+        bus: dbus.bus.BusConnection,
+        service: str,
+        base_path: str,
+        interval: int,
+        values: Union[Dict[str, Any], None] = None,
+        error_callback: Union[Callable[[str, Exception], None], None] = None,
+    ):
+        """
+        :param bus: The dbus connection
+        :param service: The service that holds the settings
+        :param base_path: Path of the settings, e.g. `/Settings/Devices/serialbattery_JK_B2A20S20P`
+        :param interval: Interval in milliseconds to write the queued values
+        :param values: Values that are already stored, they are not written again
+        :param error_callback: Called with the setting name and the exception, if a write failed
+        """
+        self.bus = bus
+        self.service = service
+        self.base_path = base_path
+        self.interval = interval
+        self.error_callback = error_callback
+
+        self.pending: Dict[str, Any] = {}
+        """
+        Values that are waiting to be written
+        """
+
+        self.written: Dict[str, Any] = dict(values) if values is not None else {}
+        """
+        Last value written to each setting
+        """
+
+        self.in_flight: Dict[str, Any] = {}
+        """
+        Values of the asynchronous writes that did not return yet
+        """
+
+        self.stats: Dict[str, int] = {
+            "queued": 0,
+            "coalesced": 0,
+            "written": 0,
+            "failed": 0,
+        }
+
+        self._proxies: Dict[str, dbus.proxies.Interface] = {}
+        self._timer = None
+
+    def start(self) -> None:
+        """
+        Start writing the queued values every `interval` milliseconds on the GLib main loop
+        """
+        if self._timer is None:
+            self._timer = GLib.timeout_add(self.interval, self._on_timer)
+
+    def stop(self) -> None:
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+
+    def _on_timer(self) -> bool:
+        self.flush()
+        # keep the timer running
+        return True
+
+    def _get_proxy(self, name: str):
+        # resolving the object is a round trip to the dbus daemon, therefore do it only once per setting
+        if name not in self._proxies:
+            obj = self.bus.get_object(
+                self.service, self.base_path + "/" + name, introspect=False
+            )
+            self._proxies[name] = dbus.Interface(obj, "com.victronenergy.BusItem")
+        return self._proxies[name]
+
+    def set(self, name: str, value: Any) -> None:
+        """
+        Queue a value to be written. Does not block.
+
+        :param name: Name of the setting, relative to `base_path`
+        :param value: Value to write, None is ignored
+        """
+        if value is None:
+            return
+
+        if name in self.pending:
+            if self.pending[name] != value:
+                self.pending[name] = value
+                self.stats["coalesced"] += 1
+            return
+
+        # the value is already written or being written
+        if name in self.in_flight:
+            if self.in_flight[name] == value:
+                return
+        elif name in self.written and self.written[name] == value:
+            return
+
+        self.pending[name] = value
+        self.stats["queued"] += 1
+
+    def flush(self, blocking: bool = False) -> None:
+        """
+        Write all queued values
+
+        :param blocking: Wait for each write to finish, used on shutdown when the main loop is not running anymore
+        """
+        if not self.pending:
+            return
+
+        pending = self.pending
+        self.pending = {}
+
+        for name, value in pending.items():
+            try:
+                proxy = self._get_proxy(name)
+                if blocking:
+                    self._on_reply(name, value, proxy.SetValue(value, timeout=2))
+                else:
+                    self.in_flight[name] = value
+                    proxy.SetValue(
+                        value,
+                        reply_handler=partial(self._on_reply, name, value),
+                        error_handler=partial(self._on_error, name, value),
+                    )
+            except dbus.exceptions.DBusException as e:
+                self._on_failed(name, value, e)
+
+    def _on_reply(self, name: str, value: Any, result: int = 0) -> None:
+        if self.in_flight.get(name) == value:
+            del self.in_flight[name]
+        # the settings daemon answers with a non zero result, if it rejected the value
+        if result != 0:
+            self._on_failed(
+                name,
+                value,
+                dbus.exceptions.DBusException(f"SetValue returned {result}"),
+            )
+            return
+        self._on_written(name, value)
+
+    def _on_error(self, name: str, value: Any, error: Exception) -> None:
+        if self.in_flight.get(name) == value:
+            del self.in_flight[name]
+        self._on_failed(name, value, error)
+
+    def _on_written(self, name: str, value: Any) -> None:
+        self.written[name] = value
+        self.stats["written"] += 1
+        logger.debug(f"Saved {self.base_path}/{name} = {value}")
+
+    def _on_failed(self, name: str, value: Any, error: Exception) -> None:
+        self.stats["failed"] += 1
+        # retry on the next flush, if the value was not changed in the meantime
+        self.pending.setdefault(name, value)
+        logger.error(f"Failed to save {self.base_path}/{name}: {error}")
+        if self.error_callback is not None:
+            self.error_callback(name, error)
+
+    def close(self) -> None:
+        """
+        Stop the timer and write all queued values, called on shutdown
+        """
+        self.stop()
+        # the replies of the asynchronous writes are not processed anymore, write them again to be sure
+        for name, value in self.in_flight.items():
+            self.pending.setdefault(name, value)
+        self.in_flight = {}
+        time_start = time()
+        count = len(self.pending)
+        self.flush(blocking=True)
+        if count > 0:
+            logger.info(
+                f"Saved {count} settings on shutdown in {time() - time_start:.3f} s"
+            )
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+import importlib
+import re
+from typing import Callable, List, Union
+
+import serial
+
+
+def modbus_crc(data: bytes) -> bytes:
+    """
+    Calculate the Modbus CRC16 of a frame
+
+    :param data: Frame without CRC
+    :return: CRC, low byte first
+    """
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc.to_bytes(2, "little")
+
+
+def seplos_command(address: int, cid2: int, info: bytes = b"") -> bytes:
+    """
+    Build an ASCII frame of the Seplos protocol (cid1=0x46), same as `Seplos.encode_cmd()`
+
+    :param address: Address of the battery
+    :param cid2: Command
+    :param info: Payload
+    :return: Frame
+    """
+    length = len(info)
+    if length > 0:
+        length_checksum = (length & 0xF) + ((length >> 4) & 0xF) + ((length >> 8) & 0xF)
+        length += (((length_checksum % 16) ^ 0xF) + 1) << 12
+    frame = "{:02X}{:02X}{:02X}{:02X}{:04X}".format(
+        0x20, address, 0x46, cid2, length
+    ).encode()
+    frame += info
+    checksum = ((sum(frame) % 0xFFFF) ^ 0xFFFF) + 1
+    return b"~" + frame + "{:04X}".format(checksum).encode() + b"\r"
+
+
+def modbus_read_command(address: bytes, register: int, count: int) -> bytes:
+    """
+    Build a Modbus request to read holding registers
+
+    :param address: Address of the BMS
+    :param register: First register
+    :param count: Number of registers
+    :return: Frame with CRC
+    """
+    frame = address + b"\x03" + register.to_bytes(2, "big") + count.to_bytes(2, "big")
+    return frame + modbus_crc(frame)
+
+
+def daly_command(address: bytes, command: int) -> bytes:
+    """
+    Build a request of the Daly protocol, same as `Daly.generate_command()`
+
+    :param address: Address of the BMS, 0x40 or 0x80
+    :param command: Command
+    :return: Frame with checksum
+    """
+    frame = b"\xa5" + address + bytes([command]) + b"\x08" + b"\xaa" * 8
+    return frame + bytes([sum(frame) & 0xFF])
+
+
+class BmsType:
+    """
+    Describes a BMS driver without importing its module.
+
+    The driver module is only imported, when the BMS type is tested. This keeps the startup time and the
+    memory usage low, since every port starts its own instance of the driver.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        module: str,
+        baud: int,
+        address: Union[bytes, None] = None,
+        probe: Union[Callable[[bytes], bytes], None] = None,
+        signature: Union[Callable[[bytes], bytes], None] = None,
+        parity: str = serial.PARITY_NONE,
+        default: bool = True,
+    ):
+        """
+        :param name: Name of the battery class, also used in `BMS_TYPE`
+        :param module: Module of the battery class
+        :param baud: Baud rate
+        :param address: Default address of the BMS
+        :param probe: Returns a short request that the BMS answers, built from the address
+        :param signature: Returns a regular expression, that matches the reply to the probe
+        :param parity: Parity of the serial port
+        :param default: Test this BMS type, if `BMS_TYPE` is empty. If False, it has to be enabled in `BMS_TYPE`
+        """
+        self.name = name
+        self.module = module
+        self.baud = baud
+        self.address = address
+        self.probe = probe
+        self.signature = signature
+        self.parity = parity
+        self.default = default
+        self._bms = None
+
+    def load(self) -> type:
+        """
+        Import the driver module
+
+        :return: The battery class
+        """
+        if self._bms is None:
+            self._bms = getattr(importlib.import_module(self.module), self.name)
+        return self._bms
+
+    def __str__(self) -> str:
+        return self.name
+
+
+SERIAL_BMS_TYPES: List[BmsType] = [
+    BmsType(
+        "Jkbms_pb",
+        "bms.jkbms_pb",
+        115200,
+        b"\x01",
+        # read the device info, a Modbus write request of the JK protocol
+        probe=lambda address: (
+            address
+            + b"\x10\x16\x1c\x00\x01\x02\x00\x00"
+            + modbus_crc(address + b"\x10\x16\x1c\x00\x01\x02\x00\x00")
+        ),
+        signature=lambda address: rb"\x55\xAA\xEB\x90",
+    ),
+    BmsType(
+        "Jkbms",
+        "bms.jkbms",
+        115200,
+        probe=lambda address: (
+            b"\x4e\x57\x00\x13\x00\x00\x00\x00\x06\x03\x00\x00\x00\x00\x00\x00\x68\x00\x00\x01\x29"
+        ),
+        signature=lambda address: rb"\x4E\x57",
+    ),
+    BmsType(
+        "LltJbd",
+        "bms.lltjbd",
+        9600,
+        # read hardware info
+        probe=lambda address: b"\xdd\xa5\x05\x00\xff\xfb\x77",
+        signature=lambda address: rb"\xDD\x05\x00",
+    ),
+    BmsType(
+        "Daly",
+        "bms.daly",
+        9600,
+        b"\x40",
+        # request the cell voltage range and the cell count
+        probe=lambda address: daly_command(address, 0x94),
+        signature=lambda address: rb"\xA5\x01\x94\x08",
+    ),
+    BmsType(
+        "Daly",
+        "bms.daly",
+        9600,
+        b"\x80",
+        probe=lambda address: daly_command(address, 0x94),
+        signature=lambda address: rb"\xA5\x01\x94\x08",
+    ),
+    BmsType(
+        "Seplos",
+        "bms.seplos",
+        19200,
+        b"\x00",
+        probe=lambda address: seplos_command(address[0], 0x42, b"01"),
+        signature=lambda address: rb"~20%02X46" % address[0],
+    ),
+    BmsType("Seplosv3", "bms.seplosv3", 19200),
+    BmsType(
+        "EG4_LL",
+        "bms.eg4_ll",
+        9600,
+        b"\x01",
+        # the driver sends the CRC of address 0x01 for all addresses
+        probe=lambda address: address + b"\x03\x00\x00\x00\x27\x05\xd0",
+        signature=lambda address: re.escape(address) + rb"\x03\x4E",
+    ),
+    BmsType(
+        "EG4_Lifepower",
+        "bms.eg4_lifepower",
+        9600,
+        b"\x01",
+        # read hardware version
+        probe=lambda address: b"\x7e" + address + b"\x42\x00\xfc\x0d",
+        signature=lambda address: rb"\x7E" + re.escape(address) + rb".*\x0D$",
+    ),
+    BmsType("HeltecModbus", "bms.heltecmodbus", 9600, b"\x01"),
+    BmsType(
+        "Renogy",
+        "bms.renogy",
+        9600,
+        b"\x30",
+        # read the model registers
+        probe=lambda address: modbus_read_command(address, 0x1402, 8),
+        signature=lambda address: re.escape(address) + rb"\x03\x10",
+    ),
+    BmsType(
+        "Renogy",
+        "bms.renogy",
+        9600,
+        b"\xf7",
+        probe=lambda address: modbus_read_command(address, 0x1402, 8),
+        signature=lambda address: re.escape(address) + rb"\x03\x10",
+    ),
+    BmsType("Ecs", "bms.ecs", 19200),
+    BmsType("HLPdataBMS4S", "bms.hlpdatabms4s", 9600),
+    # enabled only if explicitly set in config under "BMS_TYPE"
+    BmsType("ANT", "bms.ant", 19200, default=False),
+    BmsType("MNB", "bms.mnb", 9600, default=False),
+    BmsType("Sinowealth", "bms.sinowealth", 9600, default=False),
+]
+"""
+All BMS types that are connected by a serial port, ordered by how often they are used.
+The most common ones are tested first.
+
+This list is the only place where the probes, the reply signatures and the test order are defined,
+`detection.BmsDetector` takes all of them from here.
+"""
+
+CAN_BMS_TYPES: List[BmsType] = [
+    BmsType("Daly_Can", "bms.daly_can", 250000),
+    BmsType("Jkbms_Can", "bms.jkbms_can", 250000),
+]
+"""
+All BMS types that are connected by a CAN port
+"""
+
+
+def get_bms_types(bms_types: List[BmsType], enabled: List[str]) -> List[BmsType]:
+    """
+    Get the BMS types that should be tested
+
+    :param bms_types: Available BMS types
+    :param enabled: Names of the enabled BMS types, empty to test all default BMS types
+    :return: List of BMS types
+    """
+    return [
+        bms_type
+        for bms_type in bms_types
+        if bms_type.name in enabled or (len(enabled) == 0 and bms_type.default)
+    ]
@@ -338,16 +338,78 @@ if [ "$bluetooth_length" -gt 0 ]; then
         chmod 755 "/service/dbus-blebattery.$1/run"
     }
 
+    # function to install one service for all ble batteries, which share the Bluetooth adapter
+    install_blebattery_service_shared() {
+        ble_arguments=""
+        ble_addresses=""
+
+        for (( i=0; i<bluetooth_length; i++ ));
+        do
+            # split BMS type and MAC address
+            IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
+            if [ -z "${bms[0]}" ] || [ -z "${bms[1]}" ]; then
+                echo "ERROR: BMS type or MAC address for battery $i is empty. Aborting installation."
+                echo
+                exit 1
+            fi
+            ble_arguments="$ble_arguments ${bms[0]} ${bms[1]}"
+            ble_addresses="$ble_addresses ${bms[1]}"
+        done
+
+        echo "Installing $bluetooth_length Bluetooth BMS as dbus-blebattery.0"
+
+        mkdir -p "/service/dbus-blebattery.0/log"
+        {
+            echo "#!/bin/sh"
+            echo "exec multilog t s25000 n4 /var/log/dbus-blebattery.0"
+        } > "/service/dbus-blebattery.0/log/run"
+        chmod 755 "/service/dbus-blebattery.0/log/run"
+
+        {
+            echo "#!/bin/sh"
+            echo "exec 2>&1"
+            echo "echo"
+            echo "echo"
+            echo "echo \"INFO:Preparing Bluetooth for connection to BMS\""
+            echo "echo \"INFO:Bluetooth details\""
+            # close all open connections, else the driver can't connect
+            for address in $ble_addresses; do
+                echo "bluetoothctl disconnect $address"
+            done
+
+            # one scan for all BMS to display signal strength (RSSI), else it's missing
+            echo "bluetoothctl scan on | grep -E \"$(echo $ble_addresses | sed 's/ /|/g')\" | grep \"RSSI\" &"
+
+            # wait 5 seconds to finish the scan
+            echo "sleep 5"
+            # display some Bluetooth device details
+            for address in $ble_addresses; do
+                echo "bluetoothctl info $address | grep -E \"Device|Alias|Pair|Trusted|Blocked|Connected|RSSI|Power\""
+            done
+            echo "echo"
+            echo "python /opt/victronenergy/dbus-serialbattery/dbus-serialbattery.py Ble$ble_arguments"
+            echo "pkill -f \"bluetoothctl scan on\""
+        } > "/service/dbus-blebattery.0/run"
+        chmod 755 "/service/dbus-blebattery.0/run"
+    }
+
     # Example
     # install_blebattery_service 0 Jkbms_Ble C8:47:8C:00:00:00
     # install_blebattery_service 1 Jkbms_Ble C8:47:8C:00:00:11
 
-    for (( i=0; i<bluetooth_length; i++ ));
-    do
-        # split BMS type and MAC address
-        IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
-        install_blebattery_service $i "${bms[0]}" "${bms[1]}"
-    done
+    # run all BMS in one process, if not disabled in the config file
+    bluetooth_single_process=$(awk -F "=" '/^BLUETOOTH_SINGLE_PROCESS/ {print $2}' /data/etc/dbus-serialbattery/config.ini)
+
+    if [[ $bluetooth_single_process == *"False"* ]]; then
+        for (( i=0; i<bluetooth_length; i++ ));
+        do
+            # split BMS type and MAC address
+            IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
+            install_blebattery_service $i "${bms[0]}" "${bms[1]}"
+        done
+    else
+        install_blebattery_service_shared
+    fi
 
     echo
 
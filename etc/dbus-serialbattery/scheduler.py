@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+import traceback
+from time import time
+from typing import Dict, List, Union
+
+from gi.repository import GLib
+
+from battery import ReadTier
+from iocore import IoCore
+from perf import RollingHistogram
+from utils import logger, serial_stats
+import utils
+
+
+class AddressStats:
+    """
+    This class holds the polling statistics of one BMS address on the bus
+    """
+
+    def __init__(self, address, interval: int):
+        self.address = address
+
+        self.interval: int = interval
+        """
+        Poll interval of this address in milliseconds
+        """
+
+        self.next_due: float = 0
+        """
+        Timestamp when this address has to be polled next
+        """
+
+        self.polls: int = 0
+        """
+        Number of polls of this address
+        """
+
+        self.deferred: int = 0
+        """
+        Number of times this address was due, but moved to the next cycle since the cycle budget was used up
+        """
+
+        self.latency_last: float = None
+        """
+        Duration of the last poll in seconds
+        """
+
+        self.latency_avg: float = None
+        """
+        Exponential moving average of the poll duration in seconds
+        """
+
+        self.latency_min: float = None
+        """
+        Shortest poll duration in seconds
+        """
+
+        self.latency_max: float = None
+        """
+        Longest poll duration in seconds
+        """
+
+        self.latencies = RollingHistogram(20)
+        """
+        Duration of the last polls, to get a percentile that ignores single outliers
+        """
+
+        self.tier_read: Dict[str, float] = {}
+        """
+        Timestamp when the data of each `ReadTier` was read successfully the last time
+        """
+
+        self.tier_failures: Dict[str, int] = {}
+        """
+        Number of polls in a row, in which the data of each `ReadTier` could not be read
+        """
+
+    def add_sample(self, latency: float) -> None:
+        """
+        Add a poll duration to the statistics
+
+        :param latency: Duration of the poll in seconds
+        :return: None
+        """
+        self.polls += 1
+        self.latency_last = latency
+        self.latencies.add(latency)
+        self.latency_avg = (
+            latency
+            if self.latency_avg is None
+            else self.latency_avg + (latency - self.latency_avg) * 0.2
+        )
+        self.latency_min = (
+            latency if self.latency_min is None else min(self.latency_min, latency)
+        )
+        self.latency_max = (
+            latency if self.latency_max is None else max(self.latency_max, latency)
+        )
+
+    def __str__(self) -> str:
+        if self.latency_last is None:
+            return f"{self.address}: not polled yet"
+        return (
+            f"{self.address}: last {self.latency_last:.3f} s | avg {self.latency_avg:.3f} s | "
+            + f"min {self.latency_min:.3f} s | max {self.latency_max:.3f} s | "
+            + f"interval {self.interval / 1000:.3f} s | polls {self.polls} | deferred {self.deferred}"
+        )
+
+
+class BusScheduler:
+    """
+    Polls all batteries that share one port (e.g. multiple `MODBUS_ADDRESSES` on one RS485 adapter).
+
+    RS485/Modbus is a half duplex master/slave bus, only one request can be on the wire at a time.
+    Therefore the addresses are served one after another, but:
+    - each address is published immediately after its own data was read
+    - each address has its own deadline and poll interval, a slow slave is only polled less often
+      instead of raising the poll interval of the whole string
+    - the poll interval of an address follows a percentile of its recent poll durations. It is raised
+      when the address gets slow and lowered step by step when it is fast again, within `poll_interval`
+      and `poll_interval_max`. A single slow poll (e.g. a USB hiccup) does not change it at all
+    - slow changing data is only read every `POLL_TIER_MEDIUM_INTERVAL` or `POLL_TIER_SLOW_INTERVAL`
+      seconds, see `ReadTier`
+    - a cycle stops when the poll interval is used up, remaining addresses are served first in the next cycle
+
+    With an `IoCore`, the data is read in the I/O thread and only published in the GLib main loop.
+    While the next address is read, the previous one is already published. The statistics and deadlines
+    are only changed in the GLib main loop, the I/O thread hands its results over with `GLib.idle_add()`.
+    """
+
+    LATENCY_PERCENTILE = 90
+    """
+    Percentile of the recent poll durations, that has to fit into the poll interval
+    """
+
+    UTILIZATION = 0.8
+    """
+    Share of the poll interval the polls of all addresses may use, the rest is left for publishing
+    """
+
+    STEP_DOWN_POLLS = 10
+    """
+    Number of consecutive fast polls, before the interval of an address is lowered one step
+    """
+
+    STEP_DOWN_FACTOR = 0.8
+    """
+    The interval is lowered by this factor per step
+    """
+
+    WARMUP_POLLS = 5
+    """
+    The first polls are always slower, the interval is not changed before this number of polls
+    """
+
+    TIER_MAX_RETRIES = 3
+    """
+    Number of polls in a row a failed `ReadTier` is read again, before it waits for its full interval
+    """
+
+    TIMER_TOLERANCE = 0.1
+    """
+    Share of the poll interval an address may be due after the start of a cycle and is still polled in it,
+    since the GLib timeout does not fire exactly on time
+    """
+
+    def __init__(
+        self,
+        battery: Dict,
+        helper: Dict,
+        poll_interval: int,
+        io_core: Union[IoCore, None] = None,
+        poll_interval_max: Union[int, None] = None,
+    ):
+        """
+        :param battery: Dict with the battery objects, the key is the address
+        :param helper: Dict with the DbusHelper objects, the key is the address
+        :param poll_interval: Poll interval of the bus in milliseconds, also the shortest interval of an address
+        :param io_core: Read the data in this I/O thread, None to read it in the GLib main loop
+        :param poll_interval_max: Longest poll interval of an address in milliseconds, defaults to `POLL_INTERVAL_MAX`
+        """
+        self.battery = battery
+        self.helper = helper
+        self.poll_interval = poll_interval
+        self.poll_interval_max: int = max(
+            (
+                poll_interval_max
+                if poll_interval_max is not None
+                else utils.POLL_INTERVAL_MAX
+            ),
+            poll_interval,
+        )
+        self.tier_intervals: Dict[str, float] = {
+            ReadTier.MEDIUM: utils.POLL_TIER_MEDIUM_INTERVAL,
+            ReadTier.SLOW: utils.POLL_TIER_SLOW_INTERVAL,
+        }
+        """
+        Interval in seconds to read the data of the slower tiers
+        """
+        self.io_core = io_core
+        self.loop_count = 0
+        self.cycles_skipped = 0
+        """
+        Number of cycles that were skipped, because the previous cycle was still running
+        """
+        self._cycle = None
+        self._cycle_start: float = 0
+        """
+        Timestamp when the current cycle was started, the next due time of each address is counted from it
+        """
+        self._publish_pending = 0
+        self._publish_lock = threading.Lock()
+        self.stats: Dict[any, AddressStats] = {
+            key_address: AddressStats(key_address, poll_interval)
+            for key_address in battery
+        }
+        self._fast_polls: Dict[any, int] = {key_address: 0 for key_address in battery}
+
+        # publish the scheduler state of each address with its battery
+        for key_address in helper:
+            helper[key_address].poll_stats = self.stats[key_address]
+
+    def add_battery(self, key_address, battery, helper) -> None:
+        """
+        Poll a battery, that was found after the start, e.g. a Bluetooth BMS that was out of range.
+        Has to be called in the GLib main loop.
+
+        :param key_address: Address of the battery
+        :param battery: The battery object
+        :param helper: The DbusHelper of the battery
+        """
+        self.battery[key_address] = battery
+        self.helper[key_address] = helper
+        self.stats[key_address] = AddressStats(key_address, self.poll_interval)
+        self._fast_polls[key_address] = 0
+        helper.poll_stats = self.stats[key_address]
+
+    def deadline(self) -> float:
+        """
+        Time in seconds one address is allowed to take, so that all addresses fit into one poll interval
+
+        :return: Deadline in seconds
+        """
+        return self.poll_interval / 1000 / len(self.battery)
+
+    def start_poll(self, key_address, now: float) -> None:
+        """
+        Tell the battery, which read tiers are due in this poll
+
+        :param key_address: Address of the battery
+        :param now: Timestamp of the poll
+        """
+        tier_read = self.stats[key_address].tier_read
+        battery = self.battery[key_address]
+        battery.tiers_due = (ReadTier.FAST,) + tuple(
+            tier
+            for tier, interval in self.tier_intervals.items()
+            if now - tier_read.get(tier, 0) >= interval
+        )
+        battery.tiers_read = None
+
+    def end_poll(
+        self,
+        key_address,
+        poll_start: float,
+        result: bool,
+        poll_end: Union[float, None] = None,
+    ) -> None:
+        """
+        Update the statistics and the next due time of an address after it was polled
+
+        :param key_address: Address of the battery
+        :param poll_start: Timestamp when the poll started
+        :param result: Return value of `refresh_data()`, the due tiers are read again, if it failed
+            and the driver does not report the tiers it read in `tiers_read`
+        :param poll_end: Timestamp when the poll ended, defaults to now
+        """
+        stats = self.stats[key_address]
+        stats.add_sample((poll_end if poll_end is not None else time()) - poll_start)
+        battery = self.battery[key_address]
+        tiers_read = battery.tiers_read
+        if tiers_read is None:
+            tiers_read = battery.tiers_due if result else ()
+        for tier in battery.tiers_due:
+            if tier in tiers_read:
+                stats.tier_failures.pop(tier, None)
+            elif tier != ReadTier.FAST:
+                stats.tier_failures[tier] = stats.tier_failures.get(tier, 0) + 1
+                # data the BMS never delivers (e.g. a BMS that reports a capacity of 0) must not
+                # cost a request in every poll, wait a full interval after a few failed polls
+                if stats.tier_failures[tier] < self.TIER_MAX_RETRIES:
+                    continue
+                logger.debug(
+                    f"{key_address}: {tier} data not read in {stats.tier_failures[tier]} polls in a row,"
+                    + " retrying after the tier interval"
+                )
+            stats.tier_read[tier] = poll_start
+        self.adjust_interval(key_address)
+        # count from the start of the cycle, else an address that is polled late in the cycle would miss the next one
+        stats.next_due = self._cycle_start + stats.interval / 1000
+
+    def due_addresses(self, now: float, force: bool = False) -> List:
+        """
+        Get the addresses that have to be polled, the most overdue first
+
+        :param now: Current timestamp
+        :param force: Return all addresses, regardless if they are due
+        :return: List of addresses
+        """
+        return sorted(
+            [
+                key_address
+                for key_address in self.battery
+                if force or self.stats[key_address].next_due <= now
+            ],
+            key=lambda key_address: self.stats[key_address].next_due,
+        )
+
+    def run_cycle(self, loop, force: bool = False) -> bool:
+        """
+        Polls all due addresses and publishes each battery as soon as its data was read.
+        Called every `poll_interval` milliseconds or by the battery callback.
+
+        :param loop: The main loop, needed to quit on fatal errors
+        :param force: Poll all addresses, used when the battery pushes its data by callback
+        :return: Always True, to keep the GLib timeout running
+        """
+        # batteries that push their data by callback read it in their own thread
+        if self.io_core is not None and not force:
+            return self.start_cycle(loop)
+
+        cycle_start = time()
+        self._cycle_start = cycle_start
+        budget = self.poll_interval / 1000
+        due = self.due_addresses(cycle_start + budget * self.TIMER_TOLERANCE, force)
+
+        for index, key_address in enumerate(due):
+            # the cycle budget is used up, serve the remaining addresses first in the next cycle
+            if index > 0 and time() - cycle_start >= budget:
+                for key_address_deferred in due[index:]:
+                    self.stats[key_address_deferred].deferred += 1
+                logger.debug(
+                    f"Poll cycle budget of {budget:.3f} s used up, deferred: "
+                    + ", ".join(str(key) for key in due[index:])
+                )
+                break
+
+            poll_start = time()
+            self.start_poll(key_address, poll_start)
+            result = self.helper[key_address].publish_battery(loop)
+            self.end_poll(key_address, poll_start, result)
+
+        logger.debug("Polling data took %.3f seconds", time() - cycle_start)
+        if len(self.battery) > 1:
+            for key_address in due:
+                logger.debug("|- %s", self.stats[key_address])
+
+        self.loop_count += 1
+
+        return True
+
+    def start_cycle(self, loop) -> bool:
+        """
+        Start a poll cycle in the I/O thread. Called every `poll_interval` milliseconds.
+
+        :param loop: The main loop, needed to quit on fatal errors
+        :return: Always True, to keep the GLib timeout running
+        """
+        # a slow BMS can take longer than the poll interval, never poll an address twice at the same time
+        # and wait until the results of the last cycle are in the statistics
+        with self._publish_lock:
+            busy = self._publish_pending > 0
+        if busy or (self._cycle is not None and not self._cycle.done()):
+            self.cycles_skipped += 1
+            logger.debug(
+                f"Previous poll cycle still running, skipped {self.cycles_skipped} cycles"
+            )
+            return True
+
+        cycle_start = time()
+        self._cycle_start = cycle_start
+        budget = self.poll_interval / 1000
+        due = self.due_addresses(cycle_start + budget * self.TIMER_TOLERANCE)
+        # the battery is not read at this time, so the tiers can be set here instead of in the I/O thread
+        for key_address in due:
+            self.start_poll(key_address, cycle_start)
+        self._cycle = self.io_core.submit(self.run_cycle_async(loop, due, cycle_start))
+
+        return True
+
+    async def run_cycle_async(self, loop, due: List, cycle_start: float) -> None:
+        """
+        Read the due addresses one after another in the I/O thread and hand each battery
+        over to the GLib main loop to publish it.
+
+        Only the batteries are read here, the statistics are updated by `publish()` and `end_cycle()`
+        in the GLib main loop, where they are also published.
+
+        :param loop: The main loop, needed to quit on fatal errors
+        :param due: Addresses to poll
+        :param cycle_start: Timestamp when the cycle was started
+        """
+        budget = self.poll_interval / 1000
+        deferred = []
+
+        for index, key_address in enumerate(due):
+            # the cycle budget is used up, serve the remaining addresses first in the next cycle
+            if index > 0 and time() - cycle_start >= budget:
+                deferred = due[index:]
+                break
+
+            poll_start = time()
+            serial_wait_start = serial_stats.wait_time
+            try:
+                result = await IoCore.call(self.battery[key_address].refresh_data)
+            except Exception:
+                traceback.print_exc()
+                GLib.idle_add(loop.quit)
+                return
+            poll_end = time()
+
+            with self._publish_lock:
+                self._publish_pending += 1
+            GLib.idle_add(
+                self.publish,
+                loop,
+                key_address,
+                result,
+                poll_start,
+                poll_end,
+                serial_stats.wait_time - serial_wait_start,
+            )
+
+        # idle callbacks run in the order they were added, so this runs after the last publish
+        with self._publish_lock:
+            self._publish_pending += 1
+        GLib.idle_add(self.end_cycle, due, deferred, cycle_start, time())
+
+    def publish(
+        self,
+        loop,
+        key_address,
+        result: bool,
+        poll_start: float,
+        poll_end: float,
+        serial_wait: float,
+    ) -> bool:
+        """
+        Publish the data read in the I/O thread. Runs in the GLib main loop.
+
+        :param poll_start: Timestamp when `refresh_data()` started
+        :param poll_end: Timestamp when `refresh_data()` returned
+        :param serial_wait: Time `refresh_data()` waited for the serial port in seconds
+        :return: Always False, to remove the GLib idle callback
+        """
+        try:
+            # the statistics are only updated in the main loop, where they are also published
+            self.helper[key_address].perf.add_refresh(
+                poll_end - poll_start, serial_wait
+            )
+            self.helper[key_address].publish_refresh_result(loop, result)
+            self.end_poll(key_address, poll_start, result, poll_end)
+        finally:
+            with self._publish_lock:
+                self._publish_pending -= 1
+        return False
+
+    def end_cycle(
+        self, due: List, deferred: List, cycle_start: float, cycle_end: float
+    ) -> bool:
+        """
+        Update the statistics after a poll cycle in the I/O thread. Runs in the GLib main loop.
+
+        :param due: Addresses that were due in this cycle
+        :param deferred: Addresses that were not polled, because the cycle budget was used up
+        :param cycle_start: Timestamp when the cycle was started
+        :param cycle_end: Timestamp when the last address was read
+        :return: Always False, to remove the GLib idle callback
+        """
+        try:
+            if deferred:
+                for key_address in deferred:
+                    self.stats[key_address].deferred += 1
+                logger.debug(
+                    f"Poll cycle budget of {self.poll_interval / 1000:.3f} s used up, deferred: "
+                    + ", ".join(str(key) for key in deferred)
+                )
+
+            logger.debug("Polling data took %.3f seconds", cycle_end - cycle_start)
+            if len(self.battery) > 1:
+                for key_address in due:
+                    logger.debug("|- %s", self.stats[key_address])
+
+            self.loop_count += 1
+        finally:
+            with self._publish_lock:
+                self._publish_pending -= 1
+        return False
+
+    def adjust_interval(self, key_address) -> None:
+        """
+        Adapt the poll interval of a single address to its recent poll durations. Other addresses are not affected.
+
+        The interval is raised at once to fit the `LATENCY_PERCENTILE` of the recent polls and lowered by
+        `STEP_DOWN_FACTOR` after `STEP_DOWN_POLLS` consecutive polls, that would also fit into the lower interval.
+
+        :param key_address: Address of the battery
+        :return: None
+        """
+        stats = self.stats[key_address]
+
+        # the first polls are always slower
+        if stats.polls <= self.WARMUP_POLLS:
+            return
+
+        # interval needed to poll all addresses in the time of the percentile, rounded up to 100 ms
+        latency = stats.latencies.percentile(self.LATENCY_PERCENTILE) / 1000
+        required = (
+            math.ceil(round(latency * len(self.battery) / self.UTILIZATION * 10, 6))
+            * 100
+        )
+
+        if required > stats.interval:
+            self._fast_polls[key_address] = 0
+            new_interval = min(required, self.poll_interval_max)
+            if new_interval > stats.interval:
+                logger.warning(
+                    f"Polling address {key_address} took too long "
+                    + f"(P{self.LATENCY_PERCENTILE} {latency:.3f} s). "
+                    + f"Set its poll interval to {new_interval / 1000:.3f} s"
+                )
+                stats.interval = new_interval
+
+        elif (
+            stats.interval > self.poll_interval
+            and required <= stats.interval * self.STEP_DOWN_FACTOR
+        ):
+            self._fast_polls[key_address] += 1
+            if self._fast_polls[key_address] >= self.STEP_DOWN_POLLS:
+                self._fast_polls[key_address] = 0
+                stats.interval = max(
+                    int(stats.interval * self.STEP_DOWN_FACTOR / 100) * 100,
+                    required,
+                    self.poll_interval,
+                )
+                logger.info(
+                    f"Polling address {key_address} is fast again. "
+                    + f"Set its poll interval to {stats.interval / 1000:.3f} s"
+                )
+
+        else:
+            self._fast_polls[key_address] = 0
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+Capture the raw serial traffic of a BMS and replay it without hardware.
+
+Capture: set `SERIAL_TRACE_FILE` in the config, every request and reply of the ports opened by
+`serial_port_pool` is appended to the file. One JSON object per line:
+
+    {"trace": 1, "start": 1718000000.0}                  header
+    {"t": 0.0123, "port": "/dev/ttyUSB0", "tx": "dda50300fffd77"}
+    {"t": 0.0581, "port": "/dev/ttyUSB0", "rx": "dd0300...77"}
+    {"t": 1.2001, "port": "/dev/ttyUSB0", "bms": "LltJbd", "address": null, "baud": 9600}
+
+`t` is the time in seconds since the start of the capture, `tx`/`rx` are hex encoded.
+
+Replay and benchmark a driver against a capture, on any Linux box without BMS and D-Bus:
+
+    python3 serialtrace.py info trace.jsonl
+    python3 serialtrace.py bench trace.jsonl [--bms LltJbd] [--address 0x01] [--cycles 1000]
+
+Only drivers that use `serial_port_pool` can be captured and replayed. The drivers based on
+`minimalmodbus`, CAN and Bluetooth open their connections themselves.
+"""
+
+import argparse
+import io
+import json
+import sys
+import threading
+import tracemalloc
+from time import perf_counter, time
+from typing import Dict, List, Tuple, Union
+
+import serial
+
+from registry import CAN_BMS_TYPES, SERIAL_BMS_TYPES, BmsType
+from utils import logger, serial_port_pool
+
+
+class TraceWriter:
+    """
+    Appends the events of all captured ports to a JSON lines file
+    """
+
+    def __init__(self, file_path: str):
+        self.file = open(file_path, "a", buffering=1)
+        self.start = time()
+        self._lock = threading.Lock()
+        self.write({"trace": 1, "start": self.start})
+
+    def write(self, event: dict) -> None:
+        with self._lock:
+            self.file.write(json.dumps(event) + "\n")
+
+    def add(self, port: str, direction: str, data: bytes) -> None:
+        """
+        :param port: Serial port
+        :param direction: "tx" or "rx"
+        :param data: Raw bytes
+        """
+        self.write(
+            {"t": round(time() - self.start, 6), "port": port, direction: data.hex()}
+        )
+
+    def note(self, port: str, **values) -> None:
+        """
+        Add information about the port, e.g. the detected BMS type
+        """
+        self.write(dict({"t": round(time() - self.start, 6), "port": port}, **values))
+
+
+class RecordingSerial:
+    """
+    Wraps an opened `serial.Serial` and records every write and every non empty read
+    """
+
+    def __init__(self, ser: serial.Serial, writer: TraceWriter):
+        object.__setattr__(self, "_ser", ser)
+        object.__setattr__(self, "_writer", writer)
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    def __setattr__(self, name, value):
+        # baudrate, parity, timeout, ... are set on the port
+        setattr(self._ser, name, value)
+
+    def write(self, data: bytes) -> int:
+        self._writer.add(self._ser.port, "tx", bytes(data))
+        return self._ser.write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._ser.read(size)
+        if data:
+            self._writer.add(self._ser.port, "rx", data)
+        return data
+
+    def read_until(
+        self, expected: bytes = b"\n", size: Union[int, None] = None
+    ) -> bytes:
+        data = self._ser.read_until(expected, size)
+        if data:
+            self._writer.add(self._ser.port, "rx", data)
+        return data
+
+
+class Trace:
+    """
+    A capture loaded from a file: the replies to each request and the information about the port
+    """
+
+    def __init__(self, file_path: str):
+        self.replies: Dict[bytes, List[bytes]] = {}
+        """
+        Replies to each request in the order they were received, a request without reply has an empty reply
+        """
+        self.latencies: Dict[bytes, List[float]] = {}
+        """
+        Time in seconds from each request to the last byte of its reply
+        """
+        self.info: Dict[str, Union[str, int, None]] = {}
+        """
+        Last `bms`, `address` and `baud` noted in the capture
+        """
+        self.port: Union[str, None] = None
+
+        request = None
+        request_time = 0
+        reply = bytearray()
+        reply_time = 0
+
+        def close_request():
+            if request is not None:
+                self.replies.setdefault(request, []).append(bytes(reply))
+                if reply:
+                    self.latencies.setdefault(request, []).append(
+                        reply_time - request_time
+                    )
+
+        with open(file_path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if "trace" in event:
+                    continue
+                if self.port is None:
+                    self.port = event.get("port")
+                # replay the first port of a capture
+                if event.get("port") != self.port:
+                    continue
+
+                if "tx" in event:
+                    close_request()
+                    request = bytes.fromhex(event["tx"])
+                    request_time = event["t"]
+                    reply = bytearray()
+                elif "rx" in event:
+                    reply += bytes.fromhex(event["rx"])
+                    reply_time = event["t"]
+                else:
+                    self.info.update(
+                        {
+                            key: value
+                            for key, value in event.items()
+                            if key not in ("t", "port")
+                        }
+                    )
+
+        close_request()
+
+
+class ReplaySerial:
+    """
+    Replaces `serial.Serial`: answers each request with the next recorded reply to the same request.
+    The replies of a request are repeated in a loop, requests that were never recorded get no reply.
+    Nothing is waited for, so a benchmark only measures the time spent in the driver.
+    """
+
+    def __init__(
+        self,
+        trace: Trace,
+        port: str,
+        baudrate: int = 9600,
+        parity: str = serial.PARITY_NONE,
+        timeout: float = 0.1,
+    ):
+        self.trace = trace
+        self.port = port
+        self.baudrate = baudrate
+        self.parity = parity
+        self.timeout = timeout
+        self.is_open = True
+        self.buffer = bytearray()
+        self.requests = 0
+        self.unknown_requests = 0
+        self._positions: Dict[bytes, int] = {}
+
+    def fileno(self) -> int:
+        # there is nothing to wait for, `utils._wait_readable()` checks `in_waiting` instead
+        raise io.UnsupportedOperation("replayed port has no file descriptor")
+
+    def write(self, data: bytes) -> int:
+        data = bytes(data)
+        self.requests += 1
+        replies = self.trace.replies.get(data)
+        if replies is None:
+            self.unknown_requests += 1
+            return len(data)
+
+        position = self._positions.get(data, 0)
+        self.buffer += replies[position % len(replies)]
+        self._positions[data] = position + 1
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read_until(
+        self, expected: bytes = b"\n", size: Union[int, None] = None
+    ) -> bytes:
+        end = self.buffer.find(expected)
+        length = len(self.buffer) if end < 0 else end + len(expected)
+        if size is not None:
+            length = min(length, size)
+        return self.read(length)
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.buffer)
+
+    def inWaiting(self) -> int:
+        return len(self.buffer)
+
+    def reset_input_buffer(self) -> None:
+        self.buffer.clear()
+
+    def reset_output_buffer(self) -> None:
+        pass
+
+    flushInput = reset_input_buffer
+    flushOutput = reset_output_buffer
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+_writer: Union[TraceWriter, None] = None
+
+
+def start_capture(file_path: str) -> TraceWriter:
+    """
+    Record all ports opened by `serial_port_pool` from now on
+
+    :param file_path: File to append the capture to
+    :return: The writer, to add notes
+    """
+    global _writer
+    _writer = TraceWriter(file_path)
+    factory = serial_port_pool.port_factory
+
+    def open_recording(*args, **kwargs):
+        return RecordingSerial(factory(*args, **kwargs), _writer)
+
+    serial_port_pool.port_factory = open_recording
+    logger.info(f"Capturing the serial traffic to {file_path}")
+    return _writer
+
+
+def note(port: str, **values) -> None:
+    """
+    Add information about a port to the capture, if capturing is active
+    """
+    if _writer is not None:
+        _writer.note(port, **values)
+
+
+def start_replay(trace: Trace) -> Dict[str, ReplaySerial]:
+    """
+    Answer all requests to ports opened by `serial_port_pool` from the trace
+
+    :param trace: The loaded capture
+    :return: The opened replay ports by port name, to get their statistics
+    """
+    ports: Dict[str, ReplaySerial] = {}
+
+    def open_replay(port, baudrate=9600, parity=serial.PARITY_NONE, timeout=0.1):
+        ports[port] = ReplaySerial(trace, port, baudrate, parity, timeout)
+        return ports[port]
+
+    serial_port_pool.close_all()
+    serial_port_pool.port_factory = open_replay
+    return ports
+
+
+def find_bms_type(name: str, address: Union[bytes, None]) -> BmsType:
+    for bms_type in SERIAL_BMS_TYPES + CAN_BMS_TYPES:
+        if bms_type.name == name and (address is None or bms_type.address == address):
+            return bms_type
+    for bms_type in SERIAL_BMS_TYPES + CAN_BMS_TYPES:
+        if bms_type.name == name:
+            return bms_type
+    raise ValueError(f"Unknown BMS type {name}")
+
+
+def measure(function, cycles: int) -> Tuple[float, float, int]:
+    """
+    Call a function repeatedly and measure its speed and memory allocations
+
+    :param function: Function to call
+    :param cycles: Number of calls
+    :return: Calls per second, average peak of the temporary allocations per call in bytes,
+        memory that was still allocated after all calls in bytes
+    """
+    # warm up, the first calls initialize the values of the battery
+    for _ in range(min(cycles, 10)):
+        function()
+
+    time_start = perf_counter()
+    for _ in range(cycles):
+        function()
+    rate = cycles / (perf_counter() - time_start)
+
+    # tracemalloc slows down the calls, so measure the allocations in a separate run
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    peak_total = 0
+    for _ in range(cycles):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - before
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return rate, peak_total / cycles, current - base
+
+
+def bench(args) -> int:
+    trace = Trace(args.trace)
+    name = args.bms or trace.info.get("bms")
+    if name is None:
+        print("The capture does not name the BMS type, use --bms")
+        return 1
+
+    address = args.address if args.address is not None else trace.info.get("address")
+    address = bytes.fromhex(address.replace("0x", "")) if address else None
+    bms_type = find_bms_type(name, address)
+    baud = trace.info.get("baud") or bms_type.baud
+    ports = start_replay(trace)
+
+    battery = bms_type.load()(
+        port=trace.port, baud=baud, address=address or bms_type.address
+    )
+    time_start = perf_counter()
+    if not battery.test_connection():
+        print(f"test_connection() failed, does the capture contain a {name}?")
+        return 1
+    print(
+        f"{name} on {trace.port}, {len(trace.replies)} different requests in the capture"
+    )
+    print(f"test_connection:  {(perf_counter() - time_start) * 1000:9.3f} ms")
+
+    def pipeline():
+        battery.refresh_data()
+        battery.manage_charge_voltage()
+        battery.manage_charge_current()
+        battery.add_timeseries_sample()
+
+    for label, function in (
+        ("refresh_data", battery.refresh_data),
+        ("pipeline", pipeline),
+    ):
+        rate, peak, retained = measure(function, args.cycles)
+        print(
+            f"{label + ':':17} {rate:9.1f} cycles/s | "
+            + f"{peak / 1024:7.1f} KiB allocated per cycle | {retained / 1024:7.1f} KiB retained"
+        )
+
+    replay = ports.get(trace.port)
+    if replay is not None and replay.unknown_requests > 0:
+        print(
+            f"{replay.unknown_requests} of {replay.requests} requests were not in the capture "
+            + "and got no reply, the numbers include their timeouts"
+        )
+    return 0
+
+
+def info(args) -> int:
+    trace = Trace(args.trace)
+    print(f"Port {trace.port} {trace.info}")
+    for request, replies in trace.replies.items():
+        latencies = trace.latencies.get(request, [])
+        answered = sum(1 for reply in replies if reply)
+        print(
+            f"{request.hex()[:40]:40} {len(replies):6} requests | {answered:6} replies"
+            + (
+                f" | avg {sum(latencies) / len(latencies) * 1000:7.1f} ms | max {max(latencies) * 1000:7.1f} ms"
+                if latencies
+                else ""
+            )
+        )
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Show or replay a capture of the serial traffic of a BMS"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_info = commands.add_parser("info", help="show the requests and reply times")
+    parser_info.add_argument("trace", help="capture file")
+    parser_info.set_defaults(function=info)
+
+    parser_bench = commands.add_parser(
+        "bench", help="benchmark the driver against the capture"
+    )
+    parser_bench.add_argument("trace", help="capture file")
+    parser_bench.add_argument("--bms", help="BMS type, if not noted in the capture")
+    parser_bench.add_argument("--address", help="address of the BMS in hex, e.g. 0x01")
+    parser_bench.add_argument("--cycles", type=int, default=1000)
+    parser_bench.set_defaults(function=bench)
+
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+import math
+from array import array
+from collections import deque
+from time import localtime
+from typing import Dict, List, Tuple, Union
+
+NAN = float("nan")
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of float values, backed by an array. When the buffer is full, the oldest value is overwritten.
+    Mean, min and max of all values in the buffer are available in O(1).
+    Values that are `None` are stored as NaN and ignored by mean, min and max.
+
+    :param capacity: Maximum number of values
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        self._values = array("d", [NAN] * capacity)
+        self._position: int = 0
+        """
+        Total number of values appended, the next value is written to `_position % capacity`
+        """
+        self._sum: float = 0
+        self._count: int = 0
+        """
+        Number of valid (not NaN) values in the buffer
+        """
+        # monotonic queues of (position, value), the first item is the min/max of the buffer
+        self._min_queue: deque = deque()
+        self._max_queue: deque = deque()
+
+    def append(self, value: Union[float, None]) -> None:
+        """
+        Add a value and remove the oldest one, if the buffer is full
+
+        :param value: The value to add
+        """
+        position = self._position
+        index = position % self.capacity
+
+        if position >= self.capacity:
+            oldest = self._values[index]
+            if oldest == oldest:
+                self._sum -= oldest
+                self._count -= 1
+            expired = position - self.capacity
+            if self._min_queue and self._min_queue[0][0] <= expired:
+                self._min_queue.popleft()
+            if self._max_queue and self._max_queue[0][0] <= expired:
+                self._max_queue.popleft()
+
+        if value is None or value != value:
+            self._values[index] = NAN
+        else:
+            self._values[index] = value
+            self._sum += value
+            self._count += 1
+            while self._min_queue and self._min_queue[-1][1] >= value:
+                self._min_queue.pop()
+            self._min_queue.append((position, value))
+            while self._max_queue and self._max_queue[-1][1] <= value:
+                self._max_queue.pop()
+            self._max_queue.append((position, value))
+
+        self._position = position + 1
+
+        # recalculate the sum once per round to avoid accumulating floating point errors
+        if self._position % self.capacity == 0:
+            self._sum = sum(value for value in self._values if value == value)
+
+    def __len__(self) -> int:
+        return min(self._position, self.capacity)
+
+    def count(self) -> int:
+        """
+        Number of valid values in the buffer
+        """
+        return self._count
+
+    def mean(self) -> Union[float, None]:
+        """
+        Mean of all valid values in the buffer
+        """
+        return self._sum / self._count if self._count > 0 else None
+
+    def sum(self) -> float:
+        """
+        Sum of all valid values in the buffer
+        """
+        return self._sum
+
+    def min(self) -> Union[float, None]:
+        """
+        Lowest valid value in the buffer
+        """
+        return self._min_queue[0][1] if self._min_queue else None
+
+    def max(self) -> Union[float, None]:
+        """
+        Highest valid value in the buffer
+        """
+        return self._max_queue[0][1] if self._max_queue else None
+
+    def latest(self) -> Union[float, None]:
+        """
+        Last value added to the buffer
+        """
+        if self._position == 0:
+            return None
+        value = self._values[(self._position - 1) % self.capacity]
+        return None if value != value else value
+
+    def values(self) -> List[Union[float, None]]:
+        """
+        All values in the buffer, the oldest first
+        """
+        if self._position <= self.capacity:
+            values = self._values[: self._position]
+        else:
+            index = self._position % self.capacity
+            values = self._values[index:] + self._values[:index]
+        return [None if value != value else value for value in values]
+
+
+class Tier:
+    """
+    One resolution of a `TimeSeries`. Samples are collected for `interval` seconds and
+    their mean is stored as one value in the ring buffer of each column.
+    With an interval of 0 every sample is stored.
+
+    :param interval: Length of one bucket in seconds
+    :param capacity: Number of buckets to keep
+    :param columns: Names of the columns
+    """
+
+    def __init__(self, interval: float, capacity: int, columns: Tuple[str, ...]):
+        self.interval: float = interval
+        self.capacity: int = capacity
+        self.timestamps = RingBuffer(capacity)
+        self.columns: Dict[str, RingBuffer] = {
+            column: RingBuffer(capacity) for column in columns
+        }
+        self._bucket_start: float = None
+        self._bucket_sum: Dict[str, float] = {column: 0 for column in columns}
+        self._bucket_count: Dict[str, int] = {column: 0 for column in columns}
+
+    def add(self, timestamp: float, values: Dict[str, Union[float, None]]) -> None:
+        """
+        Add one sample
+
+        :param timestamp: Timestamp of the sample
+        :param values: Values of the sample, missing columns are stored as `None`
+        """
+        if self.interval == 0:
+            self.timestamps.append(timestamp)
+            for column, buffer in self.columns.items():
+                buffer.append(values.get(column))
+            return
+
+        bucket_start = timestamp - timestamp % self.interval
+        if self._bucket_start is not None and bucket_start != self._bucket_start:
+            self.flush()
+        self._bucket_start = bucket_start
+
+        for column in self.columns:
+            value = values.get(column)
+            if value is not None:
+                self._bucket_sum[column] += value
+                self._bucket_count[column] += 1
+
+    def flush(self) -> None:
+        """
+        Store the mean of the collected samples as one bucket
+        """
+        if self._bucket_start is None:
+            return
+        self.timestamps.append(self._bucket_start)
+        for column, buffer in self.columns.items():
+            count = self._bucket_count[column]
+            buffer.append(self._bucket_sum[column] / count if count > 0 else None)
+            self._bucket_sum[column] = 0
+            self._bucket_count[column] = 0
+        self._bucket_start = None
+
+
+class TimeSeries:
+    """
+    Fixed memory history of the battery values in multiple resolutions.
+    The first tier stores every sample, the following tiers store the mean of 1 second, 1 minute and 15 minutes.
+
+    :param columns: Names of the recorded values
+    :param tiers: Tuples of (interval in seconds, number of values to keep) for each tier
+    """
+
+    COLUMNS = (
+        "voltage",
+        "current",
+        "soc",
+        "min_cell_voltage",
+        "max_cell_voltage",
+        "temperature",
+        "min_temperature",
+        "max_temperature",
+        "charge_current_limit",
+        "discharge_current_limit",
+    )
+
+    TIERS = (
+        (0, 300),  # every poll
+        (1, 300),  # 1 second for 5 minutes
+        (60, 1440),  # 1 minute for 1 day
+        (900, 672),  # 15 minutes for 7 days
+    )
+
+    def __init__(
+        self,
+        columns: Tuple[str, ...] = COLUMNS,
+        tiers: Tuple[Tuple[float, int], ...] = TIERS,
+    ):
+        self.columns = columns
+        self.tiers: List[Tier] = [
+            Tier(interval, capacity, columns) for interval, capacity in tiers
+        ]
+
+    def add(self, timestamp: float, **values: Union[float, None]) -> None:
+        """
+        Add one sample to all tiers
+
+        :param timestamp: Timestamp of the sample
+        :param values: Values of the sample by column name
+        """
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+
+    def tier(self, interval: float) -> Tier:
+        """
+        Get the tier with the given interval
+
+        :param interval: Interval of the tier in seconds, 0 for every sample
+        :return: The tier
+        """
+        for tier in self.tiers:
+            if tier.interval == interval:
+                return tier
+        raise KeyError(f"No tier with interval {interval} s")
+
+    def buffer(self, column: str, interval: float = 0) -> RingBuffer:
+        """
+        Get the ring buffer of a column
+
+        :param column: Name of the column
+        :param interval: Interval of the tier in seconds, 0 for every sample
+        :return: The ring buffer
+        """
+        return self.tier(interval).columns[column]
+
+    def mean(self, column: str, interval: float = 0) -> Union[float, None]:
+        return self.buffer(column, interval).mean()
+
+    def min(self, column: str, interval: float = 0) -> Union[float, None]:
+        return self.buffer(column, interval).min()
+
+    def max(self, column: str, interval: float = 0) -> Union[float, None]:
+        return self.buffer(column, interval).max()
+
+    def latest(self, column: str, interval: float = 0) -> Union[float, None]:
+        return self.buffer(column, interval).latest()
+
+
+class CurrentEstimator:
+    """
+    Estimates the average current used to calculate Time-To-Go and Time-To-SoC.
+
+    Modes:
+    - `window`: mean of the last samples of the `current` column of the time series
+    - `ewma`: exponential moving average with a time constant of `window` seconds
+    - `time_weighted`: mean over the last `window` seconds, weighted by the time between the samples,
+      so irregular poll intervals do not distort the average
+    - `profile`: like `time_weighted`, but additionally learns the average current of each hour of the day
+      and uses this load profile to predict, when an amount of charge is reached
+
+    :param timeseries: Time series of the battery, used by the `window` mode
+    :param mode: One of `window`, `ewma`, `time_weighted` or `profile`
+    :param window: Time window or time constant in seconds
+    :param profile: Previously learned profile of the `profile` mode, e.g. loaded from a file
+    """
+
+    PROFILE_LEARNING_RATE = 0.3
+    """
+    Weight of the last day, when the mean current of an hour is added to the profile
+    """
+
+    PREDICTION_HORIZON = 7 * 24 * 3600
+    """
+    Maximum time in seconds the profile prediction looks into the future
+    """
+
+    def __init__(
+        self,
+        timeseries: TimeSeries,
+        mode: str = "window",
+        window: float = 300,
+        profile: List[Union[float, None]] = None,
+    ):
+        self.timeseries = timeseries
+        self.mode = mode
+        self.window = window
+
+        self._last_timestamp: float = None
+        self._last_current: float = None
+
+        self._ewma: float = None
+
+        # segments of (end timestamp, charge in As, duration in s) for the time weighted mean
+        self._segments: deque = deque()
+        self._segments_charge: float = 0
+        self._segments_duration: float = 0
+
+        self.profile: List[Union[float, None]] = (
+            list(profile) if profile is not None and len(profile) == 24 else [None] * 24
+        )
+        """
+        Learned mean current for each hour of the day
+        """
+        self.profile_changed: bool = False
+        """
+        Set, when an hour was added to the profile. Reset by the owner after saving the profile
+        """
+        self._hour: int = None
+        self._hour_charge: float = 0
+        self._hour_duration: float = 0
+
+    def update(self, timestamp: float, current: Union[float, None]) -> None:
+        """
+        Add a current sample. Called once per poll cycle.
+
+        :param timestamp: Timestamp of the sample
+        :param current: Current in Ampere
+        """
+        if current is None:
+            return
+
+        if self._last_timestamp is not None and timestamp > self._last_timestamp:
+            duration = timestamp - self._last_timestamp
+            # the last current is assumed to flow until this sample
+            charge = self._last_current * duration
+
+            if self.mode == "ewma":
+                alpha = 1 - math.exp(-duration / self.window)
+                self._ewma += (current - self._ewma) * alpha
+
+            if self.mode in ("time_weighted", "profile"):
+                self._segments.append((timestamp, charge, duration))
+                self._segments_charge += charge
+                self._segments_duration += duration
+                while self._segments and self._segments[0][0] < timestamp - self.window:
+                    _, old_charge, old_duration = self._segments.popleft()
+                    self._segments_charge -= old_charge
+                    self._segments_duration -= old_duration
+
+            if self.mode == "profile":
+                self._update_profile(timestamp, charge, duration)
+
+        if self._ewma is None:
+            self._ewma = current
+
+        self._last_timestamp = timestamp
+        self._last_current = current
+
+    def _update_profile(self, timestamp: float, charge: float, duration: float) -> None:
+        hour = localtime(timestamp).tm_hour
+        if self._hour is not None and hour != self._hour and self._hour_duration > 0:
+            mean = self._hour_charge / self._hour_duration
+            learned = self.profile[self._hour]
+            self.profile[self._hour] = (
+                mean
+                if learned is None
+                else learned + (mean - learned) * self.PROFILE_LEARNING_RATE
+            )
+            self.profile_changed = True
+            self._hour_charge = 0
+            self._hour_duration = 0
+        self._hour = hour
+        self._hour_charge += charge
+        self._hour_duration += duration
+
+    def average(self) -> Union[float, None]:
+        """
+        Get the estimated average current
+
+        :return: Average current in Ampere
+        """
+        if self.mode == "ewma":
+            return self._ewma
+        if self.mode in ("time_weighted", "profile"):
+            if self._segments_duration > 0:
+                return self._segments_charge / self._segments_duration
+            return self._last_current
+        return self.timeseries.mean("current")
+
+    def predict_seconds(self, charge: float, timestamp: float) -> Union[float, None]:
+        """
+        Predict the seconds until the battery charged (positive) or discharged (negative) `charge` Ah.
+        With the `profile` mode the learned current of each hour is used, hours that are not learned yet
+        use the average current. All other modes assume the average current stays constant.
+
+        :param charge: Charge in Ah, positive for charging, negative for discharging
+        :param timestamp: Timestamp to start the prediction from
+        :return: Seconds or None, if the charge is not reached within the prediction horizon
+        """
+        average = self.average()
+        if charge == 0:
+            return 0
+
+        if self.mode != "profile":
+            if average is None or average == 0 or (average > 0) != (charge > 0):
+                return None
+            return charge / average * 3600
+
+        remaining = charge * 3600
+        elapsed = 0
+        while elapsed < self.PREDICTION_HORIZON:
+            current_timestamp = timestamp + elapsed
+            hour_current = self.profile[localtime(current_timestamp).tm_hour]
+            # use the recent average for the current hour and for hours not learned yet
+            if elapsed == 0 or hour_current is None:
+                hour_current = average
+            if hour_current is None:
+                return None
+            # seconds until the next full hour
+            duration = 3600 - current_timestamp % 3600
+            if hour_current != 0 and (hour_current > 0) == (remaining > 0):
+                needed = remaining / hour_current
+                if needed <= duration:
+                    return elapsed + needed
+            remaining -= hour_current * duration
+            elapsed += duration
+        return None
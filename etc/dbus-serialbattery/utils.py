@@ -2,12 +2,18 @@
 # Standard library imports
 import bisect
 import configparser
+import io
+import json
 import logging
+import select
 import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-from struct import unpack_from
-from time import sleep
-from typing import List, Any, Callable, Union
+from struct import calcsize, unpack_from
+from time import time
+from typing import Dict, Iterator, List, Any, Callable, Tuple, Union
 
 # Third-party imports
 import serial
@@ -351,6 +357,14 @@ if MAX_BATTERY_DISCHARGE_CURRENT not in MAX_DISCHARGE_CURRENT_SOC:
 
 # --------- Time-To-Go ---------
 TIME_TO_GO_ENABLE: bool = "True" == config["DEFAULT"]["TIME_TO_GO_ENABLE"]
+TIME_TO_GO_CURRENT_MODE: str = config["DEFAULT"]["TIME_TO_GO_CURRENT_MODE"]
+TIME_TO_GO_CURRENT_WINDOW: float = float(config["DEFAULT"]["TIME_TO_GO_CURRENT_WINDOW"])
+if TIME_TO_GO_CURRENT_MODE not in ("window", "ewma", "time_weighted", "profile"):
+    errors_in_config.append(
+        f"**CONFIG ISSUE**: TIME_TO_GO_CURRENT_MODE ({TIME_TO_GO_CURRENT_MODE}) is not valid. "
+        + "Valid values are window, ewma, time_weighted and profile. Using window instead."
+    )
+    TIME_TO_GO_CURRENT_MODE = "window"
 
 # --------- Time-To-Soc ---------
 TIME_TO_SOC_POINTS: list = _get_list_from_config(
@@ -381,6 +395,22 @@ if SOC_CALC_CURRENT_REPORTED_BY_BMS == SOC_CALC_CURRENT_MEASURED_BY_USER:
 else:
     SOC_CALC_CURRENT: bool = True
 
+# --------- Bluetooth BMS ---------
+BLUETOOTH_MAX_CONNECTIONS: int = int(config["DEFAULT"]["BLUETOOTH_MAX_CONNECTIONS"])
+"""
+Maximum number of Bluetooth BMS that are connected at the same time
+"""
+
+BLUETOOTH_SLOT_TIME: float = float(config["DEFAULT"]["BLUETOOTH_SLOT_TIME"])
+"""
+Time in seconds a Bluetooth BMS keeps its connection, while other BMS wait for a free connection
+"""
+
+BLUETOOTH_SCAN_TIMEOUT: float = float(config["DEFAULT"]["BLUETOOTH_SCAN_TIMEOUT"])
+"""
+Time in seconds to scan for the Bluetooth BMS
+"""
+
 # --------- Additional settings ---------
 BMS_TYPE: list = _get_list_from_config("DEFAULT", "BMS_TYPE", lambda v: str(v))
 
@@ -388,6 +418,50 @@ EXCLUDED_DEVICES: list = _get_list_from_config(
     "DEFAULT", "EXCLUDED_DEVICES", lambda v: str(v)
 )
 
+BMS_DETECTION_CACHE: bool = "True" == config["DEFAULT"]["BMS_DETECTION_CACHE"]
+PATH_FRAME_TRACE: str = (
+    (
+        Path("/data/etc/dbus-serialbattery")
+        if Path("/data/etc/dbus-serialbattery").is_dir()
+        else path
+    )
+    .joinpath("frame_trace.jsonl")
+    .absolute()
+    .__str__()
+)
+"""
+Path of the file the frame trace is written to, when it's disabled on the dbus
+"""
+
+PATH_DETECTION_CACHE: str = (
+    (
+        Path("/data/etc/dbus-serialbattery")
+        if Path("/data/etc/dbus-serialbattery").is_dir()
+        else path
+    )
+    .joinpath("detection_cache.json")
+    .absolute()
+    .__str__()
+)
+"""
+Path of the file with the detected BMS per port.
+The driver runs from a copy in `/opt`, which is recreated on every boot, therefore store it in `/data`
+"""
+
+PATH_CURRENT_PROFILE: str = (
+    (
+        Path("/data/etc/dbus-serialbattery")
+        if Path("/data/etc/dbus-serialbattery").is_dir()
+        else path
+    )
+    .joinpath("current_profile.json")
+    .absolute()
+    .__str__()
+)
+"""
+Path of the file with the learned hourly current profile per battery, see `TIME_TO_GO_CURRENT_MODE = profile`
+"""
+
 POLL_INTERVAL: float = (
     float(config["DEFAULT"]["POLL_INTERVAL"]) * 1000
     if config["DEFAULT"]["POLL_INTERVAL"] != ""
@@ -397,12 +471,67 @@ POLL_INTERVAL: float = (
 Poll interval in milliseconds
 """
 
+POLL_INTERVAL_MAX: int = int(float(config["DEFAULT"]["POLL_INTERVAL_MAX"]) * 1000)
+"""
+Maximum poll interval in milliseconds, the poll interval is raised up to this value, if the BMS is slow
+"""
+
+POLL_TIER_MEDIUM_INTERVAL: float = float(config["DEFAULT"]["POLL_TIER_MEDIUM_INTERVAL"])
+"""
+Interval in seconds to read the data of the `ReadTier.MEDIUM`
+"""
+
+POLL_TIER_SLOW_INTERVAL: float = float(config["DEFAULT"]["POLL_TIER_SLOW_INTERVAL"])
+"""
+Interval in seconds to read the data of the `ReadTier.SLOW`
+"""
+
+IO_THREAD: bool = "True" == config["DEFAULT"]["IO_THREAD"]
+"""
+Read the data of the batteries in a separate thread, so that a slow BMS does not block the dbus service
+"""
+
+SAVE_SETTINGS_INTERVAL: int = (
+    int(config["DEFAULT"]["SAVE_SETTINGS_INTERVAL"])
+    if int(config["DEFAULT"]["SAVE_SETTINGS_INTERVAL"]) > 1
+    else 1
+)
+"""
+Interval in seconds to save the battery state to the dbus settings
+"""
+
 # Auto reset SoC
 AUTO_RESET_SOC: bool = "True" == config["DEFAULT"]["AUTO_RESET_SOC"]
 
 # Publish the config settings to the dbus path "/Info/Config/"
 PUBLISH_CONFIG_VALUES: bool = "True" == config["DEFAULT"]["PUBLISH_CONFIG_VALUES"]
 
+# Publish all changed values of a poll cycle in one "ItemsChanged" signal
+PUBLISH_ITEMS_CHANGED: bool = "True" == config["DEFAULT"]["PUBLISH_ITEMS_CHANGED"]
+
+PERF_STATS: bool = "True" == config["DEFAULT"]["PERF_STATS"]
+"""
+Publish the time spent in each phase of the poll cycle to the dbus path "/Debug/Perf/"
+"""
+
+PERF_STATS_DUMP_FILE: Union[str, None] = (
+    config["DEFAULT"]["PERF_STATS_DUMP_FILE"]
+    if config["DEFAULT"]["PERF_STATS_DUMP_FILE"] != ""
+    else None
+)
+"""
+File to write the performance statistics to, None to not write a file
+"""
+
+SERIAL_TRACE_FILE: Union[str, None] = (
+    config["DEFAULT"]["SERIAL_TRACE_FILE"]
+    if config["DEFAULT"]["SERIAL_TRACE_FILE"] != ""
+    else None
+)
+"""
+File to record the serial traffic to, None to not record
+"""
+
 BATTERY_CELL_DATA_FORMAT: int = int(config["DEFAULT"]["BATTERY_CELL_DATA_FORMAT"])
 
 MIDPOINT_ENABLE: bool = "True" == config["DEFAULT"]["MIDPOINT_ENABLE"]
@@ -435,6 +564,9 @@ INVERT_CURRENT_MEASUREMENT: int = int(config["DEFAULT"]["INVERT_CURRENT_MEASUREM
 # -- JK BMS settings
 JKBMS_CAN_CELL_COUNT: int = int(config["DEFAULT"]["JKBMS_CAN_CELL_COUNT"])
 
+# -- Sinowealth settings
+SINOWEALTH_BATCH_READ: bool = "True" == config["DEFAULT"]["SINOWEALTH_BATCH_READ"]
+
 # -- ESC GreenMeter and Lipro device settings
 GREENMETER_ADDRESS: int = int(config["DEFAULT"]["GREENMETER_ADDRESS"])
 LIPRO_START_ADDRESS: int = int(config["DEFAULT"]["LIPRO_START_ADDRESS"])
@@ -579,37 +711,456 @@ def bytearray_to_string(data: bytearray) -> str:
     :param data: Data to convert
     :return: Converted string
     """
-    return "".join("\\x" + format(byte, "02x") for byte in data)
+    if not data:
+        return ""
+    # let bytes.hex() do the work in C instead of formatting each byte in Python
+    return ("\\" + bytes(data).hex("\\")).replace("\\", "\\x")
 
 
-def open_serial_port(port: str, baud: int) -> serial.Serial:
+class HexDump:
+    """
+    Formats data with `bytearray_to_string()` only when the log message is emitted, so that debug messages
+    cost nothing on hot paths, if debug logging is disabled. Use `logger.debug("data: %s", HexDump(data))`
     """
-    Open a serial port
 
-    :param port: Serial port
-    :param baud: Baud rate
-    :return: Opened serial port
+    __slots__ = ("data",)
+
+    def __init__(self, data: Union[bytes, bytearray, List[int]]):
+        self.data = data
+
+    def __str__(self) -> str:
+        return bytearray_to_string(bytes(self.data))
+
+
+class SerialPortPool:
     """
-    ser = None
-    tries = 3
-    while tries > 0:
+    Process wide pool of open serial ports.
+
+    Opening a serial port and configuring it is expensive compared to a single request. Therefore the
+    ports are kept open and shared by all requests. The access to a port is serialized with a lock per port.
+    If the port fails (e.g. USB adapter was disconnected), it is closed and transparently reopened on
+    the next request.
+
+    Only one handle per device is kept open. If a request needs a different baud rate or parity
+    (e.g. while testing different BMS types), the open port is reconfigured.
+    """
+
+    def __init__(self):
+        self._ports: Dict[str, serial.Serial] = {}
+        self._locks: Dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, int, str], Dict[str, int]] = {}
+        """
+        Number of `opens`, `reuses` and `reconfigures` per (port, baud, parity)
+        """
+        self.port_factory: Callable[..., serial.Serial] = serial.Serial
+        """
+        Opens a port, replaced by `serialtrace` to capture or replay the traffic
+        """
+
+    def _get_lock(self, port: str) -> threading.RLock:
+        with self._lock:
+            if port not in self._locks:
+                self._locks[port] = threading.RLock()
+            return self._locks[port]
+
+    def _count(self, key: Tuple[str, int, str], counter: str) -> None:
+        if key not in self.counters:
+            self.counters[key] = {"opens": 0, "reuses": 0, "reconfigures": 0}
+        self.counters[key][counter] += 1
+
+    @contextmanager
+    def acquire(
+        self,
+        port: str,
+        baud: int,
+        parity: str = serial.PARITY_NONE,
+        timeout: float = 0.1,
+    ) -> Iterator[serial.Serial]:
+        """
+        Get exclusive access to an open serial port. Use it as context manager, the port is not closed on exit.
+
+        :param port: Serial port
+        :param baud: Baud rate
+        :param parity: Parity
+        :param timeout: Read timeout in seconds
+        :return: Opened serial port
+        """
+        key = (port, baud, parity)
+        with self._get_lock(port):
+            ser = self._ports.get(port)
+
+            if ser is None or not ser.is_open:
+                ser = self.port_factory(
+                    port, baudrate=baud, parity=parity, timeout=timeout
+                )
+                self._ports[port] = ser
+                self._count(key, "opens")
+                logger.debug(
+                    f"Opened serial port {port} with {baud} baud, parity {parity} | {self.counters[key]}"
+                )
+            else:
+                # every setter reconfigures the port, so change only what differs
+                if ser.baudrate != baud or ser.parity != parity:
+                    ser.baudrate = baud
+                    ser.parity = parity
+                    self._count(key, "reconfigures")
+                if ser.timeout != timeout:
+                    ser.timeout = timeout
+                self._count(key, "reuses")
+
+            try:
+                yield ser
+            except (serial.SerialException, OSError):
+                # the port is broken, e.g. the USB adapter was disconnected
+                self.discard(ser)
+                raise
+
+    def discard(self, ser: serial.Serial) -> None:
+        """
+        Close a broken port and remove it from the pool. It's reopened on the next request.
+
+        :param ser: Serial port
+        """
+        with self._get_lock(ser.port):
+            if self._ports.get(ser.port) is ser:
+                del self._ports[ser.port]
+            try:
+                ser.close()
+            except Exception:
+                pass
+        logger.debug(
+            f"Closed serial port {ser.port}, it will be reopened on the next request"
+        )
+
+    def close_all(self) -> None:
+        """
+        Close all open ports
+        """
+        for port in list(self._ports):
+            ser = self._ports.get(port)
+            if ser is not None:
+                self.discard(ser)
+
+
+serial_port_pool = SerialPortPool()
+"""
+Process wide pool of open serial ports, use `serial_port_pool.acquire()` to access a port
+"""
+
+
+class Framing:
+    """
+    Declarative description of the reply frame of a BMS, used by `read_serialport_data()`
+    to know how many bytes have to be read.
+
+    The frame is complete, when it contains `length + length_check + 1` bytes. `length` is read from the
+    frame at `length_pos` or set to `length_fixed`.
+
+    :param length_pos: Position of the length byte
+    :param length_check: Number of bytes after the data, that are not counted by the length byte
+    :param length_fixed: Fixed length of the data, if not set it will be read from the data
+    :param length_size: Size of the length byte, can be "B", "H", "I" or "L"
+    :param checksum: Function that gets the complete frame and returns True, if the checksum is valid
+    """
+
+    def __init__(
+        self,
+        length_pos: int,
+        length_check: int,
+        length_fixed: Union[int, None] = None,
+        length_size: str = "B",
+        checksum: Union[Callable[[bytearray], bool], None] = None,
+    ):
+        self.length_pos = length_pos
+        self.length_check = length_check
+        self.length_fixed = length_fixed
+        self.length_size = length_size.upper()
+        self.checksum = checksum
+        self.length_byte_size = calcsize(">" + self.length_size)
+
+    def header_length(self) -> int:
+        """
+        Number of bytes needed to get the length of the frame
+
+        :return: Number of bytes
+        """
+        if self.length_fixed is not None:
+            return 1
+        return self.length_pos + self.length_byte_size
+
+    def frame_length(self, header: bytearray) -> int:
+        """
+        Number of bytes of the complete frame
+
+        :param header: At least `header_length()` bytes of the frame
+        :return: Number of bytes
+        """
+        if self.length_fixed is not None:
+            length = self.length_fixed
+        else:
+            length = unpack_from(">" + self.length_size, header, self.length_pos)[0]
+        return length + self.length_check + 1
+
+    def validate(self, frame: bytearray) -> bool:
+        """
+        Check the checksum of the frame, if a checksum function is set
+
+        :param frame: The complete frame
+        :return: True if the frame is valid
+        """
+        return self.checksum is None or self.checksum(frame)
+
+
+class SerialStats:
+    """
+    Statistics about the serial transactions, to see how many wakeups and bytes a transaction took
+    """
+
+    def __init__(self):
+        self.transactions: int = 0
+        self.wakeups: int = 0
+        self.bytes: int = 0
+        self.wait_time: float = 0
+        """
+        Time spent waiting for the reply in seconds
+        """
+        self.last: Dict[str, Union[int, float]] = {
+            "wakeups": 0,
+            "bytes": 0,
+            "wait_time": 0,
+        }
+
+    def add(self, wakeups: int, bytes_read: int, wait_time: float) -> None:
+        """
+        Add a transaction to the statistics
+
+        :param wakeups: Number of reads/wakeups needed to receive the reply
+        :param bytes_read: Number of bytes received
+        :param wait_time: Time waited for the reply in seconds
+        """
+        self.transactions += 1
+        self.wakeups += wakeups
+        self.bytes += bytes_read
+        self.wait_time += wait_time
+        self.last = {"wakeups": wakeups, "bytes": bytes_read, "wait_time": wait_time}
+
+
+serial_stats = SerialStats()
+"""
+Process wide statistics of all serial transactions
+"""
+
+
+class FrameTrace:
+    """
+    Ring buffer with the last raw frames sent to and received from the BMS.
+
+    Recording is off by default and costs only one attribute check per frame. It's switched on and off at
+    runtime on the dbus path `/Debug/FrameTrace`, when switched off the frames are written to `PATH_FRAME_TRACE`
+    in the capture format of `serialtrace.py`, so that they can be replayed.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.enabled: bool = False
+        self.frames: deque = deque(maxlen=capacity)
+        """
+        Tuples of (timestamp, port, direction, data), direction is "tx" or "rx"
+        """
+
+    def add(self, port: str, direction: str, data: bytes) -> None:
+        """
+        Add a frame, check `enabled` before calling this on hot paths
+
+        :param port: Port or address of the BMS
+        :param direction: "tx" for requests, "rx" for replies
+        :param data: Raw frame
+        """
+        if self.enabled:
+            self.frames.append((time(), port, direction, bytes(data)))
+
+    def start(self) -> None:
+        self.frames.clear()
+        self.enabled = True
+
+    def stop(self, file_path: Union[str, None] = None) -> int:
+        """
+        Stop recording and write the recorded frames to a file
+
+        :param file_path: File to write to, None to not write the frames
+        :return: Number of frames
+        """
+        self.enabled = False
+        count = len(self.frames)
+        if file_path is None or count == 0:
+            return count
+
+        start = self.frames[0][0]
         try:
-            ser = serial.Serial(port, baudrate=baud, timeout=0.1)
-            tries = 0
-        except serial.SerialException as e:
-            logger.error(e)
-            tries -= 1
+            with open(file_path, "w") as file:
+                file.write(json.dumps({"trace": 1, "start": start}) + "\n")
+                for timestamp, port, direction, data in self.frames:
+                    file.write(
+                        json.dumps(
+                            {
+                                "t": round(timestamp - start, 6),
+                                "port": port,
+                                direction: data.hex(),
+                            }
+                        )
+                        + "\n"
+                    )
+        except OSError as e:
+            logger.error(f"Could not write the frame trace: {e}")
+        return count
+
+
+frame_trace = FrameTrace()
+"""
+Process wide trace of the raw frames, see `FrameTrace`
+"""
+
+SERIAL_REPLY_TIMEOUT: float = 0.3
+"""
+Time in seconds to wait for the first bytes of a reply
+"""
+
+SERIAL_FRAME_TIMEOUT: float = 1.0
+"""
+Time in seconds to wait for the rest of a frame, after the first bytes were received
+"""
+
+
+def _wait_readable(ser: serial.Serial, timeout: float) -> bool:
+    """
+    Block until the serial port has data to read or the timeout expired
+
+    :param ser: Serial port
+    :param timeout: Timeout in seconds
+    :return: True if data is available
+    """
+    try:
+        readable, _, _ = select.select([ser.fileno()], [], [], timeout)
+        return len(readable) > 0
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        # port without file descriptor, e.g. not a POSIX serial port
+        return ser.in_waiting > 0
+
+
+def read_frame(
+    ser: serial.Serial, framing: Framing, reply_timeout: float = SERIAL_REPLY_TIMEOUT
+) -> Union[bytearray, bool]:
+    """
+    Read one frame described by `framing` from a serial port.
+    Every read blocks on the port until the missing bytes arrived or the timeout expired,
+    so there is no polling of the input buffer.
+
+    :param ser: Serial port
+    :param framing: Description of the frame
+    :param reply_timeout: Time in seconds to wait for the first bytes
+    :return: The frame or False, if no complete frame was received
+    """
+    time_start = time()
+    wakeups = 0
+    data = bytearray()
+
+    # read the header to get the frame length
+    deadline = time_start + reply_timeout
+    header_length = framing.header_length()
+    while len(data) < header_length and time() < deadline:
+        data += ser.read(header_length - len(data))
+        wakeups += 1
+
+    if len(data) < header_length:
+        serial_stats.add(wakeups, len(data), time() - time_start)
+        if frame_trace.enabled and data:
+            frame_trace.add(ser.port, "rx", data)
+        logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "]")
+        return False
+
+    # read the rest of the frame
+    frame_length = framing.frame_length(data)
+    deadline = time() + SERIAL_FRAME_TIMEOUT
+    while len(data) < frame_length and time() < deadline:
+        data += ser.read(frame_length - len(data))
+        wakeups += 1
+
+    if len(data) < frame_length:
+        serial_stats.add(wakeups, len(data), time() - time_start)
+        if frame_trace.enabled:
+            frame_trace.add(ser.port, "rx", data)
+        logger.error(
+            ">>> ERROR: No reply - returning [len:"
+            + str(len(data))
+            + "/"
+            + str(frame_length)
+            + "]"
+        )
+        return False
+
+    # read the bytes that arrive until the line is silent for 3.5 characters
+    # like the Modbus frame end detection, some BMS send more bytes than described
+    gap = max(35 / ser.baudrate, 0.002)
+    while _wait_readable(ser, gap):
+        chunk = ser.read(ser.in_waiting or 1)
+        wakeups += 1
+        if not chunk:
+            break
+        data += chunk
+
+    serial_stats.add(wakeups, len(data), time() - time_start)
+    if frame_trace.enabled:
+        frame_trace.add(ser.port, "rx", data)
+
+    if not framing.validate(data):
+        logger.error(">>> ERROR: Invalid checksum")
+        return False
+
+    return data
+
+
+def read_reply(
+    ser: serial.Serial, reply_timeout: float = SERIAL_REPLY_TIMEOUT
+) -> bytearray:
+    """
+    Read a reply of unknown format from a serial port.
+    Waits for the first bytes and then reads until the line is silent for 3.5 characters.
+
+    :param ser: Serial port
+    :param reply_timeout: Time in seconds to wait for the first bytes
+    :return: The received bytes, empty if there was no reply
+    """
+    time_start = time()
+    wakeups = 0
+    data = bytearray()
+
+    if _wait_readable(ser, reply_timeout):
+        deadline = time_start + reply_timeout + SERIAL_FRAME_TIMEOUT
+        gap = max(35 / ser.baudrate, 0.002)
+        while time() < deadline:
+            chunk = ser.read(ser.in_waiting or 1)
+            wakeups += 1
+            if not chunk:
+                break
+            data += chunk
+            if not _wait_readable(ser, gap):
+                break
 
-    return ser
+    serial_stats.add(wakeups, len(data), time() - time_start)
+    if frame_trace.enabled and data:
+        frame_trace.add(ser.port, "rx", data)
+
+    return data
 
 
 def read_serialport_data(
     ser: serial.Serial,
     command: bytearray,
-    length_pos: int,
-    length_check: int,
+    length_pos: Union[int, None] = None,
+    length_check: Union[int, None] = None,
     length_fixed: Union[int, None] = None,
     length_size: str = "B",
+    framing: Union[Framing, None] = None,
 ) -> bytearray:
     """
     Read data from a serial port
@@ -620,67 +1171,25 @@ def read_serialport_data(
     :param length_check: Length of the checksum
     :param length_fixed: Fixed length of the data, if not set it will be read from the data
     :param length_size: Size of the length byte, can be "B", "H", "I" or "L"
+    :param framing: Description of the frame, replaces `length_pos`, `length_check`, `length_fixed` and `length_size`
     :return: Data read from the serial port
     """
     try:
-        ser.flushOutput()
-        ser.flushInput()
-        ser.write(command)
+        if framing is None:
+            framing = Framing(length_pos, length_check, length_fixed, length_size)
 
-        if length_size.upper() == "B":
-            length_byte_size = 1
-        elif length_size.upper() == "H":
-            length_byte_size = 2
-        elif length_size.upper() == "I" or length_size.upper() == "L":
-            length_byte_size = 4
-
-        count = 0
-        toread = ser.inWaiting()
-
-        while toread < (length_pos + length_byte_size):
-            sleep(0.005)
-            toread = ser.inWaiting()
-            count += 1
-            if count > 50:
-                logger.error(">>> ERROR: No reply - returning")
-                return False
-
-        # logger.info('serial data toread ' + str(toread))
-        res = ser.read(toread)
-        if length_fixed is not None:
-            length = length_fixed
-        else:
-            if len(res) < (length_pos + length_byte_size):
-                logger.error(
-                    ">>> ERROR: No reply - returning [len:" + str(len(res)) + "]"
-                )
-                return False
-            length = unpack_from(">" + length_size, res, length_pos)[0]
-
-        # logger.info('serial data length ' + str(length))
-
-        count = 0
-        data = bytearray(res)
-        while len(data) <= length + length_check:
-            res = ser.read(length + length_check)
-            data.extend(res)
-            # logger.info('serial data length ' + str(len(data)))
-            sleep(0.005)
-            count += 1
-            if count > 150:
-                logger.error(
-                    ">>> ERROR: No reply - returning [len:"
-                    + str(len(data))
-                    + "/"
-                    + str(length + length_check)
-                    + "]"
-                )
-                return False
+        ser.reset_output_buffer()
+        ser.reset_input_buffer()
+        ser.write(command)
+        if frame_trace.enabled:
+            frame_trace.add(ser.port, "tx", command)
 
-        return data
+        return read_frame(ser, framing)
 
     except serial.SerialException as e:
         logger.error(e)
+        # close the port, it's reopened on the next request
+        serial_port_pool.discard(ser)
         return False
 
     except Exception:
@@ -701,10 +1210,11 @@ def read_serial_data(
     command: any,
     port: str,
     baud: int,
-    length_pos: int,
-    length_check: int,
+    length_pos: Union[int, None] = None,
+    length_check: Union[int, None] = None,
     length_fixed: Union[int, None] = None,
     length_size: str = "B",
+    framing: Union[Framing, None] = None,
 ) -> bytearray:
     """
     Read data from a serial port
@@ -716,12 +1226,19 @@ def read_serial_data(
     :param length_check: Length of the checksum
     :param length_fixed: Fixed length of the data, if not set it will be read from the data
     :param length_size: Size of the length byte, can be "B", "H", "I" or "L"
+    :param framing: Description of the frame, replaces `length_pos`, `length_check`, `length_fixed` and `length_size`
     :return: Data read from the serial port
     """
     try:
-        with serial.Serial(port, baudrate=baud, timeout=0.1) as ser:
+        with serial_port_pool.acquire(port, baud) as ser:
             return read_serialport_data(
-                ser, command, length_pos, length_check, length_fixed, length_size
+                ser,
+                command,
+                length_pos,
+                length_check,
+                length_fixed,
+                length_size,
+                framing,
             )
 
     except serial.SerialException as e:
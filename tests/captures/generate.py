@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Create the sample captures in this folder.
+
+The captures are synthetic: a simulated BMS answers the requests of the real driver, the traffic is
+recorded with `serialtrace.start_capture()` like on a live port. Run from the root of the repository:
+
+    python3 tests/captures/generate.py
+"""
+
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import conftest  # noqa: E402, F401
+import frames  # noqa: E402
+
+import serialtrace  # noqa: E402
+from utils import serial_port_pool  # noqa: E402
+
+CAPTURES = os.path.dirname(os.path.abspath(__file__))
+PORT = "/dev/ttyUSB0"
+
+
+class SimulatedSerial(serialtrace.ReplaySerial):
+    """
+    Answers each request with the reply of `answer()`
+    """
+
+    def __init__(self, answer, port, baudrate=9600, parity=None, timeout=0.1):
+        super().__init__(None, port, baudrate, timeout=timeout)
+        self.answer = answer
+
+    def write(self, data: bytes) -> int:
+        self.requests += 1
+        self.buffer += self.answer(bytes(data), self.requests)
+        return len(data)
+
+
+def lltjbd_answer(request: bytes, count: int) -> bytes:
+    register = request[2]
+    if register == 0x03:
+        # the current and the cell voltages change with every poll
+        return frames.lltjbd_frame(
+            register, frames.lltjbd_general(current=-1250 + (count % 7) * 10)
+        )
+    if register == 0x04:
+        return frames.lltjbd_frame(register, frames.lltjbd_cells(offset=count % 3))
+    if register == 0x05:
+        return frames.lltjbd_frame(register, b"JBD-SP04S034-L16S-150A")
+    if register in (0x28, 0x29):
+        return frames.lltjbd_frame(
+            register, struct.pack(">h", 15000 if register == 0x28 else -15000)
+        )
+    # factory mode, cycle capacity and function configuration
+    return frames.lltjbd_frame(register, b"\x27\x10" if request[1] == 0xA5 else b"")
+
+
+def jkbms_answer(request: bytes, count: int) -> bytes:
+    return frames.jkbms_frame(
+        frames.jkbms_status(current=1250 + (count % 7) * 10, offset=count % 3)
+    )
+
+
+def daly_answer(request: bytes, count: int) -> bytes:
+    command = request[2]
+    # the current changes with every poll
+    data = frames.daly_replies(current=-1250 + (count % 7) * 10).get(command)
+    return frames.daly_frame(command, data) if data is not None else b""
+
+
+def sinowealth_answer(request: bytes, count: int) -> bytes:
+    registers = frames.sinowealth_registers()
+    register, length = request[1], request[2]
+    if length == 4:
+        data = registers[register]
+    else:
+        # a batch of 16 bit registers, 2 bytes each
+        data = b"".join(
+            registers[register + offset][:2] for offset in range(length // 2)
+        )
+    return data + bytes([sum(data) & 0xFF])
+
+
+def sinowealth_batch_read(battery, cycle: int) -> None:
+    # the second half of the cycles reads the cells and temperatures in batches
+    battery.batch_read = cycle >= 10
+
+
+def capture(
+    name: str, answer, address, baud: int, cycles: int, before_cycle=None
+) -> None:
+    file_path = os.path.join(CAPTURES, name.lower() + ".jsonl")
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+    serial_port_pool.close_all()
+    serial_port_pool.port_factory = (
+        lambda port, baudrate=9600, parity=None, timeout=0.1: (
+            SimulatedSerial(answer, port, baudrate, parity, timeout)
+        )
+    )
+    writer = serialtrace.start_capture(file_path)
+
+    battery = serialtrace.find_bms_type(name, address).load()(
+        port=PORT, baud=baud, address=address
+    )
+    assert battery.test_connection(), f"{name}: test_connection() failed"
+    for cycle in range(cycles):
+        if before_cycle is not None:
+            before_cycle(battery, cycle)
+        assert battery.refresh_data(), f"{name}: refresh_data() failed"
+
+    writer.note(PORT, bms=name, address=address.hex() if address else None, baud=baud)
+    writer.file.close()
+    serial_port_pool.close_all()
+    print(f"{file_path}: {battery.voltage} V, {battery.current} A, {battery.soc} %")
+
+
+if __name__ == "__main__":
+    capture("LltJbd", lltjbd_answer, None, 9600, 20)
+    capture("Jkbms", jkbms_answer, None, 115200, 20)
+    capture("Daly", daly_answer, b"\x40", 9600, 20)
+    capture("Sinowealth", sinowealth_answer, None, 9600, 20, sinowealth_batch_read)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Tests and benchmarks of the driver. They run on any Linux box without BMS and without D-Bus:
+
+    pip3 install -r requirements.txt requests pytest pytest-benchmark
+    python3 -m pytest tests
+
+D-Bus, GLib and the Victron dbus services are replaced by the stubs in `stubs.py`, the batteries
+read the sample captures in `tests/captures` through the replay transport of `serialtrace.py`.
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DRIVER = os.path.join(ROOT, "etc", "dbus-serialbattery")
+CAPTURES = os.path.join(ROOT, "tests", "captures")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DRIVER)
+
+import stubs  # noqa: E402
+
+glib = stubs.install()
+
+import utils  # noqa: E402
+
+utils.logger.setLevel(logging.WARNING)
+# never upload anything from a test
+utils.TELEMETRY = False
+
+
+@pytest.fixture
+def stub_glib() -> stubs.StubGLib:
+    """
+    The GLib stub, the queued callbacks are dropped before each test
+    """
+    glib.pending.clear()
+    return glib
+
+
+@pytest.fixture
+def make_helper():
+    """
+    Create a `DbusHelper` with all dbus paths on a `StubVeDbusService`
+    """
+    from dbushelper import DbusHelper
+
+    def make(battery) -> DbusHelper:
+        helper = DbusHelper(battery)
+
+        # the instance is normally read from com.victronenergy.settings
+        def setup_instance():
+            helper.path_battery = "/Settings/Devices/serialbattery_" + helper.bms_id
+            helper.settings = stubs.StubSettingsDevice()
+            helper.settings["CustomName"] = battery.custom_name()
+            helper.settings["ClassAndVrmInstance"] = "battery:1"
+
+        helper.setup_instance = setup_instance
+        assert helper.setup_vedbus()
+        return helper
+
+    return make
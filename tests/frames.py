@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic frames of the BMS protocols with known values, used by the captures and the decode benchmarks
+"""
+
+import struct
+
+CELL_COUNT = 16
+
+VOLTAGE = 5320
+"""
+Pack voltage in 10 mV
+"""
+
+
+def cell_voltages(cell_count: int = CELL_COUNT, offset: int = 0) -> list:
+    """
+    :return: Cell voltages in mV
+    """
+    return [3300 + cell + offset for cell in range(cell_count)]
+
+
+def lltjbd_frame(register: int, payload: bytes) -> bytes:
+    body = bytes([0x00, len(payload)]) + payload
+    return (
+        bytes([0xDD, register])
+        + body
+        + ((0x10000 - sum(body)) % 0x10000).to_bytes(2, "big")
+        + b"\x77"
+    )
+
+
+def lltjbd_general(current: int = -1250, cell_count: int = CELL_COUNT) -> bytes:
+    """
+    Payload of the general info (register 0x03) with 2 temperature sensors
+    """
+    return struct.pack(
+        ">HhHHHHhHHBBBBB",
+        VOLTAGE,
+        current,
+        8000,
+        10000,
+        12,
+        0x2C4A,
+        0x0003,
+        0,
+        0,
+        0x10,
+        80,
+        3,
+        cell_count,
+        2,
+    ) + struct.pack(">HH", 2981, 2991)
+
+
+def lltjbd_cells(cell_count: int = CELL_COUNT, offset: int = 0) -> bytes:
+    """
+    Payload of the cell voltages (register 0x04)
+    """
+    return b"".join(
+        struct.pack(">H", voltage) for voltage in cell_voltages(cell_count, offset)
+    )
+
+
+def jkbms_status(
+    cell_count: int = CELL_COUNT, current: int = 1250, offset: int = 0
+) -> bytes:
+    """
+    Status data of the JK BMS RS485 protocol, the part of the frame returned by `read_serial_data_jkbms()`
+    """
+    from bms.jkbms import Jkbms
+
+    cellbyte_count = 3 * cell_count
+    status = bytearray(cellbyte_count + 225)
+    status[0] = 0x01
+    status[1] = 0x79
+    status[2] = cellbyte_count
+    for cell, voltage in enumerate(cell_voltages(cell_count, offset)):
+        struct.pack_into(">BH", status, 3 + 3 * cell, cell + 1, voltage)
+
+    values = {
+        "temp_mos": 28,
+        "temp1": 24,
+        "temp2": 25,
+        "voltage": VOLTAGE,
+        "current": 32768 + current,
+        "soc": 80,
+        "charge_cycles": 12,
+        "cell_count": cell_count,
+        "protection": 0,
+        "fet": 0x03,
+        "max_discharge_current": 150,
+        "max_charge_current": 100,
+        "balance": 1,
+        "capacity": 280,
+        "custom_field": b"Input Us",
+        "production": b"2306",
+        "version": b"11.XW_S11.26___",
+        "unique_identifier": b"JK_B2A20S20P_Sample_0001",
+    }
+    for name, idcode, position, value_format in Jkbms.STATUS_FIELDS:
+        struct.pack_into(
+            ">B" + value_format,
+            status,
+            cellbyte_count + position,
+            idcode,
+            values[name],
+        )
+    return bytes(status)
+
+
+def jkbms_frame(status: bytes) -> bytes:
+    """
+    Complete JK BMS RS485 frame with header, record number, end byte and checksum
+    """
+    frame = bytearray(
+        b"\x4e\x57\x00\x00\x00\x00\x00\x00\x06\x03"
+        + status
+        + b"\x00\x00\x00\x00\x68\x00\x00\x00\x00"
+    )
+    struct.pack_into(">H", frame, 2, len(frame) - 2)
+    struct.pack_into(">H", frame, len(frame) - 2, sum(frame[:-4]))
+    return bytes(frame)
+
+
+def eg4_ll_stats(cell_count: int = CELL_COUNT) -> bytes:
+    """
+    Reply to the statistics request of the EG4 LL
+    """
+    packet = bytearray(120)
+    packet[0:3] = b"\x01\x03\x72"
+    struct.pack_into(">Hh", packet, 3, VOLTAGE, -1250)
+    for cell, voltage in enumerate(cell_voltages(cell_count)):
+        struct.pack_into(">H", packet, 7 + 2 * cell, voltage)
+    struct.pack_into(">hHHHHH", packet, 39, 24, 25, 26, 80, 100, 100)
+    struct.pack_into(">H", packet, 51, 80)
+    struct.pack_into(">LLbb", packet, 61, 12, 100 * 3600 * 1000, 25, 28)
+    struct.pack_into(">H", packet, 75, cell_count)
+    return bytes(packet)
+
+
+def eg4_lifepower_status(cell_count: int = CELL_COUNT) -> bytes:
+    """
+    Reply to the general request of the EG4 LifePower, groups of {group number} {length} {length shorts}
+    """
+    groups = [
+        cell_voltages(cell_count),
+        [30000 - 1250],
+        [8000],
+        [10000],
+        [74, 75, 76, 75, 74, 73],
+        [0, 0],
+        [12],
+        [VOLTAGE],
+        [0],
+        [0],
+    ]
+    data = bytearray(b"\x7e\x01\x01\x00")
+    for number, values in enumerate(groups, 1):
+        data += bytes([number, len(values)])
+        data += b"".join(struct.pack(">H", value) for value in values)
+    return bytes(data + b"\x00\x0d")
+
+
+def seplos_status_hex(cell_count: int = CELL_COUNT) -> bytes:
+    """
+    Info part of the Seplos telemetry reply, as ASCII hex characters
+    """
+    data = bytearray(65)
+    data[0:2] = b"\x00\x01"
+    data[2] = cell_count
+    for cell, voltage in enumerate(cell_voltages(cell_count)):
+        struct.pack_into(">H", data, 3 + 2 * cell, voltage)
+    data[35] = 6
+    struct.pack_into(">6H", data, 36, 2981, 2991, 2985, 2983, 2971, 3001)
+    struct.pack_into(">hHHBHHH", data, 48, -1250, VOLTAGE, 8000, 10, 10000, 800, 0)
+    struct.pack_into(">H", data, 61, 12)
+    return data.hex().upper().encode()
+
+
+def daly_frame(command: int, data: bytes) -> bytes:
+    """
+    Daly reply sentences of 8 data bytes each, `data` is padded to whole sentences
+    """
+    frame = bytearray()
+    for start in range(0, max(len(data), 1), 8):
+        sentence = bytearray(b"\xa5\x01" + bytes([command, 8]))
+        sentence += data[start : start + 8].ljust(8, b"\x00")
+        frame += sentence + bytes([sum(sentence) & 0xFF])
+    return bytes(frame)
+
+
+def daly_replies(current: int = -1250, cell_count: int = CELL_COUNT) -> dict:
+    """
+    Data of the Daly replies to each command
+
+    :param current: Current in 10 mA
+    """
+    voltages = cell_voltages(cell_count)
+    # 3 cells per sentence, the unused cells of the last sentence are 0
+    padded = voltages + [0] * (-cell_count % 3)
+    cells = b"".join(
+        struct.pack(">B3Hx", frame + 1, *padded[frame * 3 : frame * 3 + 3])
+        for frame in range(len(padded) // 3)
+    )
+    return {
+        0x50: struct.pack(">LL", 280000, 3200),
+        0x53: struct.pack(">BBBBBxxx", 0, 0, 24, 7, 1),
+        0x57: b"".join(
+            bytes([number + 1])
+            + b"DALY-16S-280AH-BMS-1"[number * 7 : number * 7 + 7].ljust(7)
+            for number in range(5)
+        ),
+        0x90: struct.pack(">hhhh", VOLTAGE // 10, 0, 30000 - current // 10, 800),
+        0x91: struct.pack(">hbhbxx", max(voltages), cell_count, min(voltages), 1),
+        0x92: struct.pack(">bbbbxxxx", 68, 2, 64, 1),
+        0x93: struct.pack(">b??BL", 0, True, True, 12, 224000),
+        0x94: struct.pack(">bb??bhx", cell_count, 2, False, True, 0, 12),
+        0x95: cells,
+        0x97: struct.pack(">Q", 0),
+        0x98: bytes(8),
+    }
+
+
+def sinowealth_registers(cell_count: int = 10) -> dict:
+    """
+    Register values of a Sinowealth BMS, each as the 4 bytes of a single read. The 16 bit registers use the
+    first 2 bytes. The cell count is limited to 3 to 10 by the pack configuration register.
+    """
+    voltages = cell_voltages(cell_count)
+    registers = {
+        cell + 1: struct.pack(">Hxx", voltage) for cell, voltage in enumerate(voltages)
+    }
+    registers.update(
+        {
+            0x0B: struct.pack(">Hxx", sum(voltages)),
+            0x0C: struct.pack(">Hxx", 2981),
+            0x0D: struct.pack(">Hxx", 2991),
+            0x0E: struct.pack(">Hxx", 3011),
+            0x0F: struct.pack(">Hxx", 2731),
+            0x10: struct.pack(">i", -12500),
+            0x11: struct.pack(">i", 280000),
+            0x12: struct.pack(">i", 224000),
+            0x13: struct.pack(">BBxx", 0, 80),
+            0x14: struct.pack(">Hxx", 12),
+            0x15: struct.pack(">BBxx", 0, 0x03),
+            0x16: struct.pack(">BBxx", 0, 0),
+            0x17: struct.pack(">BBxx", 0, cell_count - 3),
+        }
+    )
+    return registers
+
+
+def jk02_cell_info(cell_count: int = CELL_COUNT, max_cell_count: int = 24) -> bytes:
+    """
+    Cell info frame (info type 0x02) of the JK BMS BLE protocol JK02, as sent by BMS with a
+    maximum of 24 or 32 cells
+    """
+    from bms.jkbms_brn import offset_32s
+
+    def offset(position: int) -> int:
+        return offset_32s(position) if max_cell_count == 32 else position
+
+    frame = bytearray(300)
+    frame[0:6] = b"\x55\xaa\xeb\x90\x02\x01"
+    voltages = cell_voltages(cell_count)
+    struct.pack_into(f"<{cell_count}H", frame, offset(6), *voltages)
+    struct.pack_into(
+        "<HH", frame, offset(58), sum(voltages) // cell_count, cell_count - 1
+    )
+    struct.pack_into("<BB", frame, offset(62), cell_count - 1, 0)
+    struct.pack_into(f"<{cell_count}H", frame, offset(64), *[60] * cell_count)
+    struct.pack_into("<H", frame, offset(118), VOLTAGE * 10)
+    struct.pack_into("<l", frame, offset(126), -12500)
+    struct.pack_into("<HH", frame, offset(130), 240, 250)
+    # the MOS temperature moved in the 32S frame
+    struct.pack_into("<H", frame, offset(112) if max_cell_count == 32 else 134, 280)
+    struct.pack_into("<B", frame, offset(141), 80)
+    struct.pack_into("<LLLL", frame, offset(142), 224000, 280000, 12, 3360000)
+    struct.pack_into("<??", frame, offset(166), True, True)
+    if max_cell_count == 32:
+        # marks the frame of a 32S BMS
+        frame[287] = 0x01
+    frame[299] = sum(frame[:299]) & 0xFF
+    return bytes(frame)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-ins for D-Bus, GLib and the Victron dbus services, so that the driver can be imported and
+benchmarked on a plain Linux box without D-Bus and without Venus OS.
+"""
+
+import sys
+import types
+from collections import deque
+from typing import Dict
+
+
+class StubVeDbusService:
+    """
+    Replaces `vedbus.VeDbusService`: keeps the values of the paths in a dict and counts the signals
+    the real service would send, instead of sending them
+    """
+
+    def __init__(self, servicename: str, bus=None, register: bool = True):
+        self.name = servicename
+        self.values: Dict[str, object] = {}
+        self.callbacks: Dict[str, object] = {}
+        self.registered = False
+        self.properties_changed = 0
+        """
+        Number of `PropertiesChanged` signals, one per changed path outside of a `ServiceContext`
+        """
+        self.items_changed = 0
+        """
+        Number of `ItemsChanged` signals, one per flushed `ServiceContext` with changes
+        """
+        self.items_changed_values = 0
+        """
+        Number of values sent in all `ItemsChanged` signals
+        """
+        self._contexts = []
+        if register:
+            self.register()
+
+    def register(self) -> None:
+        self.registered = True
+
+    def get_name(self) -> str:
+        return self.name
+
+    def add_path(
+        self,
+        path: str,
+        value,
+        description: str = "",
+        writeable: bool = False,
+        onchangecallback=None,
+        gettextcallback=None,
+        valuetype=None,
+        itemtype=None,
+    ) -> None:
+        self.values[path] = value
+        if onchangecallback is not None:
+            self.callbacks[path] = onchangecallback
+
+    def set_value(self, path: str, value) -> bool:
+        """
+        Set the value like `VeDbusItemExport._local_set_value()`
+
+        :return: True, if the value changed
+        """
+        if self.values[path] == value and type(self.values[path]) is type(value):
+            return False
+        self.values[path] = value
+        return True
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.values
+
+    def __getitem__(self, path: str):
+        return self.values[path]
+
+    def __setitem__(self, path: str, value) -> None:
+        if self.set_value(path, value):
+            self.properties_changed += 1
+
+    def __delitem__(self, path: str) -> None:
+        del self.values[path]
+
+    def __enter__(self) -> "StubServiceContext":
+        context = StubServiceContext(self)
+        self._contexts.append(context)
+        return context
+
+    def __exit__(self, *exc) -> None:
+        if self._contexts:
+            self._contexts.pop().flush()
+
+
+class StubServiceContext:
+    """
+    Replaces `vedbus.ServiceContext`: collects the changes and counts one `ItemsChanged` signal per flush
+    """
+
+    def __init__(self, parent: StubVeDbusService):
+        self.parent = parent
+        self.changes: Dict[str, object] = {}
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.parent
+
+    def __getitem__(self, path: str):
+        return self.parent[path]
+
+    def __setitem__(self, path: str, value) -> None:
+        if self.parent.set_value(path, value):
+            self.changes[path] = value
+
+    def __delitem__(self, path: str) -> None:
+        self.changes.pop(path, None)
+        del self.parent[path]
+
+    def add_path(self, path: str, value, *args, **kwargs) -> None:
+        self.parent.add_path(path, value, *args, **kwargs)
+        self.changes[path] = value
+
+    def flush(self) -> None:
+        if self.changes:
+            self.parent.items_changed += 1
+            self.parent.items_changed_values += len(self.changes)
+            self.changes.clear()
+
+    def get_name(self) -> str:
+        return self.parent.get_name()
+
+
+class StubSettingsDevice(dict):
+    """
+    Replaces `settingsdevice.SettingsDevice`: the settings are kept in the dict
+    """
+
+    def __init__(self, bus=None, supportedSettings=None, eventCallback=None, **kwargs):
+        super().__init__(
+            {name: values[1] for name, values in (supportedSettings or {}).items()}
+        )
+
+    def addSettings(self, settings: dict) -> None:
+        for name, values in settings.items():
+            self.setdefault(name, values[1])
+
+
+class StubGLib:
+    """
+    Replaces `gi.repository.GLib`: idle and timeout callbacks are queued and only run by `run_pending()`
+    """
+
+    def __init__(self):
+        self.pending = deque()
+        self._source_id = 0
+
+    def idle_add(self, function, *args) -> int:
+        self._source_id += 1
+        self.pending.append((function, args))
+        return self._source_id
+
+    def timeout_add(self, interval, function, *args) -> int:
+        return self.idle_add(function, *args)
+
+    def source_remove(self, source_id: int) -> bool:
+        return True
+
+    def run_pending(self) -> int:
+        """
+        Run the queued callbacks in the order they were added
+
+        :return: Number of callbacks that ran
+        """
+        count = 0
+        while self.pending:
+            function, args = self.pending.popleft()
+            function(*args)
+            count += 1
+        return count
+
+
+class StubBusItem:
+    """
+    Replaces the `com.victronenergy.BusItem` interface of a setting in `com.victronenergy.settings`,
+    every `SetValue` call returns `result` at once
+    """
+
+    def __init__(self, bus_object=None, interface: str = None):
+        self.path = getattr(bus_object, "path", None)
+        self.values = []
+        """
+        Values written with `SetValue`
+        """
+        self.result = 0
+        """
+        Result of `SetValue`, the settings daemon returns a non zero value, if it rejects the value
+        """
+
+    def get_dbus_method(self, name: str):
+        return getattr(self, name)
+
+    def SetValue(self, value, reply_handler=None, error_handler=None, timeout=None):
+        self.values.append(value)
+        if reply_handler is not None:
+            reply_handler(self.result)
+            return None
+        return self.result
+
+
+class StubBusObject:
+    def __init__(self, service: str, path: str):
+        self.service = service
+        self.path = path
+
+
+class StubBusConnection:
+    TYPE_SYSTEM = 1
+    TYPE_SESSION = 2
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def get_object(self, service: str, path: str, introspect: bool = True):
+        return StubBusObject(service, path)
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install() -> StubGLib:
+    """
+    Register the stub modules, has to be called before the first driver module is imported
+
+    :return: The GLib stub, to run the queued callbacks
+    """
+    glib = StubGLib()
+
+    class DBusException(Exception):
+        pass
+
+    dbus = _module(
+        "dbus",
+        Array=lambda *args, **kwargs: [],
+        Signature=lambda *args, **kwargs: None,
+        Dictionary=dict,
+        Interface=StubBusItem,
+        SystemBus=StubBusConnection,
+        SessionBus=StubBusConnection,
+    )
+    dbus.bus = _module("dbus.bus", BusConnection=StubBusConnection)
+    dbus.exceptions = _module("dbus.exceptions", DBusException=DBusException)
+    dbus.mainloop = _module("dbus.mainloop")
+    dbus.mainloop.glib = _module(
+        "dbus.mainloop.glib", DBusGMainLoop=lambda *args, **kwargs: None
+    )
+    gi = _module("gi")
+    gi.repository = _module("gi.repository", GLib=glib)
+    _module("vedbus", VeDbusService=StubVeDbusService)
+    _module("settingsdevice", SettingsDevice=StubSettingsDevice)
+    _module("ve_utils", get_vrm_portal_id=lambda: "000000000000")
+
+    return glib
+
+
+class StubMainLoop:
+    """
+    Replaces the GLib main loop passed to the publish functions, which quit it on fatal errors
+    """
+
+    def __init__(self):
+        self.quit_called = False
+
+    def quit(self) -> None:
+        self.quit_called = True
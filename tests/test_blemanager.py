@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Error classification of the shared BLE manager
+"""
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from bleak.exc import BleakDBusError, BleakError  # noqa: E402
+
+from blemanager import BleManager, is_adapter_error  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        BleakDBusError("org.bluez.Error.Failed", ["le-connection-abort-by-local"]),
+        BleakDBusError("org.bluez.Error.Failed", ["Software caused connection abort"]),
+        BleakDBusError("org.bluez.Error.InProgress", ["In Progress"]),
+        BleakDBusError("org.bluez.Error.NotConnected", ["Not Connected"]),
+        BleakDBusError("org.freedesktop.DBus.Error.UnknownObject", []),
+        BleakError("Device with address C8:47:8C:00:00:01 was not found."),
+        TimeoutError(),
+    ],
+)
+def test_device_error(error):
+    assert not is_adapter_error(error)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        BleakDBusError("org.bluez.Error.NotReady", ["Resource Not Ready"]),
+        BleakDBusError("org.bluez.Error.Failed", ["Operation already in progress"]),
+        BleakError("No Bluetooth adapters found."),
+    ],
+)
+def test_adapter_error(error):
+    assert is_adapter_error(error)
+
+
+def test_waiting_for_slot():
+    # not started, the state is changed without event loop
+    manager = BleManager(max_connections=1)
+    address = "C8:47:8C:00:00:01"
+
+    assert not manager.waiting_for_slot(address)
+    manager.hand_over_slot(address.lower())
+    assert manager.waiting_for_slot(address)
+
+    # a failed reconnect ends the waiting, the device is treated as failing again
+    manager.report_error(address)
+    assert not manager.waiting_for_slot(address)
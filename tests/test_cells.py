@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the cell statistics for 4S to 32S packs and of the cell storage
+"""
+
+import tracemalloc
+
+import pytest
+
+from battery import Battery, Cell, CellStats, CellStore
+
+pytest.importorskip("pytest_benchmark")
+
+CELL_COUNTS = [4, 8, 16, 24, 32]
+
+GETTER_CALLS = 10
+"""
+Calls of each cell getter per cycle, the charge control and the publishing call them many times per cycle
+"""
+
+
+class SampleBattery(Battery):
+    def test_connection(self) -> bool:
+        return True
+
+    def get_settings(self) -> bool:
+        return True
+
+    def refresh_data(self) -> bool:
+        return True
+
+
+def make_battery(cell_count: int) -> SampleBattery:
+    battery = SampleBattery("/dev/null", 9600, None)
+    battery.cell_count = cell_count
+    for _ in range(cell_count):
+        battery.cells.append(Cell(False))
+    return battery
+
+
+def voltages(cell_count: int, cycle: int) -> list:
+    return [3300 + (cell * 7 + cycle) % 40 for cell in range(cell_count)]
+
+
+def call_getters(battery: Battery) -> None:
+    for _ in range(GETTER_CALLS):
+        battery.get_min_cell()
+        battery.get_max_cell()
+        battery.get_min_cell_voltage()
+        battery.get_max_cell_voltage()
+        battery.get_cell_voltage_sum()
+        battery.get_midvoltage()
+        battery.get_balancing()
+
+
+@pytest.mark.parametrize("cell_count", CELL_COUNTS)
+def test_cell_stats_cycle(benchmark, cell_count):
+    """
+    One poll cycle: new cell voltages, then all getters. The statistics are calculated once.
+    """
+    battery = make_battery(cell_count)
+    cycle = iter(range(10**9))
+
+    def run_cycle():
+        battery.cells.set_voltages(voltages(cell_count, next(cycle)), 1000)
+        call_getters(battery)
+
+    benchmark(run_cycle)
+
+
+@pytest.mark.parametrize("cell_count", CELL_COUNTS)
+def test_cell_stats_uncached(benchmark, cell_count):
+    """
+    The same cycle, if every getter scanned the cells again, for comparison
+    """
+    battery = make_battery(cell_count)
+    battery.cells.set_voltages(voltages(cell_count, 0), 1000)
+
+    def run_cycle():
+        for _ in range(GETTER_CALLS * 7):
+            CellStats(battery.cells, cell_count)
+
+    benchmark(run_cycle)
+
+
+def test_cell_stats_follow_the_voltages():
+    battery = make_battery(4)
+
+    battery.cells.set_voltages([3300, 3310, 3290, 3305], 1000)
+    assert battery.get_min_cell() == 2
+    assert battery.get_max_cell() == 1
+    assert battery.get_cell_voltage_sum() == pytest.approx(13.205)
+
+    # changing a single cell invalidates the cached statistics
+    battery.cells[0].voltage = 3.2
+    assert battery.get_min_cell() == 0
+    assert battery.get_min_cell_voltage() == 3.2
+    assert battery.get_cell_voltage_sum() == pytest.approx(13.105)
+
+    battery.cells[3].balance = True
+    assert battery.get_balancing() == 1
+
+
+class LegacyCell:
+    """
+    Cell with its own `__dict__` as before the `CellStore`, for comparison
+    """
+
+    def __init__(self, balance: bool = None):
+        self.voltage = None
+        self.balance = balance
+        self.temp = None
+
+
+def allocated(function) -> int:
+    """
+    :return: Bytes still allocated by the object `function` returns
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = function()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+@pytest.mark.parametrize("cell_count", [16, 32])
+@pytest.mark.parametrize("layout", ["CellStore bulk", "CellStore per cell", "legacy"])
+def test_cell_update(benchmark, cell_count, layout):
+    """
+    Cost to update the voltages of all cells from a decoded frame
+    """
+    values = voltages(cell_count, 0)
+    if layout == "legacy":
+        cells = [LegacyCell(False) for _ in range(cell_count)]
+        memory = allocated(lambda: [LegacyCell(False) for _ in range(cell_count)])
+    else:
+        cells = CellStore(Cell(False) for _ in range(cell_count))
+        memory = allocated(lambda: CellStore(Cell(False) for _ in range(cell_count)))
+    benchmark.extra_info["memory"] = memory
+
+    def update_bulk():
+        cells.set_voltages(values, 1000)
+
+    def update_per_cell():
+        for c in range(cell_count):
+            cells[c].voltage = values[c] / 1000
+
+    benchmark(update_bulk if layout == "CellStore bulk" else update_per_cell)
+    assert [cell.voltage for cell in cells] == [value / 1000 for value in values]
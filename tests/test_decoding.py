@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Decode benchmarks of the serial drivers with synthetic frames, without the serial transport
+"""
+
+import pytest
+
+import frames
+from battery import Cell
+
+pytest.importorskip("pytest_benchmark")
+
+from decoding import FrameLayout, unpack_array  # noqa: E402
+
+
+def expected_voltages(cell_count: int = frames.CELL_COUNT) -> list:
+    return [voltage / 1000 for voltage in frames.cell_voltages(cell_count)]
+
+
+def cell_list(battery) -> list:
+    return [round(cell.voltage, 3) for cell in battery.cells]
+
+
+@pytest.mark.parametrize("cell_count", [16, 32])
+def test_unpack_array(benchmark, cell_count):
+    data = frames.lltjbd_cells(cell_count)
+
+    values = benchmark(unpack_array, data, cell_count)
+
+    assert list(values) == frames.cell_voltages(cell_count)
+
+
+def test_frame_layout(benchmark):
+    layout = FrameLayout((("voltage", 0, "H"), ("current", 2, "h"), ("soc", 19, "B")))
+    data = frames.lltjbd_general()
+
+    values = benchmark(layout.unpack, data)
+
+    assert values == {"voltage": frames.VOLTAGE, "current": -1250, "soc": 80}
+
+
+@pytest.mark.parametrize("cell_count", [16, 32])
+def test_jkbms(benchmark, cell_count):
+    from bms.jkbms import Jkbms
+
+    battery = Jkbms("/dev/null", 115200, None)
+    status = frames.jkbms_status(cell_count)
+    battery.read_serial_data_jkbms = lambda command: status
+    battery.cells = [Cell(False) for _ in range(cell_count)]
+
+    assert benchmark(battery.read_status_data)
+    assert battery.voltage == frames.VOLTAGE / 100
+    assert battery.current == 12.5
+    assert cell_list(battery) == expected_voltages(cell_count)
+
+
+def test_lltjbd(benchmark):
+    from bms.lltjbd import LltJbd
+
+    battery = LltJbd("/dev/null", 9600, None)
+    replies = {
+        LltJbd.command_general: frames.lltjbd_general(),
+        LltJbd.command_cell: frames.lltjbd_cells(),
+    }
+    battery.read_serial_data_llt = lambda command: replies[command]
+    battery.cells = [Cell(False) for _ in range(frames.CELL_COUNT)]
+
+    def decode():
+        return battery.read_gen_data() and battery.read_cell_data()
+
+    assert benchmark(decode)
+    assert battery.voltage == frames.VOLTAGE / 100
+    assert battery.current == -12.5
+    assert cell_list(battery) == expected_voltages()
+
+
+def test_eg4_ll(benchmark):
+    from bms.eg4_ll import EG4_LL
+
+    battery = EG4_LL("/dev/null", 9600, b"\x01")
+    packet = frames.eg4_ll_stats()
+    battery.read_serial_data_eg4_ll = lambda command: packet
+    battery.serial_number = "sample"
+
+    assert benchmark(battery.read_cell_data)
+    assert battery.voltage == frames.VOLTAGE / 100
+    assert battery.current == -12.5
+    assert cell_list(battery) == expected_voltages()
+
+
+def test_eg4_lifepower(benchmark):
+    from bms.eg4_lifepower import EG4_Lifepower
+
+    battery = EG4_Lifepower("/dev/null", 9600, b"\x01")
+    status = frames.eg4_lifepower_status()
+    battery.read_serial_data_eg4 = lambda command: status
+
+    assert benchmark(battery.read_status_data)
+    assert battery.voltage == frames.VOLTAGE / 100
+    assert battery.current == 12.5
+    assert cell_list(battery) == expected_voltages()
+
+
+def test_seplos(benchmark):
+    from bms.seplos import Seplos
+
+    battery = Seplos("/dev/null", 9600, 0)
+    hex_data = frames.seplos_status_hex()
+    battery.cells = [Cell(False) for _ in range(frames.CELL_COUNT)]
+
+    assert benchmark(battery.decode_status_data, hex_data)
+    assert battery.voltage == frames.VOLTAGE / 100
+    assert battery.current == -12.5
+    assert cell_list(battery) == expected_voltages()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Frame assembly and decode benchmarks of the JK BMS BLE driver with synthetic JK02 frames
+"""
+
+import pytest
+
+import frames
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("bleak")
+
+from bms import jkbms_brn  # noqa: E402
+
+NOTIFICATION_SIZE = 20
+"""
+Size of the BLE notifications the frames are split into
+"""
+
+
+class StubBleManager:
+    def register(self, address: str) -> None:
+        pass
+
+
+@pytest.fixture
+def jk(monkeypatch) -> jkbms_brn.Jkbms_Brn:
+    # the real manager would start its thread and look for the Bluetooth adapter
+    monkeypatch.setattr(jkbms_brn, "get_ble_manager", StubBleManager)
+    return jkbms_brn.Jkbms_Brn("C8:47:8C:00:00:01")
+
+
+def check_cell_info(jk: jkbms_brn.Jkbms_Brn, cell_count: int, max_cell_count: int):
+    cell_info = jk.bms_status["cell_info"]
+    assert jk.bms_max_cell_count == max_cell_count
+    assert len(cell_info["voltages"]) == max_cell_count
+    assert [round(voltage * 1000) for voltage in cell_info["voltages"]] == (
+        frames.cell_voltages(cell_count) + [0] * (max_cell_count - cell_count)
+    )
+    assert cell_info["total_voltage"] == pytest.approx(frames.VOLTAGE / 100)
+    assert cell_info["current"] == pytest.approx(-12.5)
+    assert cell_info["power"] == pytest.approx(-12.5 * frames.VOLTAGE / 100)
+    assert cell_info["temperature_sensor_1"] == pytest.approx(24)
+    assert cell_info["temperature_mos"] == pytest.approx(28)
+    assert cell_info["battery_soc"] == 80
+    assert cell_info["capacity_nominal"] == pytest.approx(280)
+    assert cell_info["cycle_count"] == 12
+    assert cell_info["charging_switch_enabled"] is True
+
+
+@pytest.mark.parametrize("cell_count,max_cell_count", [(16, 24), (32, 32)])
+def test_decode(benchmark, jk, cell_count, max_cell_count):
+    frame = memoryview(frames.jk02_cell_info(cell_count, max_cell_count))
+
+    benchmark(jk.decode, frame)
+
+    check_cell_info(jk, cell_count, max_cell_count)
+
+
+@pytest.mark.parametrize("cell_count,max_cell_count", [(16, 24), (32, 32)])
+def test_assemble_frame(benchmark, jk, cell_count, max_cell_count):
+    frame = frames.jk02_cell_info(cell_count, max_cell_count)
+    notifications = [
+        bytearray(frame[start : start + NOTIFICATION_SIZE])
+        for start in range(0, len(frame), NOTIFICATION_SIZE)
+    ]
+    decoded = []
+    jk.set_callback(lambda: decoded.append(jk.bms_status["cell_info"]["current"]))
+
+    def receive():
+        for notification in notifications:
+            jk.assemble_frame(notification)
+
+    benchmark(receive)
+
+    assert decoded and jk.frame_length == 0
+    check_cell_info(jk, cell_count, max_cell_count)
+
+
+def test_assemble_frame_checksum(jk):
+    frame = bytearray(frames.jk02_cell_info())
+    frame[299] ^= 0xFF
+    # garbage in front of the frame is skipped
+    jk.assemble_frame(bytearray(b"\x00\x01") + frame[:NOTIFICATION_SIZE])
+    jk.assemble_frame(frame[NOTIFICATION_SIZE:])
+
+    assert "cell_info" not in jk.bms_status
+    assert jk.frame_length == 0
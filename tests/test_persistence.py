@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind of the settings with `SettingsWriter` against stub settings
+"""
+
+import pytest
+
+from persistence import SettingsWriter
+from stubs import StubBusConnection
+
+PATH = "/Settings/Devices/serialbattery_Sample"
+
+
+@pytest.fixture
+def errors() -> list:
+    return []
+
+
+@pytest.fixture
+def writer(errors) -> SettingsWriter:
+    return SettingsWriter(
+        StubBusConnection(),
+        "com.victronenergy.settings",
+        PATH,
+        1000,
+        values={"SocCalc": 80},
+        error_callback=lambda name, error: errors.append(name),
+    )
+
+
+def test_coalesce(writer):
+    # already stored
+    writer.set("SocCalc", 80)
+    assert not writer.pending
+
+    for soc in (81, 82, 83):
+        writer.set("SocCalc", soc)
+    writer.flush()
+
+    assert writer._get_proxy("SocCalc").values == [83]
+    assert writer.written["SocCalc"] == 83
+    assert writer.stats == {"queued": 1, "coalesced": 2, "written": 1, "failed": 0}
+    assert not writer.in_flight
+
+
+@pytest.mark.parametrize("blocking", [False, True], ids=["async", "blocking"])
+def test_rejected(writer, errors, blocking):
+    proxy = writer._get_proxy("SocCalc")
+    proxy.result = 1
+
+    writer.set("SocCalc", 85)
+    writer.flush(blocking)
+
+    assert writer.written["SocCalc"] == 80
+    assert writer.stats["failed"] == 1
+    assert errors == ["SocCalc"]
+    # written again on the next flush
+    assert writer.pending == {"SocCalc": 85}
+
+    proxy.result = 0
+    writer.flush(blocking)
+
+    assert proxy.values == [85, 85]
+    assert writer.written["SocCalc"] == 85
+    assert not writer.pending
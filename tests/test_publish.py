@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+D-Bus messages and time per publish cycle, with one `ItemsChanged` signal per cycle or one `PropertiesChanged`
+signal per changed path, see `PUBLISH_ITEMS_CHANGED`
+"""
+
+import os
+
+import pytest
+
+import utils
+from conftest import CAPTURES
+from stubs import StubMainLoop
+
+pytest.importorskip("pytest_benchmark")
+
+import serialtrace  # noqa: E402
+
+CYCLES = 100
+
+
+@pytest.fixture
+def helper(make_helper):
+    trace = serialtrace.Trace(os.path.join(CAPTURES, "lltjbd.jsonl"))
+    serialtrace.start_replay(trace)
+    battery = serialtrace.find_bms_type("LltJbd", None).load()(
+        port=trace.port, baud=9600, address=None
+    )
+    assert battery.test_connection()
+    return make_helper(battery)
+
+
+@pytest.mark.parametrize(
+    "items_changed", [True, False], ids=["ItemsChanged", "PropertiesChanged"]
+)
+def test_publish_messages(benchmark, monkeypatch, helper, items_changed):
+    monkeypatch.setattr(utils, "PUBLISH_ITEMS_CHANGED", items_changed)
+    service = helper._dbusservice
+    loop = StubMainLoop()
+
+    # the values of the capture change with every poll
+    for _ in range(CYCLES):
+        helper.publish_battery(loop)
+    messages = service.items_changed + service.properties_changed
+    values = service.items_changed_values + service.properties_changed
+
+    benchmark.extra_info["messages_per_cycle"] = messages / CYCLES
+    benchmark.extra_info["values_per_cycle"] = values / CYCLES
+    benchmark(helper.publish_battery, loop)
+
+    assert not loop.quit_called
+    if items_changed:
+        assert service.properties_changed == 0
+        assert messages <= CYCLES
+    else:
+        assert service.items_changed == 0
+        assert messages > CYCLES
+
+
+@pytest.mark.parametrize("quit_on_failure", [True, False])
+def test_failed_battery(monkeypatch, helper, quit_on_failure):
+    monkeypatch.setattr(utils, "BLOCK_ON_DISCONNECT", True)
+    helper.quit_on_failure = quit_on_failure
+    loop = StubMainLoop()
+
+    helper.publish_refresh_result(loop, False)
+    # no answer for more than 60 s
+    helper.error["timestamp_first"] -= 61
+    helper.publish_refresh_result(loop, False)
+
+    assert not helper.battery.online
+    assert loop.quit_called == quit_on_failure
+    assert helper.battery.block_because_disconnect
+
+    helper.publish_battery(loop)
+
+    assert helper.battery.online
+    assert not helper.battery.block_because_disconnect
+
+
+def test_path_changed_from_outside(helper):
+    service = helper._dbusservice
+    loop = StubMainLoop()
+    helper.publish_battery(loop)
+    voltage = service["/Dc/0/Voltage"]
+
+    # e.g. written by another process, the driver has to restore its own value
+    service["/Dc/0/Voltage"] = 0
+    helper.publish_battery(loop)
+
+    assert service["/Dc/0/Voltage"] == voltage
+
+
+def test_current_deadband(helper):
+    service = helper._dbusservice
+    helper.battery.current = -12.5
+    helper.publish_dbus()
+    assert service["/Dc/0/Current"] == -12.5
+
+    # noise of a few 10 mA is not published, the current is compared with the published value
+    for current in (-12.52, -12.47, -12.54):
+        helper.battery.current = current
+        helper.publish_dbus()
+        assert service["/Dc/0/Current"] == -12.5
+
+    helper.battery.current = -12.56
+    helper.publish_dbus()
+    assert service["/Dc/0/Current"] == -12.56
+
+
+def test_publish_stats(monkeypatch, helper):
+    monkeypatch.setattr(utils, "PUBLISH_ITEMS_CHANGED", False)
+    service = helper._dbusservice
+    stats = helper.publish_stats
+
+    def publish() -> tuple:
+        published, suppressed = stats["published"], stats["suppressed"]
+        signals = service.properties_changed
+        helper.publish_dbus()
+        # every published path changed and sent exactly one signal
+        assert service.properties_changed - signals == stats["published"] - published
+        return stats["published"] - published, stats["suppressed"] - suppressed
+
+    published, _ = publish()
+    assert published > 0
+
+    # nothing changed, the unchanged cell and history groups are skipped without counting their paths
+    published, suppressed_unchanged = publish()
+    assert published == 0
+    assert 0 < suppressed_unchanged < len(service.values) - len(helper.battery.cells)
+
+    # /Dc/0/Voltage and /Dc/0/Power
+    helper.battery.voltage += 0.1
+    assert publish() == (2, suppressed_unchanged - 2)
+
+    # the changed cell, the new lowest cell and its voltage, the sum and the difference of the cells,
+    # all other cells are compared and suppressed
+    helper.battery.cells[0].voltage += 0.01
+    published, suppressed = publish()
+    assert published == 5
+    assert suppressed >= suppressed_unchanged + len(helper.battery.cells) - 1
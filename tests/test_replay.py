@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the serial drivers against the sample captures in `tests/captures`, replayed with `serialtrace.py`.
+
+Each benchmark also records the temporary allocations per cycle and the memory retained after all cycles
+in `extra_info`, see `serialtrace.measure()`. The drivers based on `minimalmodbus`, CAN and Bluetooth open
+their connections themselves and can't be replayed yet.
+"""
+
+import glob
+import os
+
+import pytest
+
+from conftest import CAPTURES
+
+pytest.importorskip("pytest_benchmark")
+
+import serialtrace  # noqa: E402
+from stubs import StubMainLoop  # noqa: E402
+
+CAPTURE_FILES = sorted(glob.glob(os.path.join(CAPTURES, "*.jsonl")))
+
+ALLOCATION_CYCLES = 200
+
+PACKS = {"Sinowealth": (10, 33.045)}
+"""
+Cell count and voltage of the captures of BMS that do not support 16 cells, all others have 16 cells at 53.2 V
+"""
+
+
+@pytest.fixture(params=CAPTURE_FILES, ids=os.path.basename)
+def trace(request) -> serialtrace.Trace:
+    trace = serialtrace.Trace(request.param)
+    serialtrace.start_replay(trace)
+    return trace
+
+
+def load_battery(trace: serialtrace.Trace):
+    address = trace.info.get("address")
+    bms_type = serialtrace.find_bms_type(
+        trace.info["bms"], bytes.fromhex(address) if address else None
+    )
+    return bms_type.load()(
+        port=trace.port,
+        baud=trace.info.get("baud") or bms_type.baud,
+        address=bms_type.address,
+    )
+
+
+def connected_battery(trace: serialtrace.Trace):
+    battery = load_battery(trace)
+    # like the driver, test_connection() also reads the settings
+    assert battery.test_connection()
+    return battery
+
+
+def record_allocations(benchmark, function) -> None:
+    _, peak, retained = serialtrace.measure(function, ALLOCATION_CYCLES)
+    benchmark.extra_info["allocated_per_cycle"] = round(peak)
+    benchmark.extra_info["retained"] = retained
+
+
+def test_test_connection(benchmark, trace):
+    result = benchmark.pedantic(
+        lambda battery: battery.test_connection(),
+        setup=lambda: ((load_battery(trace),), {}),
+        rounds=100,
+    )
+    assert result
+
+
+def test_refresh_data(benchmark, trace):
+    battery = connected_battery(trace)
+
+    assert benchmark(battery.refresh_data)
+    cell_count, voltage = PACKS.get(trace.info["bms"], (16, 53.2))
+    assert battery.voltage == voltage
+    assert len(battery.cells) == cell_count
+    assert battery.get_min_cell_voltage() >= 3.3
+
+    record_allocations(benchmark, battery.refresh_data)
+
+
+def test_publish_battery(benchmark, trace, make_helper):
+    battery = connected_battery(trace)
+    helper = make_helper(battery)
+    loop = StubMainLoop()
+
+    def publish():
+        return helper.publish_battery(loop)
+
+    assert benchmark(publish)
+    assert not loop.quit_called
+    cell_count, voltage = PACKS.get(trace.info["bms"], (16, 53.2))
+    assert helper._dbusservice["/Dc/0/Voltage"] == round(voltage, 2)
+    assert helper._dbusservice["/System/NrOfCellsPerBattery"] == cell_count
+
+    record_allocations(benchmark, publish)
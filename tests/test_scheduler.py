@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Simulation of the `BusScheduler` with scripted poll durations and a simulated clock
+"""
+
+import itertools
+from typing import Dict, List
+
+import pytest
+
+import scheduler
+from battery import ReadTier
+from scheduler import BusScheduler
+from stubs import StubMainLoop
+
+
+class SimulatedClock:
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ScriptedBattery:
+    """
+    Battery whose polls take the scripted durations, counts how often each read tier was read
+    """
+
+    def __init__(self, clock: SimulatedClock, latencies: List[float]):
+        self.clock = clock
+        self.latencies = iter(latencies)
+        self.tiers_due = ReadTier.ALL
+        self.tiers_read = None
+        self.reads: Dict[str, int] = {tier: 0 for tier in ReadTier.ALL}
+        self.due: List[tuple] = []
+        """
+        Due tiers of each poll
+        """
+        self.result = True
+        self.failing_tiers = None
+        """
+        Tiers that fail, reported in `tiers_read` like `Battery.run_read_schedule()` does
+        """
+
+    def refresh_data(self) -> bool:
+        self.clock.now += next(self.latencies)
+        self.due.append(self.tiers_due)
+        if self.failing_tiers is not None:
+            self.tiers_read = tuple(
+                tier for tier in self.tiers_due if tier not in self.failing_tiers
+            )
+            for tier in self.tiers_read:
+                self.reads[tier] += 1
+            return self.tiers_read == self.tiers_due
+        if self.result:
+            for tier in self.tiers_due:
+                self.reads[tier] += 1
+        return self.result
+
+
+class ScriptedHelper:
+    def __init__(self, battery: ScriptedBattery):
+        self.battery = battery
+
+    def publish_battery(self, loop) -> bool:
+        return self.battery.refresh_data()
+
+
+@pytest.fixture
+def clock(monkeypatch) -> SimulatedClock:
+    clock = SimulatedClock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    return clock
+
+
+def make_scheduler(batteries: Dict, poll_interval: int = 1000) -> BusScheduler:
+    bus_scheduler = BusScheduler(
+        batteries,
+        {key: ScriptedHelper(battery) for key, battery in batteries.items()},
+        poll_interval,
+        None,
+        10000,
+    )
+    bus_scheduler.tier_intervals = {ReadTier.MEDIUM: 10, ReadTier.SLOW: 60}
+    return bus_scheduler
+
+
+def run(bus_scheduler: BusScheduler, clock: SimulatedClock, polls: int) -> List[int]:
+    """
+    Call the scheduler every poll interval like the GLib timeout, until the first address was polled `polls` times
+
+    :return: Poll interval of the first address after each of its polls
+    """
+    stats = next(iter(bus_scheduler.stats.values()))
+    intervals = []
+    tick = clock.now
+    loop = StubMainLoop()
+    while stats.polls < polls:
+        clock.now = max(clock.now, tick)
+        polls_before = stats.polls
+        bus_scheduler.run_cycle(loop)
+        if stats.polls > polls_before:
+            intervals.append(stats.interval)
+        tick += bus_scheduler.poll_interval / 1000
+    assert not loop.quit_called
+    return intervals
+
+
+def run_lengths(intervals: List[int]) -> List[tuple]:
+    return [
+        (interval, len(list(group))) for interval, group in itertools.groupby(intervals)
+    ]
+
+
+def test_single_slow_poll_does_not_change_the_interval(clock):
+    battery = ScriptedBattery(clock, [0.15] * 30 + [3.0] + [0.15] * 30)
+    bus_scheduler = make_scheduler({0: battery})
+
+    assert run(bus_scheduler, clock, 61) == [1000] * 61
+
+
+def test_interval_follows_the_percentile_up_and_steps_down(clock):
+    latencies = [0.15] * 30 + [2.0] * 40 + [0.15] * 100
+    battery = ScriptedBattery(clock, latencies)
+    bus_scheduler = make_scheduler({0: battery})
+
+    steps = run_lengths(run(bus_scheduler, clock, len(latencies)))
+
+    # P90 of 2 s with a utilization of 80 % needs 2.5 s
+    assert steps[0][0] == 1000
+    assert steps[1][0] == 2500
+    # lowered by STEP_DOWN_FACTOR after every STEP_DOWN_POLLS fast polls, never below poll_interval
+    assert steps[2:] == [
+        (2000, BusScheduler.STEP_DOWN_POLLS),
+        (1600, BusScheduler.STEP_DOWN_POLLS),
+        (1200, BusScheduler.STEP_DOWN_POLLS),
+        (1000, steps[-1][1]),
+    ]
+    # raised after a few slow polls, lowered only after the slow polls left the percentile window
+    assert steps[0][1] <= 30 + 3
+    assert steps[1][1] >= 40 - 3 + BusScheduler.STEP_DOWN_POLLS
+
+
+def test_interval_is_limited_to_the_maximum(clock):
+    battery = ScriptedBattery(clock, [0.15] * 10 + [20.0] * 20)
+    bus_scheduler = make_scheduler({0: battery})
+
+    assert max(run(bus_scheduler, clock, 30)) == bus_scheduler.poll_interval_max
+
+
+def test_read_tiers_are_polled_at_their_rates(clock):
+    battery = ScriptedBattery(clock, [0.1] * 121)
+    bus_scheduler = make_scheduler({0: battery})
+
+    run(bus_scheduler, clock, 121)
+
+    # 120 seconds with one poll per second
+    assert battery.reads == {
+        ReadTier.FAST: 121,
+        ReadTier.MEDIUM: 13,
+        ReadTier.SLOW: 3,
+    }
+
+
+def test_read_tiers_are_read_again_after_a_failed_poll(clock):
+    battery = ScriptedBattery(clock, [0.1] * 3)
+    bus_scheduler = make_scheduler({0: battery})
+
+    battery.result = False
+    run(bus_scheduler, clock, 1)
+    battery.result = True
+    run(bus_scheduler, clock, 3)
+
+    # the first poll failed, the second poll reads all tiers again
+    assert battery.reads == {ReadTier.FAST: 2, ReadTier.MEDIUM: 1, ReadTier.SLOW: 1}
+
+
+def test_failed_read_tier_waits_for_its_interval(clock):
+    battery = ScriptedBattery(clock, [0.1] * 121)
+    bus_scheduler = make_scheduler({0: battery})
+
+    # e.g. a BMS that reports a capacity of 0, the other tiers are read
+    battery.failing_tiers = (ReadTier.SLOW,)
+    run(bus_scheduler, clock, 121)
+
+    # retried in the next polls, then once per interval
+    retries = BusScheduler.TIER_MAX_RETRIES
+    polls_slow_due = [
+        poll for poll, due in enumerate(battery.due) if ReadTier.SLOW in due
+    ]
+    assert polls_slow_due == list(range(retries)) + [retries - 1 + 60]
+    assert battery.reads == {ReadTier.FAST: 121, ReadTier.MEDIUM: 13, ReadTier.SLOW: 0}
+    assert bus_scheduler.stats[0].tier_failures == {ReadTier.SLOW: retries + 1}
+
+
+def test_failed_read_tier_is_read_again(clock):
+    battery = ScriptedBattery(clock, [0.1] * 3)
+    bus_scheduler = make_scheduler({0: battery})
+
+    battery.failing_tiers = (ReadTier.MEDIUM,)
+    run(bus_scheduler, clock, 1)
+    battery.failing_tiers = ()
+    run(bus_scheduler, clock, 3)
+
+    # only the failed tier is read again, the slow tier was read in the first poll
+    assert battery.due == [
+        ReadTier.ALL,
+        (ReadTier.FAST, ReadTier.MEDIUM),
+        (ReadTier.FAST,),
+    ]
+    assert bus_scheduler.stats[0].tier_failures == {}
+
+
+def test_slow_address_does_not_slow_down_the_others(clock):
+    fast = ScriptedBattery(clock, [0.05] * 200)
+    slow = ScriptedBattery(clock, [0.05] * 10 + [0.6] * 190)
+    bus_scheduler = make_scheduler({0: fast, 1: slow})
+
+    run(bus_scheduler, clock, 60)
+
+    # two addresses with a P90 of 0.6 s need 1.5 s at 80 % utilization, rounded up to full cycles
+    assert bus_scheduler.stats[0].interval == 1000
+    assert bus_scheduler.stats[1].interval == 1500
+    assert bus_scheduler.stats[1].polls < 40
+
+
+def test_battery_added_later_is_polled(clock):
+    first = ScriptedBattery(clock, [0.1] * 20)
+    later = ScriptedBattery(clock, [0.1] * 20)
+    bus_scheduler = make_scheduler({0: first})
+
+    run(bus_scheduler, clock, 10)
+    helper = ScriptedHelper(later)
+    bus_scheduler.add_battery(1, later, helper)
+    run(bus_scheduler, clock, 20)
+
+    assert helper.poll_stats is bus_scheduler.stats[1]
+    assert bus_scheduler.stats[1].polls >= 9
+    assert later.reads[ReadTier.FAST] == bus_scheduler.stats[1].polls
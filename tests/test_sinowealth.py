@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Requests per poll of the Sinowealth driver with single and batched register reads, replayed from the
+sample capture `tests/captures/sinowealth.jsonl`
+"""
+
+import os
+
+import pytest
+
+import frames
+import serialtrace
+from bms import sinowealth
+from bms.sinowealth import Sinowealth
+from conftest import CAPTURES
+
+SINGLE_REQUESTS = 20
+"""
+Requests of one poll with single reads: 7 status registers, 10 cells and 3 temperatures
+"""
+
+BATCHED_REQUESTS = 9
+"""
+Requests of one poll with batched reads: 7 status registers, one batch of cells and one of temperatures
+"""
+
+
+@pytest.fixture
+def battery() -> Sinowealth:
+    trace = serialtrace.Trace(os.path.join(CAPTURES, "sinowealth.jsonl"))
+    serialtrace.start_replay(trace)
+    battery = Sinowealth(port=trace.port, baud=9600, address=None)
+    assert battery.test_connection()
+    return battery
+
+
+def values(battery: Sinowealth) -> tuple:
+    return (
+        battery.voltage,
+        battery.current,
+        battery.soc,
+        battery.capacity_remain,
+        battery.temp1,
+        battery.history.charge_cycles,
+        battery.charge_fet,
+        battery.discharge_fet,
+        [cell.voltage for cell in battery.cells],
+    )
+
+
+def read_batches(battery: Sinowealth, monkeypatch, reply) -> None:
+    """
+    Replace the replies of the batched requests with `reply(data)`
+    """
+    read = battery.read_serial_data_sinowealth
+
+    def read_register(command, length=Sinowealth.REGISTER_LENGTH):
+        data = read(command, length)
+        return data if length == Sinowealth.REGISTER_LENGTH else reply(data)
+
+    monkeypatch.setattr(battery, "read_serial_data_sinowealth", read_register)
+
+
+def test_requests_per_cycle(battery):
+    battery.batch_read = False
+    assert battery.refresh_data()
+    assert battery.transactions_last_cycle == SINGLE_REQUESTS
+    single = values(battery)
+    assert single[0] == pytest.approx(sum(frames.cell_voltages(10)) / 1000)
+    assert single[-1] == [voltage / 1000 for voltage in frames.cell_voltages(10)]
+
+    battery.batch_read = True
+    # the first batch of the cells and the temperatures is verified with a single read of the last register
+    assert battery.refresh_data()
+    assert battery.transactions_last_cycle == BATCHED_REQUESTS + 2
+    assert values(battery) == single
+    for _ in range(3):
+        assert battery.refresh_data()
+        assert battery.transactions_last_cycle == BATCHED_REQUESTS
+        assert values(battery) == single
+    assert battery.batch_read
+
+
+def test_batch_failures(battery, monkeypatch):
+    now = 1_700_000_000
+    monkeypatch.setattr(sinowealth, "time", lambda: now)
+    failing = True
+    read_batches(battery, monkeypatch, lambda data: False if failing else data)
+
+    battery.batch_read = True
+    # each failed batch falls back to single reads in the same poll
+    assert battery.refresh_data()
+    assert battery.batch_failures == 2
+    assert battery.batch_read
+    cells = [cell.voltage for cell in battery.cells]
+    assert cells == [voltage / 1000 for voltage in frames.cell_voltages(10)]
+
+    # the third failure in a row pauses the batched reads
+    assert battery.refresh_data()
+    assert not battery.batch_read
+    assert battery.refresh_data()
+    assert battery.transactions_last_cycle == SINGLE_REQUESTS
+
+    failing = False
+    now += Sinowealth.BATCH_RETRY_INTERVAL
+    assert battery.refresh_data()
+    assert battery.batch_read
+    assert battery.transactions_last_cycle == BATCHED_REQUESTS + 2
+    assert battery.batch_failures == 0
+
+
+def test_batch_failures_reset(battery, monkeypatch):
+    polls = 0
+    read_batches(battery, monkeypatch, lambda data: False if polls % 2 else data)
+
+    battery.batch_read = True
+    for polls in range(6):
+        assert battery.refresh_data()
+    # failures that are not in a row do not disable the batched reads
+    assert battery.batch_read
+
+
+def test_batch_mismatch(battery, monkeypatch):
+    now = 1_700_000_000
+    monkeypatch.setattr(sinowealth, "time", lambda: now)
+
+    def shift(data):
+        # the last register of the batch is 1 V off
+        data[-3] += 4
+        return data
+
+    read_batches(battery, monkeypatch, shift)
+
+    battery.batch_read = True
+    assert battery.refresh_data()
+    assert not battery.batch_read
+    assert not battery.batch_verified
+
+    now += Sinowealth.BATCH_RETRY_INTERVAL
+    assert battery.refresh_data()
+    # verified again and rejected again
+    assert not battery.batch_read
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy of the current estimators on a replayed current trace, benchmarks of `update()` and `average()`
+and the ring buffer statistics
+"""
+
+import math
+import random
+import time
+
+import pytest
+
+from timeseries import CurrentEstimator, RingBuffer, TimeSeries
+
+pytest.importorskip("pytest_benchmark")
+
+MODES = ["window", "ewma", "time_weighted", "profile"]
+
+WINDOW = 300
+
+HOURLY_CURRENT = [-4] * 5 + [-5, -8, -15, -12, -10, -10, -10, -12, -10, -10, -10, -12]
+HOURLY_CURRENT += [-18, -25, -22, -15, -10, -6, -5]
+"""
+Mean current of each hour of the day of the simulated load in Ampere
+"""
+
+
+def make_trace(days: int, seed: int = 1) -> list:
+    """
+    Current samples of a load that follows `HOURLY_CURRENT` with noise and short peaks. The poll interval
+    is irregular and longer while a peak is drawn, like on a busy bus.
+
+    :return: List of (timestamp, current)
+    """
+    rnd = random.Random(seed)
+    # local midnight, so the hours match the profile
+    start = time.mktime((2024, 7, 1, 0, 0, 0, 0, 0, -1))
+    timestamp = start
+    trace = []
+    while timestamp < start + days * 86400:
+        current = HOURLY_CURRENT[time.localtime(timestamp).tm_hour] * rnd.uniform(
+            0.8, 1.2
+        )
+        if rnd.random() < 0.01:
+            current -= 60
+        trace.append((timestamp, round(current, 2)))
+        timestamp += rnd.uniform(2, 4) if current > -30 else rnd.uniform(10, 20)
+    return trace
+
+
+def exact_mean(trace: list, index: int, window: float) -> float:
+    """
+    Time weighted mean current of the `window` seconds before the sample `index`,
+    each current flows until the next sample
+    """
+    end = trace[index][0]
+    start = max(end - window, trace[0][0])
+    charge = 0
+    while index > 0 and trace[index][0] > start:
+        charge += trace[index - 1][1] * (
+            trace[index][0] - max(trace[index - 1][0], start)
+        )
+        index -= 1
+    return charge / (end - start)
+
+
+def actual_seconds(trace: list, index: int, charge: float) -> float:
+    """
+    Seconds from the sample `index` until `charge` Ah flowed
+    """
+    remaining = charge * 3600
+    for position in range(index, len(trace) - 1):
+        timestamp, current = trace[position]
+        step = current * (trace[position + 1][0] - timestamp)
+        if abs(step) >= abs(remaining):
+            return timestamp - trace[index][0] + remaining / current
+        remaining -= step
+    return None
+
+
+def make_estimator(mode: str) -> CurrentEstimator:
+    return CurrentEstimator(TimeSeries(columns=("current",)), mode, WINDOW)
+
+
+def feed(estimator: CurrentEstimator, timestamp: float, current: float) -> None:
+    # the same order as Battery.add_timeseries_sample()
+    estimator.update(timestamp, current)
+    estimator.timeseries.add(timestamp, current=current)
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+@pytest.fixture(scope="module")
+def trace_day() -> list:
+    return make_trace(1)
+
+
+@pytest.fixture(scope="module")
+def trace_week() -> list:
+    return make_trace(5)
+
+
+@pytest.mark.parametrize(
+    "mode, p95_error",
+    [
+        # the mean of the last samples and the EWMA are not weighted by time,
+        # so the long polls during the peaks are underrepresented
+        ("window", 0.6),
+        ("ewma", 0.6),
+        ("time_weighted", 0.1),
+        ("profile", 0.1),
+    ],
+)
+def test_average_error(trace_day, mode, p95_error):
+    """
+    Relative error of `average()` against the exact time weighted mean current of the window
+    """
+    estimator = make_estimator(mode)
+    errors = []
+    for index, (timestamp, current) in enumerate(trace_day):
+        feed(estimator, timestamp, current)
+        if index % 20 == 0 and timestamp - trace_day[0][0] > 2 * WINDOW:
+            expected = exact_mean(trace_day, index, WINDOW)
+            errors.append(abs(estimator.average() - expected) / abs(expected))
+
+    assert percentile(errors, 95) < p95_error
+    assert sum(errors) / len(errors) < p95_error / 2
+
+
+def test_time_weighted_beats_window(trace_day):
+    errors = {}
+    for mode in ("window", "time_weighted"):
+        estimator = make_estimator(mode)
+        errors[mode] = 0
+        for index, (timestamp, current) in enumerate(trace_day):
+            feed(estimator, timestamp, current)
+            if index % 20 == 0 and timestamp - trace_day[0][0] > 2 * WINDOW:
+                expected = exact_mean(trace_day, index, WINDOW)
+                errors[mode] += abs(estimator.average() - expected)
+
+    assert errors["time_weighted"] < errors["window"] / 5
+
+
+@pytest.mark.parametrize(
+    "mode, mean_error",
+    [
+        ("window", 0.6),
+        ("ewma", 0.6),
+        ("time_weighted", 0.6),
+        # the learned profile follows the changing load of the day
+        ("profile", 0.1),
+    ],
+)
+def test_prediction_error(trace_week, mode, mean_error):
+    """
+    Relative error of the predicted time until 30 Ah are discharged, on the last day of the trace.
+    The profile learns the load of the days before.
+    """
+    estimator = make_estimator(mode)
+    last_day = trace_week[0][0] + 4 * 86400
+    errors = []
+    for index, (timestamp, current) in enumerate(trace_week):
+        feed(estimator, timestamp, current)
+        if timestamp >= last_day and index % 200 == 0:
+            actual = actual_seconds(trace_week, index, -30)
+            if actual is None:
+                break
+            predicted = estimator.predict_seconds(-30, timestamp)
+            errors.append(abs(predicted - actual) / actual)
+
+    assert len(errors) > 10
+    assert sum(errors) / len(errors) < mean_error
+    if mode == "profile":
+        assert estimator.profile_changed
+        assert None not in estimator.profile
+        for hour, current in enumerate(HOURLY_CURRENT):
+            # the peaks of -60 A take about 5 % of the time and add about -3 A to every hour
+            assert estimator.profile[hour] == pytest.approx(current - 3, abs=1.5)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_constant_current(mode):
+    estimator = make_estimator(mode)
+    timestamp = 1_700_000_000
+    for _ in range(200):
+        feed(estimator, timestamp, -10)
+        timestamp += 3
+
+    assert estimator.average() == pytest.approx(-10)
+    assert estimator.predict_seconds(-10, timestamp) == pytest.approx(3600, rel=0.01)
+    # charging is never reached while discharging
+    if mode != "profile":
+        assert estimator.predict_seconds(10, timestamp) is None
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_update_benchmark(benchmark, mode):
+    estimator = make_estimator(mode)
+    samples = iter(make_trace(1))
+
+    def update():
+        estimator.update(*next(samples))
+
+    benchmark.pedantic(update, rounds=10000, iterations=1)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_average_benchmark(benchmark, trace_day, mode):
+    estimator = make_estimator(mode)
+    for timestamp, current in trace_day[:2000]:
+        feed(estimator, timestamp, current)
+
+    assert benchmark(estimator.average) is not None
+
+
+def reference(values: list) -> list:
+    return [value for value in values if value is not None and not math.isnan(value)]
+
+
+def test_ring_buffer_wrap_around():
+    rnd = random.Random(2)
+    buffer = RingBuffer(10)
+    appended = []
+    for position in range(57):
+        value = rnd.uniform(-50, 50)
+        # gaps of missing values, as written for a failed poll
+        if position % 7 in (3, 4):
+            value = None
+        elif position % 11 == 5:
+            value = float("nan")
+        buffer.append(value)
+        appended.append(value)
+
+        valid = reference(appended[-10:])
+        assert len(buffer) == min(position + 1, 10)
+        assert buffer.count() == len(valid)
+        assert buffer.values() == [
+            None if value is None or math.isnan(value) else value
+            for value in appended[-10:]
+        ]
+        assert buffer.min() == min(valid)
+        assert buffer.max() == max(valid)
+        assert buffer.mean() == pytest.approx(sum(valid) / len(valid))
+
+
+def test_ring_buffer_monotonic_values():
+    """
+    Rising and falling values keep the whole buffer in one of the min/max queues
+    """
+    buffer = RingBuffer(5)
+    for value in range(12):
+        buffer.append(value)
+    assert (buffer.min(), buffer.max(), buffer.mean()) == (7, 11, 9)
+    for value in range(12, 0, -1):
+        buffer.append(value)
+    assert (buffer.min(), buffer.max(), buffer.mean()) == (1, 5, 3)
+
+
+def test_ring_buffer_nan():
+    buffer = RingBuffer(4)
+    assert (buffer.min(), buffer.max(), buffer.mean(), buffer.latest()) == (
+        None,
+        None,
+        None,
+        None,
+    )
+
+    for value in (1.0, float("nan"), 3.0, None):
+        buffer.append(value)
+    assert buffer.count() == 2
+    assert (buffer.min(), buffer.max(), buffer.mean()) == (1.0, 3.0, 2.0)
+    assert buffer.latest() is None
+
+    # the valid values expire one after another
+    for _ in range(2):
+        buffer.append(float("nan"))
+    assert (buffer.min(), buffer.max(), buffer.mean()) == (3.0, 3.0, 3.0)
+    buffer.append(None)
+    assert buffer.count() == 0
+    assert (buffer.min(), buffer.max(), buffer.mean()) == (None, None, None)
+    assert buffer.sum() == 0
+
+    buffer.append(-2.5)
+    assert (buffer.min(), buffer.max(), buffer.mean(), buffer.latest()) == (
+        -2.5,
+        -2.5,
+        -2.5,
+        -2.5,
+    )